@@ -0,0 +1,104 @@
+import collections
+import threading
+import time
+
+
+class Backpressure:
+    """High-water marks on queued and stored load, with hysteresis.
+
+    ``check`` is O(1) per gauge and cheap enough to call on every SMTP
+    command. Once a gauge reaches its high-water mark, new mail is refused
+    until it drops back below ``low_ratio`` of the mark, so the state does
+    not flap around the threshold.
+    """
+
+    def __init__(self, low_ratio=0.8):
+        self.low_ratio = low_ratio
+        self._gauges = {}  # name -> (func, high-water mark)
+        self._engaged = set()
+        self._lock = threading.Lock()
+
+    def add(self, name, func, high):
+        self._gauges[name] = (func, high)
+
+    def check(self):
+        """Return the name of the first gauge over its mark, or ``None``."""
+        overloaded = None
+        with self._lock:
+            for name, (func, high) in self._gauges.items():
+                value = func()
+                limit = high * self.low_ratio if name in self._engaged else high
+                if value >= limit:
+                    self._engaged.add(name)
+                    overloaded = overloaded or name
+                else:
+                    self._engaged.discard(name)
+        return overloaded
+
+    def status(self):
+        """Return the current state for the health check endpoint."""
+        reason = self.check()
+        return {
+            'status': 'overloaded' if reason else 'ok',
+            'reason': reason,
+            'gauges': {
+                name: {'value': func(), 'high_water': high}
+                for name, (func, high) in self._gauges.items()
+            },
+        }
+
+
+class RateLimiter:
+    """Token bucket per key (user id, client IP, sender), O(1) per call.
+
+    Each key may take ``burst`` tokens at once, refilled at ``rate`` per
+    second. Buckets idle long enough to have refilled are dropped, and at
+    most ``max_keys`` are kept, least recently used evicted first; either
+    way a key coming back starts with a full bucket. A rate of 0 disables
+    the limiter. Pickles without its buckets, for SMTP worker processes.
+    """
+
+    def __init__(self, rate, burst, max_keys=100000):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys
+        self._idle = self.burst / self.rate if self.rate > 0 else 0
+        self._buckets = collections.OrderedDict()  # key -> [tokens, last update], least recently used first
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'rate': self.rate, 'burst': self.burst, 'max_keys': self.max_keys}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def delay(self, key):
+        """Take a token for ``key``; return 0 if one was available, else seconds until there is."""
+        if self.rate <= 0:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            buckets = self._buckets
+            while buckets:
+                oldest = next(iter(buckets.values()))
+                if now - oldest[1] < self._idle and len(buckets) < self.max_keys:
+                    break
+                buckets.popitem(last=False)
+            bucket = buckets.get(key)
+            if bucket is None:
+                bucket = buckets[key] = [self.burst, now]
+            else:
+                buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / self.rate
+
+    def split(self, parts):
+        """Return a limiter for one of ``parts`` processes, which together allow what this one does."""
+        return RateLimiter(self.rate / parts, max(self.burst / parts, 1), self.max_keys)
+
+    def __len__(self):
+        return len(self._buckets)
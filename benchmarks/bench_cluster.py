@@ -0,0 +1,166 @@
+"""Throughput and failover of several nodes on one host, no outside services.
+
+Starts N node processes sharing a SQLite coordination file. Each node
+joins the cluster, competes for the Telegram lease, serves its ingest
+endpoint and runs SMTP on its own port; delivery only counts messages and
+checks they reached the node owning the address. Client processes send
+mail to random addresses through all nodes round-robin, so most of it is
+passed on to another node. Afterwards the lease holder is killed and the
+time until another node takes the lease is measured.
+
+Usage: python benchmarks/bench_cluster.py [--nodes 1,2,4] [--messages N] [--clients N] [--ttl S]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import smtplib
+import sys
+import tempfile
+import time
+from email.message import EmailMessage
+from email.policy import SMTP
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from coordination import SQLiteCoordinator, Lease  # noqa: E402
+
+DOMAIN = '10mail.xyz'
+SECRET = 'bench'
+BASE_PORT = 12000
+
+
+def build_message(i):
+    rng = random.Random(i)
+    msg = EmailMessage()
+    msg['From'] = f"news{i % 50}@example.com"
+    msg['To'] = f"user{i}@{DOMAIN}"
+    msg['Subject'] = f"Newsletter #{i}"
+    words = ('account', 'update', 'weekly', 'offer', 'security', 'team', 'welcome', 'news')
+    msg.set_content('\n\n'.join(' '.join(rng.choice(words) for _ in range(80)) for _ in range(20)))
+    return msg.as_bytes(policy=SMTP)
+
+
+def run_node(node_id, smtp_port, ingest_port, path, ttl, results, stop_event):
+    import logging
+    from aiosmtpd.controller import Controller
+    from ingest import Ingest, serve_ingest
+    from sharding import Cluster
+    from smtp_server import CustomHandler
+
+    logging.basicConfig(level=logging.WARNING)
+    coordinator = SQLiteCoordinator(path)
+    cluster = Cluster(coordinator, node_id, f"127.0.0.1:{ingest_port}", SECRET, ttl)
+    cluster.start()
+    leader = Lease(coordinator, 'telegram', node_id, ttl)
+    leader.start()
+    counts = {'delivered': 0, 'misrouted': 0}
+
+    def deliver(to_addr, record):
+        counts['delivered'] += 1
+        if not cluster.owns(to_addr):
+            counts['misrouted'] += 1
+
+    ingest = Ingest(deliver, lambda address: True, lambda: None, route=cluster.route)
+    serve_ingest(f"127.0.0.1:{ingest_port}", SECRET, ingest)
+    controller = Controller(
+        CustomHandler([DOMAIN], ingest.deliver, is_live=ingest.is_live),
+        hostname='127.0.0.1', port=smtp_port
+    )
+    controller.start()
+    results.put(('ready', node_id))
+    stop_event.wait()
+    controller.stop()
+    results.put(('done', node_id, counts))
+    cluster.stop()
+    leader.stop()
+
+
+def run_client(ports, start, count, sent):
+    connections = [smtplib.SMTP('127.0.0.1', port) for port in ports]
+    for i in range(start, start + count):
+        connections[i % len(connections)].sendmail('news@example.com', [f"user{i}@{DOMAIN}"], build_message(i))
+    for connection in connections:
+        connection.quit()
+    sent.put(count)
+
+
+def run(nodes, args):
+    context = multiprocessing.get_context('spawn')
+    path = os.path.join(tempfile.mkdtemp(), 'coordination.db')
+    SQLiteCoordinator(path)
+    results = context.Queue()
+    stop_events = {}
+    processes = {}
+    for n in range(nodes):
+        node_id = f"node{n}"
+        stop_events[node_id] = context.Event()
+        processes[node_id] = context.Process(
+            target=run_node,
+            args=(node_id, BASE_PORT + n, BASE_PORT + 100 + n, path, args.ttl, results, stop_events[node_id]),
+            daemon=True
+        )
+        processes[node_id].start()
+    for _ in range(nodes):
+        results.get(timeout=30)
+    # Let every node see every other one
+    time.sleep(args.ttl / 3 + 1)
+
+    ports = [BASE_PORT + n for n in range(nodes)]
+    sent = context.Queue()
+    per_client = args.messages // args.clients
+    clients = [
+        context.Process(target=run_client, args=(ports, c * per_client, per_client, sent))
+        for c in range(args.clients)
+    ]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    total = sum(sent.get(timeout=600) for _ in clients)
+    elapsed = time.perf_counter() - started
+
+    # Kill the lease holder and time the takeover
+    coordinator = SQLiteCoordinator(path)
+    holder = coordinator.leases('telegram').get('telegram', (None,))[0]
+    takeover = None
+    if nodes > 1 and holder in processes:
+        processes[holder].kill()
+        killed = time.perf_counter()
+        while takeover is None and time.perf_counter() - killed < args.ttl * 3:
+            current = coordinator.leases('telegram').get('telegram', (None,))[0]
+            if current not in (None, holder):
+                takeover = time.perf_counter() - killed
+            time.sleep(0.05)
+        del processes[holder]
+
+    delivered = misrouted = 0
+    for node_id in processes:
+        stop_events[node_id].set()
+    for _ in processes:
+        _, node_id, counts = results.get(timeout=30)
+        delivered += counts['delivered']
+        misrouted += counts['misrouted']
+    for process in processes.values():
+        process.join(5)
+
+    line = f"{nodes} node(s): {total / elapsed:7.0f} msg/s ({total} messages, {args.clients} clients)"
+    if nodes > 1:
+        line += f", lease takeover after {takeover:.1f}s" if takeover is not None else ", no lease takeover"
+        line += f", {misrouted} misrouted" if misrouted else ""
+    print(line)
+    return delivered
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nodes', default='1,2,4', help='comma-separated node counts to run')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--ttl', type=float, default=3, help='lease TTL in seconds')
+    args = parser.parse_args()
+    for nodes in (int(n) for n in args.nodes.split(',')):
+        run(nodes, args)
+
+
+if __name__ == '__main__':
+    main()
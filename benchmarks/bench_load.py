@@ -0,0 +1,202 @@
+"""Offline load test of the mail-to-Telegram path.
+
+Runs CustomHandler under an aiosmtpd Controller on an ephemeral port,
+replaces the Telegram Bot API with a local stub that can add latency and
+answer with 429s, and drives concurrent SMTP clients sending multipart
+messages. Reports accepted messages/sec, accept and notify latency
+percentiles, and RSS per 10k active inboxes.
+
+Usage: python benchmarks/bench_load.py [--messages N] [--clients N] [--inboxes N]
+                                       [--latency MS] [--error-rate P] [--rate N] [--coalesce S]
+"""
+import argparse
+import itertools
+import logging
+import os
+import random
+import smtplib
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import EmailMessage
+from email.policy import SMTP
+
+import psutil
+from aiosmtpd.controller import Controller
+from telegram.error import RetryAfter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bot  # noqa: E402
+from notifier import Notifier  # noqa: E402
+from smtp_server import CustomHandler, parse_email  # noqa: E402
+
+
+class StubMessage:
+    __slots__ = ('chat_id', 'message_id')
+
+    def __init__(self, chat_id, message_id):
+        self.chat_id = chat_id
+        self.message_id = message_id
+
+
+class StubBot:
+    """Stands in for telegram.Bot: records send_message calls."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.sent = 0
+        self.edited = 0
+        self.rate_limited = 0
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, parse_mode=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if random.random() < self.error_rate:
+                self.rate_limited += 1
+                raise RetryAfter(self.retry_after)
+            self.sent += 1
+        return StubMessage(chat_id, next(self._ids))
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, parse_mode=None, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.edited += 1
+        return StubMessage(chat_id, message_id)
+
+
+def build_message(to_addr, i):
+    msg = EmailMessage()
+    msg['From'] = 'noreply@example.com'
+    msg['To'] = to_addr
+    msg['Subject'] = f'Your verification code #{i}'
+    msg['Date'] = 'Mon, 06 May 2024 10:00:00 +0000'
+    msg.set_content(f'Hello,\n\nYour verification code is {i:06d}.\n\n' + 'Thanks for signing up.\n' * 40)
+    msg.add_alternative(f'<p>Hello,</p><p>Your verification code is <b>{i:06d}</b>.</p>\n' * 10, subtype='html')
+    msg.add_attachment(os.urandom(16 * 1024), maintype='application', subtype='pdf', filename='invoice.pdf')
+    return msg.as_bytes(policy=SMTP)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def run_client(port, jobs, accept_latencies):
+    client = smtplib.SMTP('127.0.0.1', port)
+    try:
+        for to_addr, raw in jobs:
+            start = time.perf_counter()
+            client.sendmail('noreply@example.com', [to_addr], raw)
+            accept_latencies.append(time.perf_counter() - start)
+    finally:
+        client.quit()
+
+
+def load_test(args):
+    stub = StubBot(args.latency / 1000, args.error_rate)
+    notify_latencies = []
+
+    def on_sent(job, sent_msg):
+        notify_latencies.append(time.time() - job.accepted_at)
+        bot.track_notification(job, sent_msg)
+
+    bot.notifier = Notifier(
+        workers=bot.NOTIFY_WORKERS, global_rate=args.rate, on_sent=on_sent,
+        coalesce_window=args.coalesce, max_digest=bot.NOTIFY_DIGEST_MAX
+    )
+    bot.notifier.start(stub)
+
+    # One address per chat so per-chat spacing does not dominate
+    addresses = [bot.assign_address(1000 + i) for i in range(args.recipients)]
+    jobs = [(addresses[i % len(addresses)], build_message(addresses[i % len(addresses)], i))
+            for i in range(args.messages)]
+
+    port = free_port()
+    handler = CustomHandler(
+        bot.DOMAINS, bot.deliver_email, bot.MAIL_PARSE_MODE,
+        overloaded=bot.backpressure.check, is_live=bot.user_emails.is_live
+    )
+    controller = Controller(handler, hostname='127.0.0.1', port=port, data_size_limit=bot.MAX_MESSAGE_SIZE)
+    controller.start()
+
+    accept_latencies = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as pool:
+        futures = [pool.submit(run_client, port, jobs[c::args.clients], accept_latencies)
+                   for c in range(args.clients)]
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+    deadline = time.time() + 60
+    while bot.notifier.pending() and time.time() < deadline:
+        time.sleep(0.05)
+    time.sleep(args.latency / 1000 + 0.1)
+    notify_elapsed = time.perf_counter() - start
+    controller.stop()
+    bot.notifier.stop()
+
+    print(f"accepted:        {len(accept_latencies)} messages from {args.clients} clients in {elapsed:.2f}s "
+          f"({len(accept_latencies) / elapsed:.0f} msg/s)")
+    print(f"accept latency:  p50 {percentile(accept_latencies, 50) * 1000:.1f} ms, "
+          f"p99 {percentile(accept_latencies, 99) * 1000:.1f} ms")
+    print(f"notified:        {stub.sent} sent + {stub.edited} edited in {notify_elapsed:.2f}s, "
+          f"{stub.rate_limited} 429s injected")
+    print(f"notify latency:  p50 {percentile(notify_latencies, 50) * 1000:.1f} ms, "
+          f"p99 {percentile(notify_latencies, 99) * 1000:.1f} ms")
+
+
+def inbox_memory(args):
+    """RSS growth while filling ``args.inboxes`` inboxes with one message each."""
+    class Envelope:
+        mail_from = 'noreply@example.com'
+        rcpt_tos = ['placeholder@10mail.xyz']
+        content = build_message('placeholder@10mail.xyz', 0)
+
+    _, record = parse_email(Envelope, bot.MAIL_PARSE_MODE)
+    process = psutil.Process()
+    before = process.memory_info().rss
+    for i in range(args.inboxes):
+        address = bot.assign_address(10 ** 7 + i)
+        bot.storage.add_email(address, dict(record))
+    used = process.memory_info().rss - before
+    print(f"inbox memory:    {used / args.inboxes * 10000 / 1024 / 1024:.1f} MiB RSS per 10k active inboxes "
+          f"({args.inboxes} inboxes, {bot.MAIL_PARSE_MODE} parsing)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--clients', type=int, default=20)
+    parser.add_argument('--recipients', type=int, default=500, help='distinct addresses/chats receiving mail')
+    parser.add_argument('--inboxes', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=20, help='stub Bot API latency in ms')
+    parser.add_argument('--error-rate', type=float, default=0.01, help='fraction of sends answered with 429')
+    parser.add_argument('--coalesce', type=float, default=bot.NOTIFY_COALESCE_SECONDS,
+                        help='notification coalescing window in seconds, 0 to disable')
+    parser.add_argument('--rate', type=float, default=1000,
+                        help='global send rate; Telegram allows about 30/s')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    load_test(args)
+    inbox_memory(args)
+
+
+if __name__ == '__main__':
+    main()
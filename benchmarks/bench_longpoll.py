@@ -0,0 +1,68 @@
+"""Wake-up latency and idle cost of inbox API long-poll requests.
+
+Parks WAITERS threads in InboxAPI.get on distinct addresses of the
+in-memory backend, measures the CPU time the process uses while they
+idle, then stores one message at a time for a waiting address and times
+from add_email to the waiter returning its response.
+
+Usage: python benchmarks/bench_longpoll.py [waiters] [messages]
+"""
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from longpoll import InboxWaiters, InboxAPI, address_token  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+from tracking import MessageTracker  # noqa: E402
+
+SECRET = b'bench'
+IDLE_SECONDS = 2
+
+
+def record(i):
+    return {'subject': f"Code #{i}", 'from': 'noreply@example.com', 'date': 'now',
+            'body': f"Your verification code is {100000 + i}", 'received': time.time()}
+
+
+def main():
+    waiters_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    messages = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    threading.stack_size(256 * 1024)
+    waiters = InboxWaiters()
+    storage = MemoryStorage({}, MessageTracker(), on_change=waiters.notify)
+    api = InboxAPI(storage, waiters, lambda address: True, SECRET, max_wait=600, max_waiters=waiters_count + 1)
+    returned = {}
+
+    def poll(address):
+        api.get(address, address_token(SECRET, address), 0, 600)
+        returned[address] = time.perf_counter()
+
+    addresses = [f"user{i}@10mail.xyz" for i in range(waiters_count)]
+    threads = [threading.Thread(target=poll, args=(address,), daemon=True) for address in addresses]
+    for thread in threads:
+        thread.start()
+    while len(waiters) < waiters_count:
+        time.sleep(0.01)
+
+    cpu = time.process_time()
+    time.sleep(IDLE_SECONDS)
+    idle_cpu = (time.process_time() - cpu) / IDLE_SECONDS
+
+    latencies = []
+    for i, (address, thread) in enumerate(zip(addresses[:messages], threads)):
+        stored = time.perf_counter()
+        storage.add_email(address, record(i))
+        thread.join()
+        latencies.append((returned[address] - stored) * 1000)
+    latencies.sort()
+    print(f"{waiters_count} idle waiters: {idle_cpu * 100:.2f}% of a CPU")
+    print(f"store -> response over {len(latencies)} messages: p50 {statistics.median(latencies):.3f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
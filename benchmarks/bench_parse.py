@@ -0,0 +1,66 @@
+"""Compare full MIME parsing with lazy header-first parsing.
+
+Usage: python benchmarks/bench_parse.py [attachment_mb] [repeat]
+"""
+import os
+import sys
+import time
+import tracemalloc
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mailparse  # noqa: E402
+
+
+def build_message(attachment_mb):
+    msg = EmailMessage()
+    msg['From'] = 'sender@example.com'
+    msg['To'] = 'abcdefghij@10mail.xyz'
+    msg['Subject'] = 'Your report is ready'
+    msg['Date'] = 'Mon, 06 May 2024 10:00:00 +0000'
+    msg.set_content('Hello,\n\nYour verification code is 123456.\n' * 20)
+    msg.add_alternative('<p>Hello,</p><p>Your verification code is <b>123456</b>.</p>' * 20, subtype='html')
+    chunk = os.urandom(256 * 1024)
+    for i in range(max(1, attachment_mb * 4)):
+        msg.add_attachment(chunk, maintype='application', subtype='octet-stream', filename=f'part{i}.bin')
+    return msg.as_bytes()
+
+
+def full(raw):
+    msg = mailparse.parse_full(raw)
+    return msg.get('subject'), mailparse.text_body(msg)
+
+
+def lazy(raw):
+    msg, body = mailparse.parse_preview(raw)
+    return msg.get('subject'), body
+
+
+def measure(func, raw, repeat):
+    func(raw)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(raw)
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    func(raw)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    attachment_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    raw = build_message(attachment_mb)
+    assert full(raw)[1].startswith(lazy(raw)[1])
+
+    print(f"message size: {len(raw) / 1024 / 1024:.1f} MiB, {attachment_mb * 4} attachments")
+    for name, func in (('full', full), ('lazy', lazy)):
+        elapsed, peak = measure(func, raw, repeat)
+        print(f"{name:>5}: {elapsed * 1000:8.2f} ms/message  peak {peak / 1024:10.1f} KiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Push delivery throughput, batching and isolation of slow targets.
+
+Serves two local HTTP/1.1 endpoints, a fast one and one answering after
+--slow-ms, and queues MESSAGES for each through a Pusher. Reports
+messages/sec and messages per request for each target, the
+connections each one saw (keep-alive reuse), and how long the fast
+target took while the slow one was backlogged.
+
+Usage: python benchmarks/bench_push.py [--messages N] [--slow-ms MS] [--workers N] [--in-flight N]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from push import Pusher  # noqa: E402
+
+
+def serve(delay):
+    stats = {'requests': 0, 'messages': 0, 'connections': set(), 'done': None}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            time.sleep(delay)
+            with lock:
+                stats['requests'] += 1
+                stats['messages'] += len(body['messages'])
+                stats['connections'].add(self.client_address)
+                stats['done'] = time.perf_counter()
+            self.send_response(204)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}/hook", stats
+
+
+def record(i):
+    return {'subject': f"Code #{i}", 'from': 'noreply@example.com', 'date': 'now',
+            'body': f"Your verification code is {100000 + i}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--slow-ms', type=float, default=200)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--in-flight', type=int, default=2)
+    args = parser.parse_args()
+
+    targets = {'fast': serve(0), 'slow': serve(args.slow_ms / 1000)}
+    pusher = Pusher(lambda r: dict(r), workers=args.workers, max_in_flight=args.in_flight,
+                    max_queue=args.messages, allow_private=True)
+    pusher.start()
+    started = time.perf_counter()
+    for i in range(args.messages):
+        for url, _ in targets.values():
+            pusher.enqueue(url, f"user{i % 100}@10mail.xyz", record(i))
+    while any(stats['messages'] < args.messages for _, stats in targets.values()):
+        time.sleep(0.01)
+    pusher.stop()
+    for name, (_, stats) in targets.items():
+        elapsed = stats['done'] - started
+        print(f"{name}: {stats['messages'] / elapsed:7.0f} msg/s, done after {elapsed:.2f}s, "
+              f"{stats['messages'] / stats['requests']:.1f} messages/request, "
+              f"{len(stats['connections'])} connection(s)")
+
+
+if __name__ == '__main__':
+    main()
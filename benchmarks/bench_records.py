@@ -0,0 +1,71 @@
+"""Memory per stored message: parsed dict records vs compact StoredEmail records.
+
+Usage: python benchmarks/bench_records.py [count]
+"""
+import os
+import random
+import sys
+import tracemalloc
+from email.message import EmailMessage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import StoredEmail  # noqa: E402
+from smtp_server import parse_email  # noqa: E402
+
+SENDERS = [f"noreply@service{i}.example.com" for i in range(200)]
+WORDS = ('account', 'update', 'weekly', 'offer', 'security', 'team', 'welcome', 'news', 'order', 'shipped')
+
+
+class Envelope:
+    rcpt_tos = ['abcdefghij@10mail.xyz']
+
+    def __init__(self, mail_from, content):
+        self.mail_from = mail_from
+        self.content = content
+
+
+def build_envelope(i, rng):
+    sender = rng.choice(SENDERS)
+    msg = EmailMessage()
+    msg['From'] = sender
+    msg['To'] = 'abcdefghij@10mail.xyz'
+    msg['Subject'] = f"Your {rng.choice(WORDS)} {rng.choice(WORDS)} #{i}"
+    msg['Date'] = 'Mon, 06 May 2024 10:00:00 +0000'
+    if i % 3:
+        # Verification mails: a short body
+        msg.set_content(f"Your verification code is {rng.randrange(10 ** 6):06d}.\nIt expires in 10 minutes.\n")
+    else:
+        # Newsletters: several KB of text
+        paragraphs = (' '.join(rng.choice(WORDS) for _ in range(80)) for _ in range(rng.randrange(5, 30)))
+        msg.set_content('\n\n'.join(paragraphs))
+    return Envelope(sender, msg.as_bytes())
+
+
+def fill(count, compact):
+    rng = random.Random(1)
+    records = []
+    for i in range(count):
+        _, record = parse_email(build_envelope(i, rng))
+        records.append(StoredEmail(record) if compact else record)
+    return records
+
+
+def measure(count, compact):
+    tracemalloc.start()
+    records = fill(count, compact)
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del records
+    return current
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for name, compact in (('dict', False), ('StoredEmail', True)):
+        used = measure(count, compact)
+        print(f"{name:>11}: {used / count:8.0f} B/message ({used / 1024 / 1024:.1f} MiB for {count})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""Cold-start time and baseline RSS of each process role.
+
+Each sample is a fresh interpreter that imports what the role needs
+(``serve.load``) and reports its time from interpreter start and its peak
+RSS; nothing is started, so no token or network is needed. ``all`` also
+imports the modules it loads lazily when it starts its web and SMTP
+threads, which is what every process imported before roles existed.
+
+Usage: python benchmarks/bench_startup.py [repeat]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROLES = ('web', 'smtp', 'bot', 'all')
+
+CHILD = '''
+import json, resource, sys, time
+import serve
+serve.load(sys.argv[1])
+if sys.argv[1] == 'all':
+    import web, smtp_server, aiosmtpd.controller  # noqa: F401
+elapsed = time.time() - float(sys.argv[2])
+modules = len(sys.modules)
+print(json.dumps([elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, modules]))
+'''
+
+
+def sample(role):
+    started = time.time()
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, role, repr(started)],
+        cwd=ROOT, capture_output=True, text=True, check=True,
+        env=dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    print(f"{'role':>5}  {'start ms':>9}  {'RSS MiB':>8}  {'modules':>7}")
+    for role in ROLES:
+        samples = [sample(role) for _ in range(repeat)]
+        elapsed = statistics.median(s[0] for s in samples)
+        rss = statistics.median(s[1] for s in samples)
+        print(f"{role:>5}  {elapsed * 1000:9.0f}  {rss / 1024:8.1f}  {samples[0][2]:7d}")
+
+
+if __name__ == '__main__':
+    main()
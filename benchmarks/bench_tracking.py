@@ -0,0 +1,51 @@
+"""Memory used per million tracked messages: plain dicts vs MessageTracker.
+
+Usage: python benchmarks/bench_tracking.py [count]
+"""
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tracking import MessageTracker  # noqa: E402
+
+TYPES = ('email_notification', 'inbox_view', 'help', 'stats')
+
+
+def fill_dict(count):
+    tracking = {}
+    for i in range(count):
+        tracking[i] = {
+            'chat_id': 100000000 + i % 5000,
+            'type': TYPES[i % len(TYPES)],
+            'email': f"user{i % 5000:05d}@10mail.xyz"
+        }
+    return tracking
+
+
+def fill_tracker(count):
+    tracker = MessageTracker(max_entries=count, ttl=10 ** 9)
+    for i in range(count):
+        tracker.track(100000000 + i % 5000, i, TYPES[i % len(TYPES)], f"user{i % 5000:05d}@10mail.xyz")
+    return tracker
+
+
+def measure(fill, count):
+    tracemalloc.start()
+    result = fill(count)
+    current = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    for name, fill in (('dict', fill_dict), ('MessageTracker', fill_tracker)):
+        used = measure(fill, count)
+        print(f"{name:>14}: {used / count * 1000000 / 1024 / 1024:8.1f} MiB per million ({used / count:.0f} B/entry)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import hashlib
+import math
+import multiprocessing
+
+
+class CountingBloomFilter:
+    """Counting Bloom filter in shared memory, for SMTP worker processes.
+
+    The bot process adds and discards addresses as they are assigned and
+    released; worker processes only test membership, so they can reject
+    unknown recipients without asking the bot process. There are no false
+    negatives, and false positives (about ``error_rate``) are caught when
+    the message is delivered.
+    """
+
+    def __init__(self, capacity=1000000, error_rate=0.01, context=None):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        context = context or multiprocessing.get_context('spawn')
+        # One byte per counter, written only by the owning process
+        self._counters = context.RawArray('B', self.size)
+
+    def _indexes(self, address):
+        digest = hashlib.blake2b(address.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, address):
+        counters = self._counters
+        for i in self._indexes(address):
+            if counters[i] < 255:
+                counters[i] += 1
+
+    def discard(self, address):
+        counters = self._counters
+        for i in self._indexes(address):
+            # A saturated counter no longer knows its count, so it stays set
+            if 0 < counters[i] < 255:
+                counters[i] -= 1
+
+    def __contains__(self, address):
+        counters = self._counters
+        return all(counters[i] for i in self._indexes(address))
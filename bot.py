@@ -3,23 +3,50 @@ import logging
 import random
 import string
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatPermissions
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext, CallbackQueryHandler
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, CallbackContext, CallbackQueryHandler, JobQueue, ExtBot
+from telegram.utils.request import Request
+from telegram.error import TelegramError
 from datetime import datetime, timedelta
 import pytz
-from flask import Flask
 import threading
 import sys
 import atexit
 import signal
-import email
-from email import policy
 import json
+import collections
 import time
-import psutil
-import requests
-from aiosmtpd.controller import Controller
 import asyncio
 import socket
+import html
+import mmap
+from registry import AddressRegistry
+from notifier import Notifier
+import mailparse
+from storage import MemoryStorage, SQLiteStorage
+from records import as_dict
+from spool import AttachmentSpool
+from search import SearchIndex
+from groups import ChatMessageCache, DeleteSweeper
+from preview import preview_of
+from expiry import ExpiryScheduler
+from tracking import MessageTracker
+from inbox import InboxRenderer
+from longpoll import InboxWaiters, InboxAPI, address_token, message_json
+from push import Pusher, check_url
+import webhook
+import ingest
+from settings import (
+    WEBHOOK_SECRET, UPDATE_QUEUE_ADDRESS, MAIL_QUEUE_ADDRESS, MAIL_QUEUE_SECRET, MAIL_QUEUE_TIMEOUT, EMAIL_HOST,
+    EMAIL_PORT, DOMAINS, MAIL_PARSE_MODE, SMTP_WORKERS, MAX_MESSAGE_SIZE, STORAGE_BACKEND, STORAGE_PATH, SPOOL_DIR, METRICS_PORT,
+    SMTP_CLIENT_RATE_PER_MINUTE, SMTP_CLIENT_BURST, SMTP_SENDER_RATE_PER_MINUTE, SMTP_SENDER_BURST
+)
+from dispatch import ShardedDispatcher
+import metrics
+from admission import Backpressure, RateLimiter
+from coordination import SQLiteCoordinator, Lease
+from sharding import Cluster, LOCAL_PART_LENGTH, address_tag
+from bloom import CountingBloomFilter
+from queue import Queue
 
 # Configure logging
 logging.basicConfig(
@@ -28,94 +55,363 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Create Flask app
-app = Flask(__name__)
+# Update delivery: 'polling' or 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+
+# Leases replace the single-instance lock file: one node polls Telegram at a time
+COORDINATION_PATH = os.getenv('COORDINATION_PATH', '/tmp/tempmail-coordination.db')
+LEASE_TTL = int(os.getenv('LEASE_TTL_SECONDS', 15))
+# Set on every instance to shard addresses and users across them; nodes reach each other at MAIL_QUEUE_ADDRESS
+NODE_ID = os.getenv('NODE_ID', '')
+
+# SMTP worker settings
+LIVE_ADDRESS_CAPACITY = int(os.getenv('LIVE_ADDRESS_CAPACITY', 1000000))  # Sizes the SMTP workers' Bloom filter
+
+# Handler threads; updates of one user always go to the same thread
+DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', 8))
+
+# Inbox rendering settings
+SEARCH_MAX_POSTINGS = int(os.getenv('SEARCH_MAX_POSTINGS', 2000000))  # Bounds search index memory
+INBOX_PAGE_SIZE = int(os.getenv('INBOX_PAGE_SIZE', 5))
+
+# Notification delivery settings
+NOTIFY_WORKERS = int(os.getenv('NOTIFY_WORKERS', 4))
+NOTIFY_COALESCE_SECONDS = float(os.getenv('NOTIFY_COALESCE_SECONDS', 10))  # 0 sends one message per email
+NOTIFY_DIGEST_MAX = int(os.getenv('NOTIFY_DIGEST_MAX', 10))
+
+# Push delivery to URLs set with /forward
+PUSH_WORKERS = int(os.getenv('PUSH_WORKERS', 4))
+PUSH_MAX_IN_FLIGHT = int(os.getenv('PUSH_MAX_IN_FLIGHT', 2))  # Concurrent requests per URL
+PUSH_MAX_BATCH = int(os.getenv('PUSH_MAX_BATCH', 20))  # Messages per request when a URL falls behind
+PUSH_MAX_QUEUE = int(os.getenv('PUSH_MAX_QUEUE', 1000))  # Messages held per URL; the oldest are dropped
+PUSH_TIMEOUT = float(os.getenv('PUSH_TIMEOUT_SECONDS', 10))
+PUSH_ALLOW_PRIVATE = os.getenv('PUSH_ALLOW_PRIVATE', '') == '1'  # Allow URLs on loopback and private networks
+
+# Attachment downloads
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024  # Bot API limit for sending files
+SPOOL_SWEEP_INTERVAL = 3600
+
+# Expiry settings
+ADDRESS_TTL = int(os.getenv('ADDRESS_TTL_HOURS', 24)) * 3600
+MAX_INBOX_MESSAGES = int(os.getenv('MAX_INBOX_MESSAGES', 50))
+MEMORY_BUDGET_MB = int(os.getenv('MEMORY_BUDGET_MB', 256))
+
+# Admission control: above these marks SMTP answers 451 so senders retry later
+STORED_HIGH_WATER_MB = int(os.getenv('STORED_HIGH_WATER_MB', MEMORY_BUDGET_MB * 9 // 10))
+PENDING_HIGH_WATER = int(os.getenv('PENDING_HIGH_WATER', 10000))
 
-# Lock file path
-LOCK_FILE = '/tmp/telegram_bot.lock'
+# New addresses per user from /newmail, /tempmaill and the New Email button; a rate of 0 disables the limit
+NEWMAIL_RATE_PER_MINUTE = float(os.getenv('NEWMAIL_RATE_PER_MINUTE', 2))
+NEWMAIL_BURST = int(os.getenv('NEWMAIL_BURST', 5))
 
-# Email server settings
-EMAIL_HOST = '0.0.0.0'
-EMAIL_PORT = 25
-DOMAINS = ['10mail.xyz', 'emlhub.com', 'tempmail.plus', 'tempmail.space']
+# Message tracking settings
+TRACKING_MAX_ENTRIES = int(os.getenv('TRACKING_MAX_ENTRIES', 100000))
+TRACKING_TTL = int(os.getenv('TRACKING_TTL_HOURS', 48)) * 3600
+
+# Group chat settings
+GROUP_CACHE_MESSAGES = int(os.getenv('GROUP_CACHE_MESSAGES', 200))  # Recent texts kept per group for edits
+GROUP_CACHE_CHATS = int(os.getenv('GROUP_CACHE_CHATS', 10000))
+GROUP_NOTICE_TTL = int(os.getenv('GROUP_NOTICE_TTL', 60))  # Seconds before edit notices are deleted
+DELETE_SWEEP_INTERVAL = 5
+
+# Inbox API (GET /api/inbox/<address>); tokens are derived from API_SECRET, a random one per run if unset
+API_SECRET = os.getenv('API_SECRET', '').encode() or os.urandom(32)
+API_BASE_URL = os.getenv('API_BASE_URL', '')  # Shown in /api replies
+API_MAX_WAIT = int(os.getenv('API_MAX_WAIT_SECONDS', 60))
+API_MAX_WAITERS = int(os.getenv('API_MAX_WAITERS', 1000))
+API_PORT = int(os.getenv('API_PORT', 0))  # Serves the API from role 'bot', which has no web server otherwise
 
 # Store emails and user sessions
 emails = {}
-user_emails = {}
+user_emails = AddressRegistry()  # address <-> user index
 user_stats = {}
-message_tracking = {}  # Track bot messages for editing/deleting
+forward_urls = {}  # address -> URL its mail is pushed to
+message_tracking = MessageTracker(TRACKING_MAX_ENTRIES, TRACKING_TTL)  # Track bot messages for editing/deleting
+spool = AttachmentSpool(SPOOL_DIR, NODE_ID or 'main')  # Attachments on disk, deduplicated by content hash
+group_messages = ChatMessageCache(GROUP_CACHE_MESSAGES, GROUP_CACHE_CHATS)
+delete_sweeper = DeleteSweeper()  # Deletes expired group notices, rate limited
+search_index = SearchIndex(
+    SEARCH_MAX_POSTINGS, loader=lambda address, install: storage.with_emails(address, install)
+)
+inbox_waiters = InboxWaiters()  # Inbox API requests waiting for new mail
+storage = MemoryStorage(
+    emails, message_tracking, MAX_INBOX_MESSAGES, MEMORY_BUDGET_MB * 1024 * 1024, spool, search_index,
+    on_change=inbox_waiters.notify
+)
+
+def configure_storage():
+    """Select the storage backend and restore state saved by a previous run."""
+    global storage
+    if STORAGE_BACKEND == 'sqlite':
+        storage = SQLiteStorage(
+            STORAGE_PATH, MAX_INBOX_MESSAGES, TRACKING_TTL, spool=spool, index=search_index,
+            on_change=inbox_waiters.notify, tracking_max_entries=TRACKING_MAX_ENTRIES
+        )
+        logger.info(f"Using SQLite storage at {STORAGE_PATH}")
+    spool.rebuild(storage.attachments())
+    # Saved inboxes are indexed when first searched
+    search_index.mark_stale(storage.inbox_addresses())
+    restore_state()
+
+def restore_state():
+    """Take over saved addresses, inboxes, stats and push URLs that this node owns but does not hold.
+
+    At startup that is everything it owns. After cluster members change,
+    with a database shared by the nodes, it is what a node that left held.
+    """
+    addresses, stats = storage.load()
+    for user_id, address, assigned in addresses:
+        if (cluster is None or cluster.owns(address)) and user_id not in user_emails.owners(address):
+            user_emails.assign(user_id, address)
+            expiry.schedule(address, max(assigned + ADDRESS_TTL, expiry.deadline(address) or 0))
+    for address, received in storage.inbox_times().items():
+        if expiry.deadline(address) is None and (cluster is None or cluster.owns(address)):
+            # Inboxes of released addresses outlive them until an expiry that was only kept in memory
+            expiry.schedule(address, received + ADDRESS_TTL)
+    for user_id, entry in stats.items():
+        if (cluster is None or cluster.owns(user_id)) and user_id not in user_stats:
+            user_stats[user_id] = entry
+    for address, url in storage.forwards().items():
+        if address in forward_urls:
+            continue
+        if user_emails.owners(address):
+            forward_urls[address] = url
+        elif cluster is None or cluster.owns(address):
+            storage.delete_forward(address)
+
+def expire_address(address):
+    """Drop an expired address, its inbox and the stats of owners left without an address."""
+    for user_id in user_emails.release_address(address):
+        storage.delete_address(user_id, address)
+        if user_id not in user_emails:
+            user_stats.pop(user_id, None)
+            storage.delete_stats(user_id)
+    storage.delete_inbox(address)
+    drop_forward(address)
+    logger.info(f"Expired {address}")
 
-class CustomHandler:
-    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
-        if not address.endswith(tuple(DOMAINS)):
-            return '550 not relaying to that domain'
-        envelope.rcpt_tos.append(address)
-        return '250 OK'
+expiry = ExpiryScheduler(expire_address)
 
-    async def handle_DATA(self, server, session, envelope):
+def assign_address(user_id):
+    """Give a new random address to a user and persist the assignment."""
+    address = generate_email(user_id)
+    storage.save_address(user_id, address)
+    expiry.schedule(address, time.time() + ADDRESS_TTL)
+    return address
+
+def release_address(user_id):
+    """Release the current address of a user."""
+    address = user_emails.release(user_id)
+    if address:
+        storage.delete_address(user_id, address)
+        if not user_emails.owners(address):
+            drop_forward(address)
+    return address
+
+def drop_forward(address):
+    """Stop pushing mail for an address."""
+    if forward_urls.pop(address, None):
+        storage.delete_forward(address)
+
+def track_message(sent_msg, msg_type, **fields):
+    """Track a bot message for editing/deleting."""
+    storage.track_message(sent_msg.chat_id, sent_msg.message_id, msg_type, **fields)
+
+def track_notification(job, sent_msg):
+    """Record a delivered email notification."""
+    metrics.NOTIFY_LATENCY_SECONDS.observe(time.time() - job.accepted_at)
+    track_message(sent_msg, 'email_notification', email=job.email)
+
+notifier = Notifier(
+    workers=NOTIFY_WORKERS,
+    on_sent=track_notification,
+    coalesce_window=NOTIFY_COALESCE_SECONDS,
+    max_digest=NOTIFY_DIGEST_MAX
+)
+
+pusher = Pusher(
+    lambda record: message_json(record, message_body),
+    workers=PUSH_WORKERS,
+    max_in_flight=PUSH_MAX_IN_FLIGHT,
+    max_batch=PUSH_MAX_BATCH,
+    max_queue=PUSH_MAX_QUEUE,
+    timeout=PUSH_TIMEOUT,
+    allow_private=PUSH_ALLOW_PRIVATE
+)
+
+backpressure = Backpressure()
+backpressure.add('stored_bytes', lambda: storage.memory_used(), STORED_HIGH_WATER_MB * 1024 * 1024)
+backpressure.add('pending_notifications', lambda: notifier.pending(), PENDING_HIGH_WATER)
+inbox_renderer = InboxRenderer(page_size=INBOX_PAGE_SIZE)
+new_address_limit = RateLimiter(NEWMAIL_RATE_PER_MINUTE / 60, NEWMAIL_BURST)
+smtp_client_limit = RateLimiter(SMTP_CLIENT_RATE_PER_MINUTE / 60, SMTP_CLIENT_BURST)
+smtp_sender_limit = RateLimiter(SMTP_SENDER_RATE_PER_MINUTE / 60, SMTP_SENDER_BURST)
+
+# This node's leases, set up by main()
+cluster = None
+leader = None
+
+def deliver_email(to_addr, record):
+    """Store a received email and queue notifications for the owners of its address."""
+    owners = user_emails.owners(to_addr)
+    if not owners and cluster is not None and cluster.settling():
+        # May still be on its way from the node that held it; the sender or SMTP pool retries
+        raise ingest.Moving(f"{to_addr} may be moving between nodes")
+    if not owners:
+        # Released since RCPT, or a Bloom filter false positive in an SMTP worker
+        logger.info(f"Dropping email for unassigned address {to_addr}")
+        spool.discard(record.get('attachments', ()))
+        return
+    storage.add_email(to_addr, record)
+    url = forward_urls.get(to_addr)
+    if url:
+        # Posted by the push workers
+        pusher.enqueue(url, to_addr, record)
+
+    # Queue a notification for each owner; delivery workers send them
+    preview = preview_of(record)
+    notification = (
+        f"📧 New email received!\n\n"
+        f"From: {preview['from_html']}\n"
+        f"Subject: {preview['subject_html']}\n"
+        f"Date: {preview['date_html']}\n"
+        f"Body: {preview['text_html']}"
+    )
+    if preview['code']:
+        notification += f"\n\n🔑 Code: <code>{preview['code']}</code>"
+    if preview['link']:
+        notification += f"\n🔗 {html.escape(preview['link'])}"
+    # Line for this email when several arrive together and are shown as a digest
+    summary = f"• <b>{preview['from_html']}</b>: {preview['subject_html']}"
+    if preview['code']:
+        summary += f" (code <code>{preview['code']}</code>)"
+    for user_id in owners:
+        notifier.enqueue(user_id, notification, parse_mode='HTML', email=to_addr,
+                         accepted_at=record.get('received'), summary=summary)
+
+# Entry point for mail, lookups and updates from SMTP servers and other nodes, set up by main()
+node_ingest = None
+
+# Addresses moved to another node per call, to keep each batch of messages small
+HANDOFF_BATCH = 100
+
+def address_live(address):
+    """Whether an address is held here; None while it may still be on its way from another node."""
+    if user_emails.is_live(address):
+        return True
+    if cluster is not None and cluster.settling():
+        return None
+    return False
+
+def address_state(address):
+    """Everything this node holds for an address, with the ids of its stored messages."""
+    return {
+        'address': address,
+        'owners': user_emails.owners(address),
+        'deadline': expiry.deadline(address),
+        'forward': forward_urls.get(address),
+        'messages': storage.emails_since(address, 0),
+    }
+
+def hand_over(node, addresses, stats):
+    """Move addresses and user stats to ``node``, which owns them now."""
+    peer = cluster.peer(node)
+    units = [address_state(address) for address in addresses]
+    # Drop the saved rows first, so a database shared with the new owner ends up with its rows only
+    for unit in units:
+        for user_id in unit['owners']:
+            storage.delete_address(user_id, unit['address'])
+        if unit['forward']:
+            storage.delete_forward(unit['address'])
+    for user_id in stats:
+        storage.delete_stats(user_id)
+    storage.flush()
+    try:
+        peer.adopt({
+            'addresses': [
+                dict(unit, messages=[as_dict(record) for _, record in unit['messages']]) for unit in units
+            ],
+            'stats': stats,
+        })
+    except Exception:
+        # Keep everything here and try again on the next refresh
+        for unit in units:
+            for user_id in unit['owners']:
+                storage.save_address(user_id, unit['address'])
+            if unit['forward']:
+                storage.save_forward(unit['address'], unit['forward'])
+        for user_id, entry in stats.items():
+            storage.save_stats(user_id, entry)
+        raise
+    for unit in units:
+        user_emails.release_address(unit['address'])
+        expiry.cancel(unit['address'])
+        forward_urls.pop(unit['address'], None)
+    for user_id in stats:
+        user_stats.pop(user_id, None)
+    # Mail stored while the batch was on its way follows it
+    storage.flush()
+    for unit in units:
+        address = unit['address']
+        ids = [message_id for message_id, _ in unit['messages']]
+        late = storage.emails_since(address, ids[-1] if ids else 0)
+        if late:
+            peer.adopt({'addresses': [
+                {'address': address, 'owners': [], 'messages': [as_dict(record) for _, record in late]}
+            ], 'stats': {}})
+            ids.extend(message_id for message_id, _ in late)
+        storage.delete_messages(address, ids)
+    logger.info(f"Handed {len(units)} addresses and {len(stats)} users over to {node}")
+
+def adopt_state(batch):
+    """Take over addresses and user stats handed over by the node that held them."""
+    for user_id, entry in batch['stats'].items():
+        if user_id not in user_stats:
+            user_stats[user_id] = entry
+            storage.save_stats(user_id, entry)
+    for unit in batch['addresses']:
+        address = unit['address']
+        for user_id in unit['owners']:
+            user_emails.assign(user_id, address)
+            storage.save_address(user_id, address)
+        if unit.get('deadline'):
+            expiry.schedule(address, max(unit['deadline'], expiry.deadline(address) or 0))
+        if unit.get('forward'):
+            forward_urls[address] = unit['forward']
+            storage.save_forward(address, unit['forward'])
+        for record in unit['messages']:
+            storage.add_email(address, record)
+
+def rebalance():
+    """Follow a change of cluster members; return whether everything that moved away was handed over."""
+    if node_ingest is None:
+        # Still starting; the cluster calls again on its next refresh
+        return False
+    restore_state()
+    addresses = collections.defaultdict(list)
+    stats = collections.defaultdict(dict)
+    seen = set()
+    for user_id in user_emails.users():
+        # In assignment order, so the current address is still current on the new node
+        for address in user_emails.addresses(user_id):
+            node = cluster.owner(address)
+            if node != NODE_ID and address not in seen:
+                seen.add(address)
+                addresses[node].append(address)
+    for user_id, entry in list(user_stats.items()):
+        node = cluster.owner(user_id)
+        if node != NODE_ID:
+            stats[node][user_id] = entry
+    done = True
+    for node in set(addresses) | set(stats):
+        moving = addresses[node]
         try:
-            # Parse email
-            msg = email.message_from_bytes(envelope.content, policy=policy.default)
-            subject = msg.get('subject', 'No Subject')
-            from_addr = envelope.mail_from
-            to_addr = envelope.rcpt_tos[0]
-            date = msg.get('date', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-            
-            # Extract body
-            body = ''
-            if msg.is_multipart():
-                for part in msg.walk():
-                    if part.get_content_type() == "text/plain":
-                        body = part.get_content()
-                        break
-            else:
-                body = msg.get_content()
-
-            # Store email
-            if to_addr not in emails:
-                emails[to_addr] = []
-            emails[to_addr].append({
-                'subject': subject,
-                'from': from_addr,
-                'date': date,
-                'body': body
-            })
-
-            # Find user by email and send notification
-            for user_id, email_addr in user_emails.items():
-                if email_addr == to_addr:
-                    try:
-                        # Get bot instance from the application context
-                        bot = Updater.bot
-                        if bot:
-                            # Create notification message
-                            notification = (
-                                f"📧 New email received!\n\n"
-                                f"From: {from_addr}\n"
-                                f"Subject: {subject}\n"
-                                f"Date: {date}\n"
-                                f"Body: {body[:200]}..."  # First 200 chars
-                            )
-                            # Send notification to user
-                            sent_msg = bot.send_message(
-                                chat_id=user_id,
-                                text=notification,
-                                parse_mode='HTML'
-                            )
-                            # Track the message
-                            message_tracking[sent_msg.message_id] = {
-                                'chat_id': user_id,
-                                'type': 'email_notification',
-                                'email': to_addr
-                            }
-                    except Exception as e:
-                        logger.error(f"Error sending notification to user {user_id}: {str(e)}")
-
-            logger.info(f"Received email for {to_addr} from {from_addr}")
-            return '250 Message accepted for delivery'
+            for i in range(0, max(len(moving), 1), HANDOFF_BATCH):
+                hand_over(node, moving[i:i + HANDOFF_BATCH], stats[node] if i == 0 else {})
         except Exception as e:
-            logger.error(f"Error processing email: {str(e)}")
-            return f'500 Error processing email: {str(e)}'
+            logger.error(f"Error handing state over to {node}: {str(e)}")
+            done = False
+    return done
 
 async def run_email_server():
     """Run SMTP server in a separate thread."""
@@ -125,7 +421,18 @@ async def run_email_server():
         sock.bind((EMAIL_HOST, EMAIL_PORT))
         sock.close()
         
-        controller = Controller(CustomHandler(), hostname=EMAIL_HOST, port=EMAIL_PORT)
+        # Imported here so the bot role starts without aiosmtpd
+        from aiosmtpd.controller import Controller
+        from smtp_server import CustomHandler
+
+        handler = CustomHandler(
+            DOMAINS, node_ingest.deliver, MAIL_PARSE_MODE,
+            overloaded=backpressure.check, is_live=node_ingest.is_live, spool=spool,
+            client_limit=smtp_client_limit, sender_limit=smtp_sender_limit,
+            # Lookups and mail for other nodes' addresses go over the network
+            call_timeout=MAIL_QUEUE_TIMEOUT if cluster is not None else None
+        )
+        controller = Controller(handler, hostname=EMAIL_HOST, port=EMAIL_PORT, data_size_limit=MAX_MESSAGE_SIZE)
         controller.start()
         logger.info(f"Starting SMTP server on {EMAIL_HOST}:{EMAIL_PORT}")
         
@@ -136,42 +443,16 @@ async def run_email_server():
         logger.error(f"Error running SMTP server: {str(e)}")
         sys.exit(1)
 
-def is_process_running(pid):
-    """Check if a process is running."""
-    try:
-        process = psutil.Process(pid)
-        return process.is_running()
-    except psutil.NoSuchProcess:
-        return False
-
 def cleanup():
-    """Cleanup function to remove lock file on exit."""
-    try:
-        if os.path.exists(LOCK_FILE):
-            os.remove(LOCK_FILE)
-            logger.info("Lock file removed")
-    except Exception as e:
-        logger.error(f"Error removing lock file: {str(e)}")
+    """Give up this process's leases on exit."""
+    for lease in (leader, cluster):
+        if lease is not None:
+            lease.stop()
 
-def create_lock():
-    """Create a lock file to ensure only one instance runs."""
-    try:
-        if os.path.exists(LOCK_FILE):
-            with open(LOCK_FILE, 'r') as f:
-                pid = int(f.read().strip())
-                if is_process_running(pid):
-                    logger.error(f"Another instance is already running with PID {pid}")
-                    return False
-                else:
-                    # Process is not running, we can create a new lock
-                    os.remove(LOCK_FILE)
-        
-        with open(LOCK_FILE, 'w') as f:
-            f.write(str(os.getpid()))
-        return True
-    except Exception as e:
-        logger.error(f"Error creating lock file: {str(e)}")
-        return False
+def shutdown():
+    """Stop this process through the signal handler, e.g. when its lease is lost."""
+    logger.error("Lease lost, shutting down")
+    os.kill(os.getpid(), signal.SIGTERM)
 
 def error_handler(update: Update, context: CallbackContext):
     """Handle errors in the bot."""
@@ -181,22 +462,39 @@ def error_handler(update: Update, context: CallbackContext):
             "Sorry, something went wrong. Please try again later."
         )
 
-@app.route('/')
-def home():
-    return "Bot is running!"
+def generate_email(user_id):
+    """Assign a random temporary email address that nobody else holds."""
+    while True:
+        username = ''.join(random.choices(string.ascii_lowercase + string.digits, k=LOCAL_PART_LENGTH))
+        if cluster is not None:
+            # Routes mail for it to the node that holds the user
+            username += address_tag(user_id)
+        domain = random.choice(DOMAINS)
+        candidate = f"{username}@{domain}"
+        address = user_emails.assign(user_id, candidate, fresh=True)
+        if address:
+            return address
 
-def generate_email():
-    """Generate a random temporary email address."""
-    username = ''.join(random.choices(string.ascii_lowercase + string.digits, k=10))
-    domain = random.choice(DOMAINS)
-    return f"{username}@{domain}"
+def rate_limited_text(user_id):
+    """Charge a new address to ``user_id``; return the refusal to show if over the limit."""
+    delay = new_address_limit.delay(user_id)
+    if delay:
+        return f"⏳ Too many new addresses. Please try again in {int(delay) + 1} seconds."
+    return None
 
 def newmail(update: Update, context: CallbackContext):
     """Generate a new temporary email address."""
     user_id = update.effective_user.id
-    email = generate_email()
-    user_emails[user_id] = email
+    refusal = rate_limited_text(user_id)
+    if refusal:
+        sent_msg = update.message.reply_text(refusal)
+        
+        # Track the message
+        track_message(sent_msg, 'rate_limited')
+        return
+    email = assign_address(user_id)
     user_stats[user_id] = {'created': datetime.now(), 'emails_received': 0}
+    storage.save_stats(user_id, user_stats[user_id])
     
     # Create refresh button
     keyboard = [[InlineKeyboardButton("🔄 Refresh Email", callback_data='refresh_email')]]
@@ -205,124 +503,271 @@ def newmail(update: Update, context: CallbackContext):
     sent_msg = update.message.reply_text(
         f"📧 Your new temporary email address:\n\n"
         f"`{email}`\n\n"
-        f"This email will be valid for 24 hours.",
+        f"This email will be valid for {ADDRESS_TTL // 3600} hours.",
         parse_mode='Markdown',
         reply_markup=reply_markup
     )
     
     # Track the message
-    message_tracking[sent_msg.message_id] = {
-        'chat_id': update.effective_chat.id,
-        'type': 'email_generation',
-        'email': email
-    }
+    track_message(sent_msg, 'email_generation', email=email)
 
 def tempmaill(update: Update, context: CallbackContext):
     """Generate a new temporary email address and show inbox."""
     user_id = update.effective_user.id
-    email = generate_email()
-    user_emails[user_id] = email
-    
-    # Create refresh and new email buttons
-    keyboard = [
-        [InlineKeyboardButton("🔄 Refresh Messages", callback_data='refresh_messages')],
-        [InlineKeyboardButton("📧 New Email", callback_data='new_email')]
-    ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    refusal = rate_limited_text(user_id)
+    if refusal:
+        sent_msg = update.message.reply_text(refusal)
+        
+        # Track the message
+        track_message(sent_msg, 'rate_limited')
+        return
+    email = assign_address(user_id)
     
     # Show inbox
-    inbox_text = show_inbox(email)
+    inbox_text, page, pages, _ = show_inbox(email)
     
     sent_msg = update.message.reply_text(
         f"📧 Your temporary email address:\n\n"
         f"`{email}`\n\n"
         f"{inbox_text}",
         parse_mode='Markdown',
-        reply_markup=reply_markup
+        reply_markup=inbox_keyboard(page, pages)
     )
+    inbox_renderer.mark_shown(sent_msg.chat_id, sent_msg.message_id, email, page, inbox_text)
     
     # Track the message
-    message_tracking[sent_msg.message_id] = {
-        'chat_id': update.effective_chat.id,
-        'type': 'inbox_view',
-        'email': email
-    }
+    track_message(sent_msg, 'inbox_view', email=email)
+
+def inbox_keyboard(page, pages):
+    """Create page navigation, refresh and new email buttons."""
+    keyboard = []
+    if pages > 1:
+        navigation = []
+        if page > 1:
+            navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=f'inbox_page:{page - 1}'))
+        navigation.append(InlineKeyboardButton(f"{page}/{pages}", callback_data=f'inbox_page:{page}'))
+        if page < pages:
+            navigation.append(InlineKeyboardButton("Next ➡️", callback_data=f'inbox_page:{page + 1}'))
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("🔄 Refresh Messages", callback_data=f'refresh_messages:{page}')])
+    keyboard.append([InlineKeyboardButton("📧 New Email", callback_data='new_email')])
+    return InlineKeyboardMarkup(keyboard)
+
+def show_inbox(email, page=1):
+    """Show one page of inbox contents as (text, page, pages, version)."""
+    return inbox_renderer.render(storage, email, page)
+
+def message_body(msg):
+    """Return the full body of a stored email, parsing it on first use."""
+    if 'raw' in msg and not msg.get('parsed'):
+        msg['body'] = mailparse.text_body(mailparse.parse_full(msg['raw']))
+        msg['parsed'] = True
+    return msg['body']
+
+def read_email(update: Update, context: CallbackContext):
+    """Show the full contents of one message in the current inbox."""
+    user_id = update.effective_user.id
+    email = user_emails.current(user_id)
+    try:
+        index = int(context.args[0])
+    except (IndexError, ValueError):
+        index = 0
+    msg = storage.get_email(email, index - 1) if email else None
+    if msg is None:
+        sent_msg = update.message.reply_text(
+            "❌ No such message.\n"
+            "Usage: /read <number> (see /tempmaill for message numbers)"
+        )
+        
+        # Track the message
+        track_message(sent_msg, 'no_message')
+        return
+    
+    text = (
+        f"📧 From: {msg['from']}\n"
+        f"Subject: {msg['subject']}\n"
+        f"Date: {msg['date']}\n\n"
+        f"{message_body(msg)}"
+    )
+    attachments = msg.get('attachments', ())
+    if attachments:
+        listing = ''.join(f"\n• {attachment['name']} ({attachment['size'] // 1024 + 1} KB)" for attachment in attachments)
+        text = f"{text[:4000 - len(listing)]}\n\n📎 Attachments:{listing}"
+    sent_msg = update.message.reply_text(text[:4096], reply_markup=attachment_keyboard(index, attachments))
+    
+    # Track the message
+    track_message(sent_msg, 'read_email', email=email)
+
+def render_search(email, query, page=1):
+    """Rank the messages of an inbox matching ``query``; return (text, page, pages)."""
+    positions = search_index.search(email, query)
+    if not positions:
+        return f"🔎 No messages match \"{query}\"", 1, 1
+    pages = (len(positions) + INBOX_PAGE_SIZE - 1) // INBOX_PAGE_SIZE
+    page = min(max(page, 1), pages)
+    lines = [f"🔎 {len(positions)} messages match \"{query}\":\n\n"]
+    for position in positions[(page - 1) * INBOX_PAGE_SIZE:page * INBOX_PAGE_SIZE]:
+        msg = storage.get_email(email, position)
+        if msg is None:
+            continue
+        lines.append(
+            f"{position + 1}. From: {msg['from']}\n"
+            f"   Subject: {str(msg['subject'])[:200]}\n"
+            f"   Date: {msg['date']}\n\n"
+        )
+    lines.append("Use /read <number> to open a message.")
+    return ''.join(lines)[:4096], page, pages
+
+def search_keyboard(page, pages):
+    """Create page navigation buttons for search results."""
+    if pages <= 1:
+        return None
+    navigation = []
+    if page > 1:
+        navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=f'search_page:{page - 1}'))
+    navigation.append(InlineKeyboardButton(f"{page}/{pages}", callback_data=f'search_page:{page}'))
+    if page < pages:
+        navigation.append(InlineKeyboardButton("Next ➡️", callback_data=f'search_page:{page + 1}'))
+    return InlineKeyboardMarkup([navigation])
 
-def show_inbox(email):
-    """Show inbox contents for an email address."""
-    if email not in emails or not emails[email]:
-        return "📥 Inbox is empty"
+def search_email(update: Update, context: CallbackContext):
+    """Search the current inbox by subject, sender and body."""
+    user_id = update.effective_user.id
+    email = user_emails.current(user_id)
+    query = ' '.join(context.args)[:200]
+    if not email or not query:
+        sent_msg = update.message.reply_text(
+            "Usage: /search <terms>\n"
+            "Finds messages in your current inbox containing all terms."
+        )
+        
+        # Track the message
+        track_message(sent_msg, 'search')
+        return
     
-    inbox_text = "📥 Inbox:\n\n"
-    for i, msg in enumerate(emails[email], 1):
-        inbox_text += f"{i}. From: {msg['from']}\n"
-        inbox_text += f"   Subject: {msg['subject']}\n"
-        inbox_text += f"   Date: {msg['date']}\n"
-        inbox_text += f"   Body: {msg['body'][:200]}...\n\n"  # Show first 200 chars of body
+    context.user_data['search_query'] = query
+    text, page, pages = render_search(email, query)
+    sent_msg = update.message.reply_text(text, reply_markup=search_keyboard(page, pages))
     
-    return inbox_text
+    # Track the message
+    track_message(sent_msg, 'search', email=email)
+
+def attachment_keyboard(index, attachments):
+    """Create a download button for each attachment of message ``index``."""
+    if not attachments:
+        return None
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"⬇️ {attachment['name'][:40]}",
+                              callback_data=f"attachment:{index}:{n}:{attachment['sha256'][:12]}")]
+        for n, attachment in enumerate(attachments[:20])
+    ])
+
+def send_attachment(query, attachment):
+    """Send a spooled attachment, reusing Telegram's copy after the first upload."""
+    digest = attachment['sha256']
+    file_id = spool.file_id(digest)
+    if file_id:
+        return query.message.reply_document(document=file_id, filename=attachment['name'])
+    # Map the file instead of reading it through a buffered file object
+    with open(spool.path(digest), 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        sent_msg = query.message.reply_document(document=data, filename=attachment['name'])
+    spool.remember_file_id(digest, sent_msg.document.file_id)
+    return sent_msg
 
 def button_callback(update: Update, context: CallbackContext):
     """Handle button callbacks."""
     query = update.callback_query
     user_id = query.from_user.id
     
-    if query.data == 'refresh_messages':
-        if user_id in user_emails:
-            email = user_emails[user_id]
-            inbox_text = show_inbox(email)
+    action, _, arg = query.data.partition(':')
+    
+    if action in ('refresh_messages', 'inbox_page'):
+        email = user_emails.current(user_id)
+        if email:
+            requested = int(arg) if arg.isdigit() else 1
+            inbox_text, page, pages, _ = show_inbox(email, requested)
+            chat_id, message_id = query.message.chat_id, query.message.message_id
             
-            # Create refresh and new email buttons
-            keyboard = [
-                [InlineKeyboardButton("🔄 Refresh Messages", callback_data='refresh_messages')],
-                [InlineKeyboardButton("📧 New Email", callback_data='new_email')]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            # Nothing changed since this message was rendered
+            if inbox_renderer.is_shown(chat_id, message_id, email, page, inbox_text):
+                query.answer("No new messages")
+                return
             
             query.edit_message_text(
                 f"📧 Your temporary email address:\n\n"
                 f"`{email}`\n\n"
                 f"{inbox_text}",
                 parse_mode='Markdown',
-                reply_markup=reply_markup
+                reply_markup=inbox_keyboard(page, pages)
             )
-            query.answer("Messages refreshed!")
+            inbox_renderer.mark_shown(chat_id, message_id, email, page, inbox_text)
+            query.answer("Messages refreshed!" if action == 'refresh_messages' else f"Page {page}/{pages}")
     
-    elif query.data == 'new_email':
-        email = generate_email()
-        user_emails[user_id] = email
-        
-        # Create refresh and new email buttons
-        keyboard = [
-            [InlineKeyboardButton("🔄 Refresh Messages", callback_data='refresh_messages')],
-            [InlineKeyboardButton("📧 New Email", callback_data='new_email')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+    elif action == 'search_page':
+        email = user_emails.current(user_id)
+        query_text = context.user_data.get('search_query')
+        if email and query_text:
+            text, page, pages = render_search(email, query_text, int(arg) if arg.isdigit() else 1)
+            query.edit_message_text(text, reply_markup=search_keyboard(page, pages))
+            query.answer(f"Page {page}/{pages}")
+        else:
+            query.answer("Search again with /search")
+
+    elif action == 'attachment':
+        email = user_emails.current(user_id)
+        index, n, digest = (arg.split(':') + ['', '', ''])[:3]
+        msg = storage.get_email(email, int(index) - 1) if email and index.isdigit() else None
+        attachments = msg.get('attachments', ()) if msg else ()
+        attachment = attachments[int(n)] if n.isdigit() and int(n) < len(attachments) else None
+        if attachment is None or not attachment['sha256'].startswith(digest):
+            query.answer("This message is no longer in your inbox")
+        elif attachment['size'] == 0 or attachment['size'] > MAX_UPLOAD_SIZE:
+            query.answer("This attachment is empty or too large to send")
+        else:
+            try:
+                sent_msg = send_attachment(query, attachment)
+            except FileNotFoundError:
+                query.answer("This attachment is no longer available")
+            else:
+                query.answer()
+                track_message(sent_msg, 'attachment', email=email)
+
+    elif action == 'new_email':
+        refusal = rate_limited_text(user_id)
+        if refusal:
+            query.answer(refusal, show_alert=True)
+            return
+        email = assign_address(user_id)
         
         query.edit_message_text(
             f"📧 Your new temporary email address:\n\n"
             f"`{email}`\n\n"
             f"📥 Inbox is empty",
             parse_mode='Markdown',
-            reply_markup=reply_markup
+            reply_markup=inbox_keyboard(1, 1)
         )
+        inbox_renderer.mark_shown(query.message.chat_id, query.message.message_id, email, 1, "📥 Inbox is empty")
         query.answer("New email address generated!")
 
 def handle_edited_message(update: Update, context: CallbackContext):
-    """Handle edited messages in groups."""
+    """Remember group message texts and announce edits."""
     try:
-        if update.edited_message and update.edited_message.chat.type in ['group', 'supergroup']:
+        if update.message and update.message.chat.type in ['group', 'supergroup']:
+            group_messages.remember(update.message.chat_id, update.message.message_id, update.message.text)
+        elif update.edited_message and update.edited_message.chat.type in ['group', 'supergroup']:
             edited_msg = update.edited_message
             user = edited_msg.from_user
             
-            # Get the original message if available
-            original_text = edited_msg.reply_to_message.text if edited_msg.reply_to_message else "Original message not available"
+            # Get the previous text from the cache of recent group messages
+            original_text = group_messages.remember(edited_msg.chat_id, edited_msg.message_id, edited_msg.text)
+            if original_text is None:
+                original_text = "Original message not available"
             
             # Create notification message
             notification = (
-                f"📝 Message edited by @{user.username or user.first_name}\n\n"
-                f"Original: {original_text}\n"
-                f"New: {edited_msg.text}"
+                f"📝 Message edited by @{html.escape(user.username or user.first_name)}\n\n"
+                f"Original: {html.escape(original_text)}\n"
+                f"New: {html.escape(edited_msg.text)}"
             )
             
             # Send notification and store the message object
@@ -333,20 +778,10 @@ def handle_edited_message(update: Update, context: CallbackContext):
             )
             
             # Track the message
-            message_tracking[sent_msg.message_id] = {
-                'chat_id': edited_msg.chat_id,
-                'type': 'edit_notification',
-                'original_message_id': edited_msg.message_id
-            }
+            track_message(sent_msg, 'edit_notification', original_message_id=edited_msg.message_id)
             
-            # Schedule deletion after 1 minute
-            context.job_queue.run_once(
-                lambda context: context.bot.delete_message(
-                    chat_id=edited_msg.chat_id,
-                    message_id=sent_msg.message_id
-                ),
-                when=60  # 60 seconds = 1 minute
-            )
+            # Delete the notice with the next due sweep
+            delete_sweeper.schedule(edited_msg.chat_id, sent_msg.message_id, GROUP_NOTICE_TTL)
     except Exception as e:
         logger.error(f"Error handling edited message: {str(e)}")
 
@@ -371,30 +806,23 @@ def handle_deleted_message(update: Update, context: CallbackContext):
             )
             
             # Track the message
-            message_tracking[sent_msg.message_id] = {
-                'chat_id': deleted_msg.chat_id,
-                'type': 'delete_notification',
-                'original_message_id': deleted_msg.message_id
-            }
+            track_message(sent_msg, 'delete_notification', original_message_id=deleted_msg.message_id)
     except Exception as e:
         logger.error(f"Error handling deleted message: {str(e)}")
 
 def current_email(update: Update, context: CallbackContext):
     """Show current email address."""
     user_id = update.effective_user.id
-    if user_id in user_emails:
+    email = user_emails.current(user_id)
+    if email:
         sent_msg = update.message.reply_text(
             f"📧 Your current temporary email address:\n\n"
-            f"`{user_emails[user_id]}`",
+            f"`{email}`",
             parse_mode='Markdown'
         )
         
         # Track the message
-        message_tracking[sent_msg.message_id] = {
-            'chat_id': update.effective_chat.id,
-            'type': 'current_email',
-            'email': user_emails[user_id]
-        }
+        track_message(sent_msg, 'current_email', email=email)
     else:
         sent_msg = update.message.reply_text(
             "❌ You don't have an active temporary email address.\n"
@@ -402,38 +830,30 @@ def current_email(update: Update, context: CallbackContext):
         )
         
         # Track the message
-        message_tracking[sent_msg.message_id] = {
-            'chat_id': update.effective_chat.id,
-            'type': 'no_email'
-        }
+        track_message(sent_msg, 'no_email')
 
 def delete_email(update: Update, context: CallbackContext):
     """Delete current email session."""
     user_id = update.effective_user.id
-    if user_id in user_emails:
-        email = user_emails.pop(user_id)
-        user_stats.pop(user_id, None)
+    email = release_address(user_id)
+    if email:
+        if user_id not in user_emails:
+            user_stats.pop(user_id, None)
+            storage.delete_stats(user_id)
         sent_msg = update.message.reply_text(
             f"🗑️ Your temporary email address has been deleted:\n\n"
             f"`{email}`"
         )
         
         # Track the message
-        message_tracking[sent_msg.message_id] = {
-            'chat_id': update.effective_chat.id,
-            'type': 'email_deletion',
-            'email': email
-        }
+        track_message(sent_msg, 'email_deletion', email=email)
     else:
         sent_msg = update.message.reply_text(
             "❌ You don't have an active temporary email address."
         )
         
         # Track the message
-        message_tracking[sent_msg.message_id] = {
-            'chat_id': update.effective_chat.id,
-            'type': 'no_email'
-        }
+        track_message(sent_msg, 'no_email')
 
 def show_stats(update: Update, context: CallbackContext):
     """Show email statistics."""
@@ -445,16 +865,13 @@ def show_stats(update: Update, context: CallbackContext):
             f"📊 Email Statistics:\n\n"
             f"Created: {created_time}\n"
             f"Emails received: {stats['emails_received']}\n"
-            f"Current address: `{user_emails[user_id]}`",
+            f"Current address: `{user_emails.current(user_id)}`\n"
+            f"Search index: {len(search_index)} inboxes, ~{search_index.memory_used() // 1024} KB",
             parse_mode='Markdown'
         )
         
         # Track the message
-        message_tracking[sent_msg.message_id] = {
-            'chat_id': update.effective_chat.id,
-            'type': 'stats',
-            'email': user_emails[user_id]
-        }
+        track_message(sent_msg, 'stats', email=user_emails.current(user_id))
     else:
         sent_msg = update.message.reply_text(
             "❌ No statistics available.\n"
@@ -462,26 +879,69 @@ def show_stats(update: Update, context: CallbackContext):
         )
         
         # Track the message
-        message_tracking[sent_msg.message_id] = {
-            'chat_id': update.effective_chat.id,
-            'type': 'no_stats'
-        }
+        track_message(sent_msg, 'no_stats')
 
 def forward_email(update: Update, context: CallbackContext):
-    """Set email forwarding."""
+    """Set or clear the URL received mail is pushed to."""
     user_id = update.effective_user.id
-    if user_id in user_emails:
+    email = user_emails.current(user_id)
+    if not email:
         sent_msg = update.message.reply_text(
-            "📧 Email forwarding is enabled by default.\n"
-            "All emails sent to your temporary address will be forwarded to you."
+            "❌ You don't have an active temporary email address.\n"
+            "Use /newmail to create one."
         )
         
         # Track the message
-        message_tracking[sent_msg.message_id] = {
-            'chat_id': update.effective_chat.id,
-            'type': 'forwarding_info',
-            'email': user_emails[user_id]
-        }
+        track_message(sent_msg, 'no_email')
+        return
+    if not context.args:
+        url = forward_urls.get(email)
+        if url:
+            text = f"🔗 Emails to <code>{email}</code> are posted to:\n<code>{html.escape(url)}</code>\n\n"
+        else:
+            text = f"📧 Emails to <code>{email}</code> are only sent to you here.\n\n"
+        text += (
+            "Use /forward &lt;url&gt; to also POST each email as JSON to your own endpoint, "
+            "and /forward off to stop."
+        )
+    elif context.args[0].lower() == 'off':
+        drop_forward(email)
+        text = f"🔕 Emails to <code>{email}</code> are no longer posted anywhere."
+    else:
+        url = context.args[0]
+        problem = check_url(url, PUSH_ALLOW_PRIVATE)
+        if problem:
+            text = f"❌ {html.escape(problem)}"
+        else:
+            forward_urls[email] = url
+            storage.save_forward(email, url)
+            text = (
+                f"🔗 Emails to <code>{email}</code> will also be posted to:\n<code>{html.escape(url)}</code>\n\n"
+                f"Each request is a JSON object with a <code>messages</code> list."
+            )
+    sent_msg = update.message.reply_text(text, parse_mode='HTML')
+    
+    # Track the message
+    track_message(sent_msg, 'forwarding_info', email=email)
+
+def api_access(update: Update, context: CallbackContext):
+    """Show the inbox API token of the current address."""
+    user_id = update.effective_user.id
+    email = user_emails.current(user_id)
+    if email:
+        token = address_token(API_SECRET, email)
+        sent_msg = update.message.reply_text(
+            f"🔌 Inbox API for `{email}`\n\n"
+            f"Token: `{token}`\n\n"
+            f"`curl -H 'Authorization: Bearer {token}' "
+            f"'{API_BASE_URL}/api/inbox/{email}?since=0&wait=30'`\n\n"
+            f"The request waits up to `wait` seconds for new mail. "
+            f"Pass the returned `since` to the next request to get only newer messages.",
+            parse_mode='Markdown'
+        )
+        
+        # Track the message
+        track_message(sent_msg, 'api_access', email=email)
     else:
         sent_msg = update.message.reply_text(
             "❌ You don't have an active temporary email address.\n"
@@ -489,26 +949,23 @@ def forward_email(update: Update, context: CallbackContext):
         )
         
         # Track the message
-        message_tracking[sent_msg.message_id] = {
-            'chat_id': update.effective_chat.id,
-            'type': 'no_email'
-        }
+        track_message(sent_msg, 'no_email')
 
 def extend_email(update: Update, context: CallbackContext):
     """Extend email lifetime."""
     user_id = update.effective_user.id
-    if user_id in user_stats:
+    email = user_emails.current(user_id)
+    if user_id in user_stats and email:
         user_stats[user_id]['created'] = datetime.now()
+        storage.save_stats(user_id, user_stats[user_id])
+        storage.save_address(user_id, email)
+        expiry.schedule(email, time.time() + ADDRESS_TTL)
         sent_msg = update.message.reply_text(
-            "⏰ Your temporary email address lifetime has been extended by 24 hours."
+            f"⏰ Your temporary email address lifetime has been extended by {ADDRESS_TTL // 3600} hours."
         )
         
         # Track the message
-        message_tracking[sent_msg.message_id] = {
-            'chat_id': update.effective_chat.id,
-            'type': 'extension',
-            'email': user_emails[user_id]
-        }
+        track_message(sent_msg, 'extension', email=email)
     else:
         sent_msg = update.message.reply_text(
             "❌ You don't have an active temporary email address.\n"
@@ -516,10 +973,7 @@ def extend_email(update: Update, context: CallbackContext):
         )
         
         # Track the message
-        message_tracking[sent_msg.message_id] = {
-            'chat_id': update.effective_chat.id,
-            'type': 'no_email'
-        }
+        track_message(sent_msg, 'no_email')
 
 def privacy_tips(update: Update, context: CallbackContext):
     """Get privacy tips."""
@@ -536,10 +990,7 @@ def privacy_tips(update: Update, context: CallbackContext):
     sent_msg = update.message.reply_text(tips)
     
     # Track the message
-    message_tracking[sent_msg.message_id] = {
-        'chat_id': update.effective_chat.id,
-        'type': 'privacy_tips'
-    }
+    track_message(sent_msg, 'privacy_tips')
 
 def help_command(update: Update, context: CallbackContext):
     """Send a message when the command /help is issued."""
@@ -549,10 +1000,13 @@ def help_command(update: Update, context: CallbackContext):
         "/newmail - Generate a new temporary email address\n"
         "/tempmaill - Generate a new temporary email address and show inbox\n"
         "/current - Show current email address\n"
+        "/read - Read a message in full\n"
+        "/search - Search your inbox\n"
         "/delete - Delete current email session\n"
         "/stats - Show email statistics\n"
-        "/forward - Set email forwarding\n"
+        "/forward - Push emails to your own URL\n"
         "/extend - Extend email lifetime\n"
+        "/api - Get an API token for your inbox\n"
         "/privacy - Get privacy tips\n\n"
         "Group Features:\n"
         "- Tracks edited messages\n"
@@ -561,28 +1015,91 @@ def help_command(update: Update, context: CallbackContext):
     sent_msg = update.message.reply_text(help_text)
     
     # Track the message
-    message_tracking[sent_msg.message_id] = {
-        'chat_id': update.effective_chat.id,
-        'type': 'help'
-    }
+    track_message(sent_msg, 'help')
 
-def run_flask():
-    """Run Flask server in a separate thread."""
-    try:
-        port = int(os.getenv('PORT', 10000))
-        app.run(host='0.0.0.0', port=port)
-    except Exception as e:
-        logger.error(f"Error running Flask server: {str(e)}")
-        sys.exit(1)
+def register_state_metrics(dispatcher, smtp_pool=None):
+    """Expose sizes of the in-memory state and queues as gauges."""
+    metrics.state.add('tempmail_live_addresses', 'Addresses currently assigned to users', lambda: len(user_emails))
+    metrics.state.add('tempmail_stored_messages', 'Emails held in storage', lambda: storage.count_messages())
+    metrics.state.add('tempmail_tracked_messages', 'Entries in message_tracking', lambda: len(message_tracking))
+    metrics.state.add('tempmail_scheduled_expiries', 'Addresses waiting to expire', lambda: len(expiry))
+    metrics.state.add(
+        'tempmail_queue_depth', 'Items waiting in each queue',
+        lambda: {
+            'notifications': notifier.pending(),
+            'pushes': pusher.pending(),
+            'dispatch': dispatcher.update_queue.qsize() + dispatcher.pending(),
+            'webhook_updates': webhook.update_queue.qsize(),
+            'smtp_ingest': smtp_pool.pending() if smtp_pool else 0,
+        },
+        label='queue'
+    )
 
-def main():
-    """Start the bot."""
+def route_update(update):
+    """Pass an update on to the node owning its user; return whether it was passed on."""
+    peer = cluster.route(ShardedDispatcher.shard_key(update))
+    if peer is None:
+        return False
     try:
-        # Create lock file
-        if not create_lock():
-            logger.error("Failed to create lock file. Another instance might be running.")
-            sys.exit(1)
+        peer.dispatch(update.to_dict())
+        return True
+    except ConnectionError as e:
+        # Handled here until the cluster notices the node is gone
+        logger.error(f"Error forwarding update {update.update_id}: {str(e)}")
+        return False
+
+def poll_updates(bot, dispatcher):
+    """Feed getUpdates into the dispatcher while this node holds the Telegram lease."""
+    polling = False
+    offset = None
+    while True:
+        if not leader.held:
+            polling = False
+            time.sleep(1)
+            continue
+        try:
+            if not polling:
+                bot.delete_webhook()
+                polling = True
+            for update in bot.get_updates(offset=offset, timeout=10, allowed_updates=webhook.ALLOWED_UPDATES):
+                offset = update.update_id + 1
+                dispatcher.update_queue.put(update)
+        except TelegramError as e:
+            logger.error(f"Error polling updates: {str(e)}")
+            time.sleep(1)
+
+def create_updater(token, route=None):
+    """Create an Updater whose dispatcher runs handlers on per-user shards."""
+    request = Request(
+        con_pool_size=DISPATCH_WORKERS + NOTIFY_WORKERS + 4,  # Shards, notifier, polling, jobs
+        read_timeout=30,  # Increase timeouts
+        connect_timeout=30
+    )
+    job_queue = JobQueue()
+    dispatcher = ShardedDispatcher(
+        ExtBot(token, request=request),
+        Queue(),
+        workers=1,
+        job_queue=job_queue,
+        shards=DISPATCH_WORKERS,
+        route=route
+    )
+    job_queue.set_dispatcher(dispatcher)
+    return Updater(dispatcher=dispatcher, workers=None)
+
+def main(role='all'):
+    """Start the bot; role 'all' also serves HTTP and SMTP in this process.
 
+    Role 'bot' leaves those to separate web and SMTP role processes and
+    accepts their mail over MAIL_QUEUE_ADDRESS.
+
+    Without NODE_ID the instance waits for the Telegram lease before it
+    starts, so a second one on the host stands by. With NODE_ID it joins
+    the cluster: it owns a range of addresses and users, passes on mail
+    and updates for the rest, and polls Telegram while it holds the lease.
+    """
+    global cluster, leader, node_ingest
+    try:
         # Register cleanup function
         atexit.register(cleanup)
 
@@ -590,16 +1107,41 @@ def main():
         token = os.getenv('TELEGRAM_BOT_TOKEN')
         if not token:
             logger.error("TELEGRAM_BOT_TOKEN not found in environment variables")
-            cleanup()
             return
 
+        coordinator = SQLiteCoordinator(COORDINATION_PATH)
+        if NODE_ID:
+            if not MAIL_QUEUE_SECRET:
+                logger.error("MAIL_QUEUE_SECRET is required with NODE_ID")
+                return
+            cluster = Cluster(
+                coordinator, NODE_ID, MAIL_QUEUE_ADDRESS, MAIL_QUEUE_SECRET, LEASE_TTL,
+                on_lost=shutdown, on_change=rebalance
+            )
+            cluster.start()
+            leader = Lease(coordinator, 'telegram', NODE_ID, LEASE_TTL)
+            leader.start()
+        else:
+            # Inboxes and sessions live in this process, so only one may run
+            leader = Lease(
+                coordinator, 'telegram', f"{socket.gethostname()}:{os.getpid()}", LEASE_TTL,
+                on_change=lambda held: held or shutdown()
+            )
+            leader.start()
+            if not leader.wait(LEASE_TTL):
+                logger.info("Another instance holds the Telegram lease, standing by")
+                leader.wait()
+
+        # Open storage and restore saved inboxes and sessions
+        configure_storage()
+        expiry.start()
+
         # Create the Updater with specific settings
-        updater = Updater(
-            token=token,
-            use_context=True,
-            workers=1,  # Limit workers to 1
-            request_kwargs={'read_timeout': 30, 'connect_timeout': 30}  # Increase timeouts
-        )
+        updater = create_updater(token, route_update if cluster is not None else None)
+
+        # Start notification delivery workers
+        notifier.start(updater.bot)
+        pusher.start()
 
         # Get the dispatcher to register handlers
         dp = updater.dispatcher
@@ -608,45 +1150,118 @@ def main():
         dp.add_error_handler(error_handler)
 
         # Add command handlers
-        dp.add_handler(CommandHandler("start", help_command))
-        dp.add_handler(CommandHandler("help", help_command))
-        dp.add_handler(CommandHandler("newmail", newmail))
-        dp.add_handler(CommandHandler("tempmaill", tempmaill))
-        dp.add_handler(CommandHandler("current", current_email))
-        dp.add_handler(CommandHandler("delete", delete_email))
-        dp.add_handler(CommandHandler("stats", show_stats))
-        dp.add_handler(CommandHandler("forward", forward_email))
-        dp.add_handler(CommandHandler("extend", extend_email))
-        dp.add_handler(CommandHandler("privacy", privacy_tips))
+        dp.add_handler(CommandHandler("start", metrics.timed("start", help_command)))
+        dp.add_handler(CommandHandler("help", metrics.timed("help", help_command)))
+        dp.add_handler(CommandHandler("newmail", metrics.timed("newmail", newmail)))
+        dp.add_handler(CommandHandler("tempmaill", metrics.timed("tempmaill", tempmaill)))
+        dp.add_handler(CommandHandler("current", metrics.timed("current", current_email)))
+        dp.add_handler(CommandHandler("read", metrics.timed("read", read_email)))
+        dp.add_handler(CommandHandler("search", metrics.timed("search", search_email)))
+        dp.add_handler(CommandHandler("delete", metrics.timed("delete", delete_email)))
+        dp.add_handler(CommandHandler("stats", metrics.timed("stats", show_stats)))
+        dp.add_handler(CommandHandler("forward", metrics.timed("forward", forward_email)))
+        dp.add_handler(CommandHandler("extend", metrics.timed("extend", extend_email)))
+        dp.add_handler(CommandHandler("api", metrics.timed("api", api_access)))
+        dp.add_handler(CommandHandler("privacy", metrics.timed("privacy", privacy_tips)))
         
         # Add message handlers
-        dp.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_edited_message))
-        dp.add_handler(MessageHandler(Filters.status_update, handle_deleted_message))
+        dp.add_handler(MessageHandler(Filters.text & ~Filters.command, metrics.timed("handle_edited_message", handle_edited_message)))
+        dp.add_handler(MessageHandler(Filters.status_update, metrics.timed("handle_deleted_message", handle_deleted_message)))
         
         # Add callback query handler
-        dp.add_handler(CallbackQueryHandler(button_callback))
+        dp.add_handler(CallbackQueryHandler(metrics.timed("button_callback", button_callback)))
+
+        # Delete attachments written for mail that was never stored
+        updater.job_queue.run_repeating(lambda context: spool.sweep(), interval=SPOOL_SWEEP_INTERVAL)
+
+        # Delete expired group notices
+        updater.job_queue.run_repeating(
+            lambda context: delete_sweeper.sweep(context.bot), interval=DELETE_SWEEP_INTERVAL, first=DELETE_SWEEP_INTERVAL
+        )
 
         # Start the bot
-        logger.info("Starting bot...")
-        updater.start_polling(
-            allowed_updates=['message', 'edited_message', 'callback_query'],
-            drop_pending_updates=True  # Drop any pending updates
+        if BOT_MODE == 'webhook':
+            if not WEBHOOK_SECRET:
+                logger.error("WEBHOOK_SECRET is required in webhook mode")
+                cleanup()
+                return
+            logger.info("Starting bot in webhook mode...")
+            webhook.serve_update_queue(UPDATE_QUEUE_ADDRESS, WEBHOOK_SECRET)
+            webhook.start_pump(dp, Update.de_json)
+        else:
+            logger.info("Starting bot...")
+            threading.Thread(target=poll_updates, args=(updater.bot, dp), name='poller', daemon=True).start()
+        threading.Thread(target=dp.start, name='dispatcher', daemon=True).start()
+        updater.job_queue.start()
+
+        # Mail, lookups and updates from SMTP role processes and other nodes
+        node_ingest = ingest.Ingest(
+            deliver_email, address_live, backpressure.check,
+            dispatch=lambda data: dp.process_local(Update.de_json(data, dp.bot)),
+            route=cluster.route if cluster is not None else None, adopt=adopt_state
         )
+        if MAIL_QUEUE_SECRET:
+            ingest.serve_ingest(MAIL_QUEUE_ADDRESS, MAIL_QUEUE_SECRET, node_ingest)
+        elif role == 'bot':
+            logger.warning("MAIL_QUEUE_SECRET is not set, SMTP role processes cannot deliver mail")
 
-        # Start Flask in a separate thread
-        flask_thread = threading.Thread(target=run_flask)
-        flask_thread.daemon = True
-        flask_thread.start()
+        inbox_api = InboxAPI(
+            storage, inbox_waiters, user_emails.is_live, API_SECRET, body=message_body,
+            max_wait=API_MAX_WAIT, max_waiters=API_MAX_WAITERS
+        )
+        smtp_pool = None
+        if role == 'bot':
+            # /metrics has its own port
+            if METRICS_PORT:
+                metrics.serve(METRICS_PORT)
+            if API_PORT:
+                import web
+                web.set_status(backpressure.status)
+                web.set_inbox_api(inbox_api.get)
+                threading.Thread(target=web.run_flask, args=(API_PORT,), name='inbox-api', daemon=True).start()
+        else:
+            # Start Flask in a separate thread
+            import web
+            web.set_status(backpressure.status)
+            web.set_inbox_api(inbox_api.get)
+            flask_thread = threading.Thread(target=web.run_flask)
+            flask_thread.daemon = True
+            flask_thread.start()
 
-        # Start email server in a separate thread
-        email_thread = threading.Thread(target=lambda: asyncio.run(run_email_server()))
-        email_thread.daemon = True
-        email_thread.start()
+            # Start email server in worker processes or a separate thread
+            if SMTP_WORKERS > 0:
+                from smtp_server import SMTPWorkerPool
+
+                if cluster is None:
+                    live_filter = CountingBloomFilter(LIVE_ADDRESS_CAPACITY)
+                    user_emails.attach_filter(live_filter)
+                else:
+                    # Other nodes' addresses are not in a local filter; ask this node, which asks their owners
+                    live_filter = ingest.RemoteIngest(MAIL_QUEUE_ADDRESS, MAIL_QUEUE_SECRET)
+                smtp_pool = SMTPWorkerPool(
+                    SMTP_WORKERS, EMAIL_HOST, EMAIL_PORT, DOMAINS, MAIL_PARSE_MODE,
+                    data_size_limit=MAX_MESSAGE_SIZE, live_filter=live_filter, spool_dir=SPOOL_DIR,
+                    client_limit=smtp_client_limit, sender_limit=smtp_sender_limit,
+                    call_timeout=MAIL_QUEUE_TIMEOUT if cluster is not None else None
+                )
+                backpressure.add('smtp_ingest', smtp_pool.pending, PENDING_HIGH_WATER)
+                smtp_pool.start(node_ingest.deliver, overloaded=backpressure.check)
+            else:
+                email_thread = threading.Thread(target=lambda: asyncio.run(run_email_server()))
+                email_thread.daemon = True
+                email_thread.start()
+        register_state_metrics(dp, smtp_pool)
 
         # Handle shutdown signals
         def signal_handler(signum, frame):
             logger.info("Received shutdown signal")
+            if smtp_pool:
+                smtp_pool.stop()
             updater.stop()
+            notifier.stop()
+            pusher.stop()
+            expiry.stop()
+            storage.close()
             cleanup()
             sys.exit(0)
 
@@ -654,7 +1269,8 @@ def main():
         signal.signal(signal.SIGTERM, signal_handler)
 
         # Run the bot until you press Ctrl-C
-        updater.idle()
+        while True:
+            signal.pause()
 
     except Exception as e:
         logger.error(f"Error in main: {str(e)}")
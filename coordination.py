@@ -0,0 +1,150 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Coordinator:
+    """Named leases shared by every node of a deployment.
+
+    A lease is held by one holder until it expires or is released; the
+    holder keeps it by acquiring it again before ``ttl`` runs out.
+    Backends only need these three calls, so a store shared across hosts
+    can replace the SQLite one without touching callers.
+    """
+
+    def acquire(self, name, holder, ttl, data=None):
+        """Take or renew ``name`` for ``holder``; return whether it is held."""
+        raise NotImplementedError
+
+    def release(self, name, holder):
+        raise NotImplementedError
+
+    def leases(self, prefix=''):
+        """Return {name: (holder, data)} of unexpired leases whose name starts with ``prefix``."""
+        raise NotImplementedError
+
+
+class SQLiteCoordinator(Coordinator):
+    """Leases in a SQLite file, for nodes on one host (or tests).
+
+    Every call is one short transaction; ``BEGIN IMMEDIATE`` serialises
+    competing acquires across processes. Expiry uses the wall clock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS leases ("
+                "name TEXT PRIMARY KEY, holder TEXT NOT NULL, data TEXT, expires REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def acquire(self, name, holder, ttl, data=None):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT holder, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            held = row is None or row[0] == holder or row[1] <= now
+            if held:
+                conn.execute(
+                    "INSERT OR REPLACE INTO leases (name, holder, data, expires) VALUES (?, ?, ?, ?)",
+                    (name, holder, json.dumps(data), now + ttl)
+                )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return held
+
+    def release(self, name, holder):
+        self._connect().execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+    def leases(self, prefix=''):
+        rows = self._connect().execute(
+            "SELECT name, holder, data FROM leases WHERE name LIKE ? ESCAPE '\\' AND expires > ?",
+            (prefix.replace('%', r'\%').replace('_', r'\_') + '%', time.time())
+        )
+        return {name: (holder, json.loads(data)) for name, holder, data in rows}
+
+
+class Lease:
+    """Hold one lease from a background thread, renewing it every ``ttl / 3``.
+
+    ``on_change(held)`` runs on that thread whenever the lease is won or
+    lost. A lease whose renewal keeps failing counts as lost once ``ttl``
+    has passed since the last successful renewal, the moment other nodes
+    may take it.
+    """
+
+    def __init__(self, coordinator, name, holder, ttl=15, data=None, on_change=None):
+        self.coordinator = coordinator
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.data = data
+        self.on_change = on_change
+        self.held = False
+        self._renewed = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"lease-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(5)
+        if self.held:
+            # Given up on purpose, so on_change is not told
+            self.held = False
+            try:
+                self.coordinator.release(self.name, self.holder)
+            except Exception as e:
+                logger.error(f"Error releasing lease {self.name}: {str(e)}")
+
+    def wait(self, timeout=None):
+        """Block until the lease is held or ``timeout`` passes; return whether it is held."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.held and not self._stop.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(0.1)
+        return self.held
+
+    def _set(self, held):
+        if held != self.held:
+            self.held = held
+            logger.info(f"{'Acquired' if held else 'Lost'} lease {self.name} as {self.holder}")
+            if self.on_change:
+                try:
+                    self.on_change(held)
+                except Exception as e:
+                    logger.error(f"Error handling lease {self.name} change: {str(e)}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                won = self.coordinator.acquire(self.name, self.holder, self.ttl, self.data)
+                if won:
+                    self._renewed = time.monotonic()
+                self._set(won)
+            except Exception as e:
+                logger.error(f"Error renewing lease {self.name}: {str(e)}")
+                if self.held and time.monotonic() - self._renewed >= self.ttl:
+                    self._set(False)
+            self._stop.wait(self.ttl / 3)
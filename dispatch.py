@@ -0,0 +1,80 @@
+import logging
+import queue
+import threading
+
+from telegram import Update
+from telegram.ext import Dispatcher
+
+logger = logging.getLogger(__name__)
+
+
+class ShardedDispatcher(Dispatcher):
+    """Dispatcher that runs handlers on a pool of shard threads.
+
+    Each update goes to the shard chosen by its user id (or chat id when
+    there is no user), so updates of one user are handled in order while
+    different users are handled in parallel. A slow handler only delays
+    the users that share its shard.
+
+    With ``route``, each update is first offered to it; updates it
+    returns True for were passed on to another node and are not handled
+    here. Updates passed on by other nodes come in through ``process_local``.
+    """
+
+    def __init__(self, *args, shards=8, route=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shards = shards
+        self.route = route
+        self._shard_queues = [queue.Queue() for _ in range(shards)]
+        self._shard_threads = []
+
+    @staticmethod
+    def shard_key(update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return update.update_id
+
+    def process_update(self, update):
+        if self.route is not None and isinstance(update, Update) and self.route(update):
+            return
+        self.process_local(update)
+
+    def process_local(self, update):
+        if not isinstance(update, Update) or not self._shard_threads:
+            # Errors put on the queue and updates arriving before start run inline
+            super().process_update(update)
+            return
+        self._shard_queues[self.shard_key(update) % self.shards].put(update)
+
+    def _run_shard(self, shard_queue):
+        while True:
+            update = shard_queue.get()
+            if update is None:
+                return
+            try:
+                super().process_update(update)
+            except Exception as e:
+                logger.error(f"Error processing update {update.update_id}: {str(e)}")
+
+    def pending(self):
+        return sum(shard_queue.qsize() for shard_queue in self._shard_queues)
+
+    def start(self, ready=None):
+        if not self._shard_threads:
+            for i, shard_queue in enumerate(self._shard_queues):
+                thread = threading.Thread(
+                    target=self._run_shard, args=(shard_queue,), name=f"dispatch-shard-{i}", daemon=True
+                )
+                thread.start()
+                self._shard_threads.append(thread)
+        super().start(ready)
+
+    def stop(self):
+        super().stop()
+        for shard_queue in self._shard_queues:
+            shard_queue.put(None)
+        for thread in self._shard_threads:
+            thread.join(5)
+        self._shard_threads = []
@@ -0,0 +1,90 @@
+import heapq
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryScheduler:
+    """Expire keys at their deadline using one heap and one thread.
+
+    ``schedule`` and ``cancel`` are O(log n) and O(1). Rescheduling a key
+    only records its new deadline and pushes a fresh heap entry; the old
+    entry is recognised as stale when it reaches the top and is dropped.
+    The thread sleeps until the earliest deadline instead of polling, so
+    idle entries cost nothing.
+    """
+
+    def __init__(self, on_expire):
+        self.on_expire = on_expire
+        self._deadlines = {}  # key -> current deadline (time.time())
+        self._heap = []
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def schedule(self, key, deadline):
+        """Expire ``key`` at ``deadline``, replacing any earlier deadline."""
+        with self._cond:
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, key))
+            if len(self._heap) > 2 * len(self._deadlines) + 1024:
+                self._heap = [(d, k) for k, d in self._deadlines.items()]
+                heapq.heapify(self._heap)
+            if self._heap[0][1] == key:
+                self._cond.notify()
+
+    def cancel(self, key):
+        with self._cond:
+            self._deadlines.pop(key, None)
+
+    def deadline(self, key):
+        with self._cond:
+            return self._deadlines.get(key)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._deadlines)
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='expiry', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(5)
+
+    def _pop_due(self):
+        """Block until a key is due and return it, or ``None`` when stopped."""
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                deadline, key = self._heap[0]
+                if self._deadlines.get(key) != deadline:
+                    heapq.heappop(self._heap)
+                    continue
+                delay = deadline - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                del self._deadlines[key]
+                return key
+        return None
+
+    def _run(self):
+        while True:
+            key = self._pop_due()
+            if key is None:
+                return
+            try:
+                self.on_expire(key)
+            except Exception as e:
+                logger.error(f"Error expiring {key}: {str(e)}")
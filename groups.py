@@ -0,0 +1,100 @@
+import collections
+import heapq
+import logging
+import threading
+import time
+
+from telegram.error import RetryAfter, TelegramError
+
+from notifier import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Longest text kept per cached group message
+MAX_TEXT_LENGTH = 1000
+# Deletions per second, leaving most of the Bot API's ~30 calls/s to notifications
+DELETE_RATE = 10
+
+
+class ChatMessageCache:
+    """Recent message texts of group chats, so edits can show what changed.
+
+    Each chat keeps its last ``per_chat`` messages, oldest evicted first,
+    and at most ``max_chats`` chats are kept, least recently active
+    evicted first.
+    """
+
+    def __init__(self, per_chat=200, max_chats=10000):
+        self.per_chat = per_chat
+        self.max_chats = max_chats
+        self._chats = collections.OrderedDict()  # chat_id -> OrderedDict(message_id -> text)
+        self._lock = threading.Lock()
+
+    def remember(self, chat_id, message_id, text):
+        """Store the current text of a message; returns the text it replaces, if known."""
+        with self._lock:
+            messages = self._chats.get(chat_id)
+            if messages is None:
+                messages = self._chats[chat_id] = collections.OrderedDict()
+                if len(self._chats) > self.max_chats:
+                    self._chats.popitem(last=False)
+            else:
+                self._chats.move_to_end(chat_id)
+            previous = messages.pop(message_id, None)
+            messages[message_id] = (text or '')[:MAX_TEXT_LENGTH]
+            if len(messages) > self.per_chat:
+                messages.popitem(last=False)
+            return previous
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(messages) for messages in self._chats.values())
+
+
+class DeleteSweeper:
+    """Delete bot messages after a delay, from one periodic job.
+
+    ``schedule`` only pushes onto a heap; ``sweep``, run every few seconds
+    by the job queue, deletes what is due through a token bucket of
+    ``rate`` deletions per second, holding up to ``burst``. Whatever the
+    bucket cannot cover, or Telegram asks to retry later, waits for a later
+    sweep, so a sweep never blocks the job queue.
+    """
+
+    def __init__(self, rate=DELETE_RATE, burst=5 * DELETE_RATE):
+        self._heap = []  # (due time, chat_id, message_id)
+        self._lock = threading.Lock()
+        self._bucket = TokenBucket(rate, burst)
+
+    def schedule(self, chat_id, message_id, delay):
+        with self._lock:
+            heapq.heappush(self._heap, (time.time() + delay, chat_id, message_id))
+
+    def pending(self):
+        with self._lock:
+            return len(self._heap)
+
+    def _next_due(self):
+        with self._lock:
+            if self._heap and self._heap[0][0] <= time.time():
+                return heapq.heappop(self._heap)
+        return None
+
+    def sweep(self, bot):
+        while True:
+            item = self._next_due()
+            if item is None:
+                return
+            if not self._bucket.try_acquire():
+                with self._lock:
+                    heapq.heappush(self._heap, item)
+                return
+            _, chat_id, message_id = item
+            try:
+                bot.delete_message(chat_id=chat_id, message_id=message_id)
+            except RetryAfter as e:
+                logger.warning(f"Rate limited deleting messages, retrying in {e.retry_after}s")
+                self.schedule(chat_id, message_id, float(e.retry_after))
+                return
+            except TelegramError as e:
+                logger.warning(f"Error deleting message {message_id} in chat {chat_id}: {str(e)}")
@@ -1,7 +1,10 @@
 import multiprocessing
+import os
 
 # Server socket
-bind = "0.0.0.0:10000"
+# Serves web:app; webhook updates are handed to the bot process (BOT_MODE=webhook)
+# through UPDATE_QUEUE_ADDRESS, so run the bot process on a different PORT.
+bind = f"0.0.0.0:{os.getenv('WEB_PORT', 10000)}"
 backlog = 2048
 
 # Worker processes
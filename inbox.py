@@ -0,0 +1,85 @@
+import collections
+import threading
+
+from preview import preview_of
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+# Room left for the keyboard hint and anything the caller appends
+RESERVED_LENGTH = 200
+
+
+class InboxRenderer:
+    """Render inboxes page by page and cache the result.
+
+    Every cached page carries the inbox version it was rendered from
+    (see ``storage.inbox_version``), so a page is rebuilt only after the
+    inbox actually changed. The renderer also remembers which page and
+    text each inbox message in a chat shows, so a refresh that would
+    produce the same text can skip the edit.
+    """
+
+    def __init__(self, page_size=5, max_cached=5000):
+        self.page_size = page_size
+        self.max_cached = max_cached
+        self._pages = collections.OrderedDict()  # (address, page) -> (version, text, pages)
+        self._shown = collections.OrderedDict()  # (chat_id, message_id) -> (address, page, hash of text)
+        self._lock = threading.Lock()
+
+    def _remember(self, cache, key, value):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            if len(cache) > self.max_cached:
+                cache.popitem(last=False)
+
+    def render(self, storage, address, page=1):
+        """Return (text, page, pages, version) for one page of an inbox."""
+        version = storage.inbox_version(address)
+        with self._lock:
+            cached = self._pages.get((address, page))
+        if cached is not None and cached[0] == version:
+            return cached[1], page, cached[2], version
+
+        inbox = storage.get_emails(address)
+        if not inbox:
+            return "📥 Inbox is empty", 1, 1, version
+        pages = (len(inbox) + self.page_size - 1) // self.page_size
+        page = min(max(page, 1), pages)
+        first = (page - 1) * self.page_size
+        lines = [f"📥 Inbox ({len(inbox)} messages):\n\n"]
+        for i, msg in enumerate(inbox[first:first + self.page_size], first + 1):
+            preview = preview_of(msg)
+            lines.append(
+                f"{i}. From: {preview['from_md']}\n"
+                f"   Subject: {preview['subject_md']}\n"
+                f"   Date: {preview['date_md']}\n"
+            )
+            if preview['code']:
+                lines.append(f"   Code: `{preview['code']}`\n")
+            lines.append(f"   Body: {preview['text_md']}\n\n")
+        text = self._fit(lines, MAX_MESSAGE_LENGTH - RESERVED_LENGTH)
+        if version:
+            # Version 0 means no change was recorded for this inbox
+            self._remember(self._pages, (address, page), (version, text, pages))
+        return text, page, pages, version
+
+    @staticmethod
+    def _fit(lines, limit):
+        # Cut between lines, never inside one, so no Markdown entity or escape is split
+        text, length = [], 0
+        for line in lines:
+            if length + len(line) > limit - 1:
+                text.append('…')
+                break
+            text.append(line)
+            length += len(line)
+        return ''.join(text)
+
+    def is_shown(self, chat_id, message_id, address, page, text):
+        """Return whether this message already shows ``text`` as ``page`` of ``address``."""
+        with self._lock:
+            return self._shown.get((chat_id, message_id)) == (address, page, hash(text))
+
+    def mark_shown(self, chat_id, message_id, address, page, text):
+        self._remember(self._shown, (chat_id, message_id), (address, page, hash(text)))
@@ -0,0 +1,159 @@
+import logging
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+from webhook import parse_address
+
+logger = logging.getLogger(__name__)
+
+_ingest = None
+
+
+class Moving(ConnectionError):
+    """The address is being handed over between nodes; try again shortly."""
+
+
+class Ingest:
+    """What a bot process offers other processes: delivery, RCPT checks, admission and updates.
+
+    With ``route`` (key -> RemoteIngest of the owning node, or ``None`` for
+    this one), mail and lookups for addresses owned by other nodes are
+    passed on to them. Calls that were already passed on (``forwarded``)
+    are always handled here, so nodes whose views of the cluster briefly
+    differ cannot bounce a message between them.
+
+    ``is_live`` answers ``None`` for an address that may still be on its
+    way here after a cluster change; ``deliver`` raises ``Moving`` for it.
+    """
+
+    def __init__(self, deliver, is_live, overloaded, dispatch=None, route=None, adopt=None):
+        self._deliver = deliver
+        self._is_live = is_live
+        self._overloaded = overloaded
+        self._dispatch = dispatch
+        self._route = route
+        self._adopt = adopt
+
+    def _peer(self, address, forwarded):
+        return None if forwarded or self._route is None else self._route(address.lower())
+
+    def deliver(self, to_addr, record, forwarded=False):
+        peer = self._peer(to_addr, forwarded)
+        if peer is not None:
+            peer.deliver(to_addr, record, forwarded=True)
+        else:
+            self._deliver(to_addr, record)
+
+    def is_live(self, address, forwarded=False):
+        peer = self._peer(address, forwarded)
+        if peer is not None:
+            return peer.is_live(address, forwarded=True)
+        return self._is_live(address)
+
+    def overloaded(self):
+        return self._overloaded()
+
+    def dispatch(self, data):
+        """Handle a raw Telegram update passed on by the node that received it."""
+        self._dispatch(data)
+
+    def adopt(self, batch):
+        """Take over addresses and users handed over by the node that held them."""
+        self._adopt(batch)
+
+
+class IngestManager(BaseManager):
+    """Shares the ``Ingest`` of a bot process with SMTP role processes and other nodes."""
+
+
+IngestManager.register('get_ingest', callable=lambda: _ingest)
+
+
+def serve_ingest(address, authkey, ingest):
+    """Accept mail, lookups and updates from other processes at ``address``."""
+    global _ingest
+    _ingest = ingest
+    manager = IngestManager(address=parse_address(address), authkey=authkey.encode())
+    server = manager.get_server()
+    thread = threading.Thread(target=server.serve_forever, name='mail-queue-server', daemon=True)
+    thread.start()
+    logger.info(f"Serving mail queue on {address}")
+
+
+class RemoteIngest:
+    """Client side of ``serve_ingest``, used by the SMTP role and by other nodes.
+
+    Connects lazily and again after the bot process restarts. While the
+    bot process is unreachable ``overloaded`` reports it, so the SMTP
+    server answers 451 and senders retry; ``deliver`` raises
+    ``ConnectionError``. The admission state is polled at most every
+    ``poll_interval`` seconds. ``in`` tests liveness, so an instance can
+    stand in for the Bloom filter of SMTP worker processes, and it pickles
+    without its connection.
+    """
+
+    def __init__(self, address, authkey, poll_interval=0.2):
+        self.address = address
+        self.authkey = authkey
+        self.poll_interval = poll_interval
+        self._proxy = None
+        self._overloaded = None
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        return {'address': self.address, 'authkey': self.authkey, 'poll_interval': self.poll_interval}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _call(self, method, *args):
+        with self._lock:
+            if self._proxy is None:
+                manager = IngestManager(address=parse_address(self.address), authkey=self.authkey.encode())
+                try:
+                    manager.connect()
+                    self._proxy = manager.get_ingest()
+                except (OSError, EOFError) as e:
+                    raise ConnectionError(f"Bot process unreachable at {self.address}: {str(e)}")
+            proxy = self._proxy
+        try:
+            return getattr(proxy, method)(*args)
+        except Moving:
+            raise
+        except (OSError, EOFError) as e:
+            # Reconnect on the next call
+            self._proxy = None
+            raise ConnectionError(f"Lost connection to bot process: {str(e)}")
+
+    def deliver(self, to_addr, record, forwarded=False):
+        self._call('deliver', to_addr, record, forwarded)
+
+    def is_live(self, address, forwarded=False):
+        try:
+            return self._call('is_live', address, forwarded)
+        except ConnectionError:
+            # overloaded() refuses mail meanwhile; the bot drops it if nobody holds the address
+            return True
+
+    def dispatch(self, data):
+        self._call('dispatch', data)
+
+    def adopt(self, batch):
+        self._call('adopt', batch)
+
+    def __contains__(self, address):
+        return self.is_live(address) is not False
+
+    def overloaded(self):
+        now = time.monotonic()
+        if now - self._checked >= self.poll_interval:
+            try:
+                self._overloaded = self._call('overloaded')
+            except ConnectionError as e:
+                if self._overloaded != 'bot_unreachable':
+                    logger.error(str(e))
+                self._overloaded = 'bot_unreachable'
+            self._checked = now
+        return self._overloaded
@@ -0,0 +1,117 @@
+import hashlib
+import hmac
+import threading
+import time
+
+from preview import preview_of
+
+
+class InboxWaiters:
+    """Requests blocked until an inbox changes.
+
+    A watched address has a Condition, created by its first waiter and
+    dropped with the last, so unwatched addresses cost nothing. Waiters
+    sleep in ``Condition.wait`` until the storage calls ``notify`` for
+    their address, which wakes them as soon as the change is readable.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conditions = {}  # address -> [Condition, number of waiters]
+
+    def notify(self, address):
+        with self._lock:
+            entry = self._conditions.get(address)
+            if entry is not None:
+                entry[0].notify_all()
+
+    def wait(self, address, predicate, timeout):
+        """Block until ``predicate()`` is true or ``timeout`` seconds pass; return its last value."""
+        with self._lock:
+            entry = self._conditions.get(address)
+            if entry is None:
+                entry = self._conditions[address] = [threading.Condition(self._lock), 0]
+            entry[1] += 1
+            try:
+                return entry[0].wait_for(predicate, timeout)
+            finally:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._conditions[address]
+
+    def __len__(self):
+        with self._lock:
+            return sum(entry[1] for entry in self._conditions.values())
+
+
+def message_json(record, body):
+    """JSON form of a stored message; ``body(record)`` returns its full text."""
+    preview = preview_of(record)
+    return {
+        'from': record['from'],
+        'subject': str(record['subject']),
+        'date': str(record['date']),
+        'received': record.get('received'),
+        'code': preview['code'],
+        'link': preview['link'],
+        'body': body(record),
+        'attachments': [
+            {'name': attachment['name'], 'type': attachment['type'], 'size': attachment['size']}
+            for attachment in record.get('attachments') or ()
+        ],
+    }
+
+
+def address_token(secret, address):
+    """Token that grants API access to one address."""
+    return hmac.new(secret, address.lower().encode(), hashlib.sha256).hexdigest()[:32]
+
+
+class InboxAPI:
+    """JSON inbox reads that wait for new mail.
+
+    ``get`` returns the messages of an address newer than ``since``; with
+    none yet it blocks up to ``wait`` seconds (at most ``max_wait``) on
+    ``waiters`` and answers as soon as one is stored. Message ids only
+    grow, so the highest id seen is the ``since`` of the next request.
+    ``body(record)`` returns the full text of a stored message.
+    """
+
+    def __init__(self, storage, waiters, is_live, secret, body=None, max_wait=60, max_waiters=1000):
+        self.storage = storage
+        self.waiters = waiters
+        self.is_live = is_live
+        self.secret = secret
+        self.body = body or (lambda record: record['body'])
+        self.max_wait = max_wait
+        self.max_waiters = max_waiters
+
+    def message(self, message_id, record):
+        return dict(message_json(record, self.body), id=message_id)
+
+    def get(self, address, token, since=0, wait=0):
+        """Return (JSON body, HTTP status) for a read of ``address``."""
+        address = address.lower()
+        if not hmac.compare_digest(token, address_token(self.secret, address)):
+            return {'error': 'forbidden'}, 403
+        if not self.is_live(address):
+            return {'error': 'unknown_address'}, 404
+        deadline = time.monotonic() + min(max(wait, 0), self.max_wait)
+        while True:
+            # Read the version first, so a message stored after the read below still wakes us
+            version = self.storage.inbox_version(address)
+            messages = self.storage.emails_since(address, since)
+            remaining = deadline - time.monotonic()
+            if messages or remaining <= 0:
+                break
+            if len(self.waiters) >= self.max_waiters:
+                return {'error': 'too_many_waiters'}, 503
+            self.waiters.wait(address, lambda: self.storage.inbox_version(address) != version, remaining)
+            if not self.is_live(address):
+                return {'error': 'unknown_address'}, 404
+        messages = [self.message(message_id, record) for message_id, record in messages]
+        return {
+            'address': address,
+            'messages': messages,
+            'since': messages[-1]['id'] if messages else since,
+        }, 200
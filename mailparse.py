@@ -0,0 +1,205 @@
+import base64
+import binascii
+import email
+import quopri
+import re
+from email import policy
+from email.parser import BytesHeaderParser
+from html.parser import HTMLParser
+
+# Characters of body text kept at accept time in lazy mode
+PREVIEW_CHARS = 500
+
+_header_parser = BytesHeaderParser(policy=policy.default)
+_blank_line = re.compile(rb'\r?\n\r?\n')
+
+
+_BLOCK_TAGS = frozenset(('p', 'div', 'br', 'tr', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'blockquote'))
+_SKIP_TAGS = frozenset(('script', 'style', 'head', 'title'))
+
+
+class _TextExtractor(HTMLParser):
+    """Collect the visible text of an HTML body; links become "text (url)"."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+        self._href = None
+        self._anchor_start = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIP_TAGS:
+            self._skip += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag == 'a':
+            href = dict(attrs).get('href') or ''
+            self._href = href if href.startswith(('http://', 'https://')) else None
+            self._anchor_start = len(self.parts)
+
+    def handle_endtag(self, tag):
+        if tag in _SKIP_TAGS:
+            self._skip = max(0, self._skip - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append('\n')
+        elif tag == 'a' and self._href:
+            if self._href not in ''.join(self.parts[self._anchor_start:]):
+                self.parts.append(f' ({self._href})')
+            self._href = None
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(markup):
+    """Return the visible text of an HTML document."""
+    extractor = _TextExtractor()
+    extractor.feed(markup)
+    extractor.close()
+    text = ''.join(extractor.parts)
+    return re.sub(r'[ \t\r\f\v]*\n\s*', '\n', re.sub(r'[ \t\xa0]+', ' ', text)).strip()
+
+
+def parse_full(raw):
+    """Parse the complete MIME tree of a message."""
+    return email.message_from_bytes(raw, policy=policy.default)
+
+
+def text_body(msg):
+    """Return the first text/plain body of a parsed message, else its HTML as text."""
+    html_part = None
+    for part in msg.walk():
+        if part.is_multipart() or part.get_content_disposition() == 'attachment':
+            continue
+        content_type = part.get_content_type()
+        if content_type == 'text/plain':
+            return part.get_content()
+        if content_type == 'text/html' and html_part is None:
+            html_part = part
+    return html_to_text(html_part.get_content()) if html_part is not None else ''
+
+
+def _split(raw, start, end):
+    """Return (headers, body_start) for the entity in raw[start:end]."""
+    match = _blank_line.search(raw, start, end)
+    header_end, body_start = (match.start(), match.end()) if match else (end, end)
+    return _header_parser.parsebytes(raw[start:header_end]), body_start
+
+
+def parse_headers(raw):
+    """Parse only the top-level header block of a message."""
+    return _split(raw, 0, len(raw))[0]
+
+
+def _decode(raw, start, end, headers, limit):
+    """Decode at most ``limit`` characters of a leaf part without copying the rest."""
+    cte = str(headers.get('content-transfer-encoding', '7bit')).strip().lower()
+    charset = headers.get_content_charset() or 'utf-8'
+    if cte == 'base64':
+        chunk = re.sub(rb'\s+', b'', raw[start:min(end, start + limit * 6 + 8)])
+        try:
+            data = base64.b64decode(chunk[:len(chunk) - len(chunk) % 4])
+        except (binascii.Error, ValueError):
+            data = b''
+    elif cte == 'quoted-printable':
+        data = quopri.decodestring(raw[start:min(end, start + limit * 12)])
+    else:
+        data = raw[start:min(end, start + limit * 4)]
+    try:
+        text = data.decode(charset, errors='replace')
+    except LookupError:
+        text = data.decode('utf-8', errors='replace')
+    return text[:limit]
+
+
+def _walk(raw, start, end, headers, depth=0):
+    """Yield (headers, body_start, body_end) for each leaf part, in order."""
+    if headers.get_content_maintype() == 'multipart':
+        boundary = headers.get_param('boundary')
+        if not boundary or depth > 10:
+            return
+        delimiter = b'--' + str(boundary).encode('ascii', 'replace')
+        pos = raw.find(delimiter, start, end)
+        while pos != -1:
+            line_end = raw.find(b'\n', pos, end)
+            if line_end == -1 or raw.startswith(b'--', pos + len(delimiter)):
+                break
+            part_start = line_end + 1
+            next_pos = raw.find(b'\n' + delimiter, part_start, end)
+            part_end = next_pos if next_pos != -1 else end
+            if part_end > part_start and raw[part_end - 1:part_end] == b'\r':
+                part_end -= 1
+            part_headers, body_start = _split(raw, part_start, part_end)
+            yield from _walk(raw, body_start, part_end, part_headers, depth + 1)
+            pos = next_pos + 1 if next_pos != -1 else -1
+        return
+    yield headers, start, end
+
+
+def _find_text(raw, start, end, headers, limit):
+    html_part = None
+    for part_headers, part_start, part_end in _walk(raw, start, end, headers):
+        if part_headers.get_content_disposition() == 'attachment':
+            continue
+        content_type = part_headers.get_content_type()
+        if content_type == 'text/plain':
+            return _decode(raw, part_start, part_end, part_headers, limit)
+        if content_type == 'text/html' and html_part is None:
+            html_part = (part_headers, part_start, part_end)
+    if html_part is not None:
+        part_headers, part_start, part_end = html_part
+        # Markup takes several times the space of the text it shows
+        return html_to_text(_decode(raw, part_start, part_end, part_headers, limit * 8))[:limit]
+    return None
+
+
+def iter_attachments(raw):
+    """Yield (headers, body_start, body_end) for each attachment of a raw message.
+
+    A part is an attachment if its disposition says so or it has a file
+    name. Parts are located by boundary scanning, without decoding them.
+    """
+    headers, body_start = _split(raw, 0, len(raw))
+    if headers.get_content_maintype() != 'multipart':
+        return
+    for part_headers, start, end in _walk(raw, body_start, len(raw), headers):
+        if part_headers.get_content_disposition() == 'attachment' or part_headers.get_filename():
+            yield part_headers, start, end
+
+
+def iter_decoded(raw, start, end, headers, chunk_size=64 * 1024):
+    """Yield the decoded payload of a leaf part in chunks of about ``chunk_size``."""
+    cte = str(headers.get('content-transfer-encoding', '7bit')).strip().lower()
+    view = memoryview(raw)
+    if cte not in ('base64', 'quoted-printable'):
+        for pos in range(start, end, chunk_size):
+            yield view[pos:min(end, pos + chunk_size)]
+        return
+    carry = b''
+    pos = start
+    while pos < end:
+        # Cut windows at line ends so no encoded sequence is split
+        cut = raw.rfind(b'\n', pos, min(end, pos + chunk_size)) + 1 if pos + chunk_size < end else end
+        if cut <= pos:
+            cut = min(end, pos + chunk_size)
+        if cte == 'base64':
+            data = carry + re.sub(rb'[^A-Za-z0-9+/=]+', b'', raw[pos:cut])
+            usable = len(data) - len(data) % 4
+            carry = data[usable:]
+            yield base64.b64decode(data[:usable])
+        else:
+            yield quopri.decodestring(raw[pos:cut])
+        pos = cut
+
+
+def parse_preview(raw, limit=PREVIEW_CHARS):
+    """Parse headers and a bounded text/plain preview of a raw message.
+
+    Multipart bodies are scanned by boundary only; attachments are skipped
+    without being decoded or copied.
+    """
+    headers, body_start = _split(raw, 0, len(raw))
+    text = _find_text(raw, body_start, len(raw), headers, limit)
+    return headers, text or ''
@@ -0,0 +1,91 @@
+import functools
+import os
+import time
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Histogram, generate_latest, start_http_server
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# Set PROMETHEUS_MULTIPROC_DIR to aggregate histograms from SMTP worker processes
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+SMTP_DATA_SECONDS = Histogram(
+    'tempmail_smtp_data_seconds', 'Time spent in handle_DATA per message',
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5)
+)
+MIME_PARSE_SECONDS = Histogram(
+    'tempmail_mime_parse_seconds', 'Time spent parsing a received message',
+    buckets=(.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, 1)
+)
+NOTIFY_LATENCY_SECONDS = Histogram(
+    'tempmail_notification_latency_seconds', 'Time from mail accepted to Telegram notification sent',
+    buckets=(.05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+COMMAND_SECONDS = Histogram(
+    'tempmail_command_seconds', 'Telegram handler latency', ['command'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+)
+
+
+class StateCollector:
+    """Gauges computed when /metrics is scraped, so they cost nothing per message."""
+
+    def __init__(self):
+        self._gauges = {}
+
+    def add(self, name, documentation, func, label=None):
+        """Register ``func``; with ``label`` it returns a {label value: number} dict."""
+        self._gauges[name] = (documentation, func, label)
+
+    def collect(self):
+        for name, (documentation, func, label) in list(self._gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                continue
+            if label is None:
+                yield GaugeMetricFamily(name, documentation, value=value)
+            else:
+                family = GaugeMetricFamily(name, documentation, labels=[label])
+                for label_value, number in value.items():
+                    family.add_metric([label_value], number)
+                yield family
+
+
+state = StateCollector()
+REGISTRY.register(state)
+
+
+def timed(command, func):
+    """Wrap a Telegram handler so its latency is recorded under ``command``."""
+    histogram = COMMAND_SECONDS.labels(command)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+
+def _registry():
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(state)
+        return registry
+    return REGISTRY
+
+
+def render():
+    """Return (body, content type) for the /metrics endpoint."""
+    return generate_latest(_registry()), CONTENT_TYPE_LATEST
+
+
+def serve(port):
+    """Serve /metrics on ``port`` from a background thread, for roles without the Flask app."""
+    start_http_server(port, registry=_registry())
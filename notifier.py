@@ -0,0 +1,282 @@
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, Unauthorized
+
+logger = logging.getLogger(__name__)
+
+# Telegram Bot API limits: ~30 messages per second overall, about one
+# message per second to a private chat and 20 per minute to a group.
+GLOBAL_RATE = 30
+PRIVATE_CHAT_INTERVAL = 1.0
+GROUP_CHAT_INTERVAL = 3.0
+
+
+class TokenBucket:
+    """Blocking token bucket shared by all delivery workers."""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """Take a token if one is available now; return whether it was."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = self.clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Notification:
+    __slots__ = ('chat_id', 'text', 'parse_mode', 'email', 'attempts', 'accepted_at', 'burst')
+
+    def __init__(self, chat_id, text, parse_mode=None, email=None, accepted_at=None, burst=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.parse_mode = parse_mode
+        self.email = email
+        self.attempts = 0
+        self.accepted_at = accepted_at or time.time()
+        self.burst = burst
+
+
+class Burst:
+    """Mails to one address in one chat that share a notification message."""
+
+    __slots__ = ('started', 'summaries', 'message_id', 'queued', 'sending', 'waiting')
+
+    def __init__(self, started):
+        self.started = started
+        self.summaries = []
+        self.message_id = None  # Telegram message to edit once the first is sent
+        self.queued = False     # a job that will show the latest summaries is scheduled
+        self.sending = False
+        self.waiting = None     # that job, held back until the send in flight finishes
+
+
+def render_digest(summaries):
+    return f"📧 {len(summaries)} new emails:\n\n" + "\n".join(summaries)
+
+
+class Notifier:
+    """Queue of outgoing Telegram messages drained by a pool of worker threads.
+
+    ``enqueue`` never blocks on the network, so it is safe to call from the
+    SMTP event loop. Jobs are kept in a heap ordered by the earliest time they
+    may be sent, which spaces out messages to the same chat without holding
+    up other chats, and a global token bucket caps the overall send rate.
+
+    With a ``coalesce_window``, mails to the same address within the window
+    share one Telegram message: the first is sent as is, and later ones
+    edit it into a digest of up to ``max_digest`` summaries. Mails that
+    arrive while an update is still queued cost no extra API call.
+
+    ``clock`` (monotonic seconds) and ``bucket`` (a TokenBucket for the
+    global rate) can be given to control timing, e.g. in tests.
+    """
+
+    def __init__(self, workers=4, global_rate=GLOBAL_RATE, max_retries=5, on_sent=None,
+                 coalesce_window=0, max_digest=10, digest=render_digest, clock=time.monotonic, bucket=None):
+        self.workers = workers
+        self.max_retries = max_retries
+        self.on_sent = on_sent
+        self.coalesce_window = coalesce_window
+        self.max_digest = max_digest
+        self.digest = digest
+        self._bursts = {}  # (chat_id, email) -> Burst
+        self.clock = clock
+        self._bucket = TokenBucket(global_rate, clock=clock) if bucket is None else bucket
+        self._heap = []
+        self._seq = itertools.count()
+        self._chat_next = {}  # chat_id -> earliest monotonic time of the next send
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._bot = None
+
+    def start(self, bot):
+        self._bot = bot
+        self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"notifier-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} notification workers")
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def enqueue(self, chat_id, text, parse_mode=None, email=None, accepted_at=None, summary=None):
+        """Queue a message for ``chat_id`` and return immediately.
+
+        ``accepted_at`` is the time.time() the mail was accepted, for latency
+        metrics. ``summary`` is the line shown for this mail in a digest.
+        """
+        if not self.coalesce_window or email is None or summary is None:
+            self._schedule(Notification(chat_id, text, parse_mode, email, accepted_at))
+            return
+        now = self.clock()
+        with self._cond:
+            key = (chat_id, email)
+            burst = self._bursts.get(key)
+            if (burst is None or now - burst.started > self.coalesce_window
+                    or len(burst.summaries) >= self.max_digest):
+                if len(self._bursts) > 10000:
+                    self._bursts = {
+                        k: b for k, b in self._bursts.items()
+                        if now - b.started <= self.coalesce_window or b.queued or b.sending
+                    }
+                burst = self._bursts[key] = Burst(now)
+            burst.summaries.append(summary)
+            if burst.queued:
+                return
+            burst.queued = True
+        self._schedule(Notification(chat_id, text, parse_mode, email, accepted_at, burst))
+
+    def _chat_interval(self, chat_id):
+        return GROUP_CHAT_INTERVAL if chat_id < 0 else PRIVATE_CHAT_INTERVAL
+
+    def _schedule(self, job, delay=0.0):
+        now = self.clock()
+        with self._cond:
+            ready_at = max(now + delay, self._chat_next.get(job.chat_id, 0.0))
+            self._chat_next[job.chat_id] = ready_at + self._chat_interval(job.chat_id)
+            if len(self._chat_next) > 10000:
+                self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+            heapq.heappush(self._heap, (ready_at, next(self._seq), job))
+            self._cond.notify()
+
+    def _next_job(self):
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - self.clock()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                job = heapq.heappop(self._heap)[2]
+                burst = job.burst
+                if burst is not None:
+                    if burst.sending:
+                        # Wait for the message to edit to exist; checked here so no send token is spent on it
+                        burst.waiting = job
+                        continue
+                    burst.queued = False
+                    burst.sending = True
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            self._bucket.acquire()
+            self._send(job)
+
+    def _retry(self, job, delay):
+        burst = job.burst
+        if burst is not None:
+            with self._cond:
+                if burst.queued:
+                    # A newer job will show these summaries
+                    return
+                burst.queued = True
+        self._schedule(job, delay)
+
+    def _send(self, job):
+        # _next_job marked the burst as sending
+        burst = job.burst
+        text, message_id = job.text, None
+        if burst is not None:
+            with self._cond:
+                message_id = burst.message_id
+                if len(burst.summaries) > 1:
+                    text = self.digest(burst.summaries)
+        job.attempts += 1
+        try:
+            if message_id is None:
+                sent_msg = self._bot.send_message(
+                    chat_id=job.chat_id,
+                    text=text,
+                    parse_mode=job.parse_mode
+                )
+            else:
+                sent_msg = self._bot.edit_message_text(
+                    text,
+                    chat_id=job.chat_id,
+                    message_id=message_id,
+                    parse_mode=job.parse_mode
+                )
+        except RetryAfter as e:
+            logger.warning(f"Rate limited sending to {job.chat_id}, retrying in {e.retry_after}s")
+            self._retry(job, float(e.retry_after))
+        except BadRequest as e:
+            if message_id is None:
+                logger.error(f"Error sending notification to user {job.chat_id}: {str(e)}")
+            elif 'not modified' not in str(e).lower():
+                # The notification was deleted; start a new one
+                burst.message_id = None
+                self._retry(job, 0.0)
+        except Unauthorized as e:
+            logger.error(f"Error sending notification to user {job.chat_id}: {str(e)}")
+        except NetworkError as e:
+            if job.attempts > self.max_retries:
+                logger.error(f"Giving up on notification to user {job.chat_id}: {str(e)}")
+                return
+            backoff = min(2 ** job.attempts, 60) * random.uniform(0.5, 1.5)
+            logger.warning(f"Error sending notification to user {job.chat_id}, retrying in {backoff:.1f}s: {str(e)}")
+            self._retry(job, backoff)
+        except Exception as e:
+            logger.error(f"Error sending notification to user {job.chat_id}: {str(e)}")
+        else:
+            if burst is not None and message_id is None:
+                burst.message_id = sent_msg.message_id
+            if self.on_sent:
+                try:
+                    self.on_sent(job, sent_msg)
+                except Exception as e:
+                    logger.error(f"Error recording notification for user {job.chat_id}: {str(e)}")
+        finally:
+            if burst is not None:
+                with self._cond:
+                    burst.sending = False
+                    waiting, burst.waiting = burst.waiting, None
+                    if waiting is not None:
+                        heapq.heappush(self._heap, (self.clock(), next(self._seq), waiting))
+                        self._cond.notify()
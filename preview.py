@@ -0,0 +1,82 @@
+import html
+import re
+
+# Characters of body text shown in notifications and inbox listings
+SNIPPET_CHARS = 200
+SUBJECT_CHARS = 200
+# Characters of body text searched for codes and links
+SCAN_CHARS = 10000
+
+# Keys of a preview record, in the order compact records store them
+PREVIEW_FIELDS = (
+    'text', 'code', 'link', 'from_html', 'subject_html', 'date_html', 'text_html',
+    'from_md', 'subject_md', 'date_md', 'text_md',
+)
+
+_whitespace = re.compile(r'\s+')
+_url = re.compile(r'https?://[^\s<>"\'()\[\]]+')
+_url_in_text = re.compile(r'\(?https?://[^\s<>"\'()\[\]]+\)?')
+_link_words = re.compile(r'verif|confirm|activat|validat|reset|magic|login|sign-?in|auth|token', re.IGNORECASE)
+_code_patterns = (
+    # "Your verification code is 123456", "OTP: 1234"
+    re.compile(r'\b(?:code|otp|pin|passcode|verification|one[- ]time|security)\b\D{0,40}?\b(\d{4,8})\b',
+               re.IGNORECASE),
+    # "123456 is your code"
+    re.compile(r'\b(\d{4,8})\b\D{0,20}?\b(?:is your|code|otp)\b', re.IGNORECASE),
+)
+_markdown_special = re.compile(r'([_*`\[])')
+
+
+def escape_markdown(text):
+    """Escape text for Telegram's legacy Markdown parse mode."""
+    return _markdown_special.sub(r'\\\1', text)
+
+
+def find_code(*texts):
+    """Return the first one-time code found in ``texts``, or ``None``."""
+    for text in texts:
+        for pattern in _code_patterns:
+            match = pattern.search(text)
+            if match:
+                return match.group(1)
+    return None
+
+
+def find_link(text):
+    """Return the first verification-looking link in ``text``, or ``None``."""
+    for match in _url.finditer(text):
+        if _link_words.search(match.group()):
+            return match.group().rstrip('.,;:!')
+    return None
+
+
+def build_preview(record):
+    """Compute everything notifications and inbox pages show for a message.
+
+    Done once at ingest; rendering then only joins these strings.
+    """
+    body = record['body'] or ''
+    subject = str(record['subject'])[:SUBJECT_CHARS]
+    sender = record['from']
+    date = str(record['date'])
+    text = _whitespace.sub(' ', _url_in_text.sub('', body[:SNIPPET_CHARS * 4])).strip()
+    if len(text) > SNIPPET_CHARS:
+        text = text[:SNIPPET_CHARS] + '…'
+    return {
+        'text': text,
+        'code': find_code(subject, body[:SCAN_CHARS]),
+        'link': find_link(body[:SCAN_CHARS]),
+        'from_html': html.escape(sender),
+        'subject_html': html.escape(subject),
+        'date_html': html.escape(date),
+        'text_html': html.escape(text),
+        'from_md': escape_markdown(sender),
+        'subject_md': escape_markdown(subject),
+        'date_md': escape_markdown(date),
+        'text_md': escape_markdown(text),
+    }
+
+
+def preview_of(record):
+    """Return the stored preview of a record, or build one for records stored without."""
+    return record.get('preview') or build_preview(record)
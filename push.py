@@ -0,0 +1,272 @@
+import collections
+import heapq
+import ipaddress
+import itertools
+import json
+import logging
+import random
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+logger = logging.getLogger(__name__)
+
+
+def _is_public(address):
+    return ipaddress.ip_address(address.split('%')[0]).is_global
+
+
+def check_url(url, allow_private=False):
+    """Return why ``url`` cannot be a push target, or ``None`` if it can.
+
+    Unless ``allow_private``, hosts resolving to loopback, private or
+    link-local addresses are refused, so users cannot make the server post
+    to services on its own network.
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return "The URL must start with http:// or https://"
+    if allow_private:
+        return None
+    try:
+        infos = socket.getaddrinfo(parts.hostname, parts.port or 80, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, ValueError):
+        return f"Cannot resolve {parts.hostname}"
+    for info in infos:
+        if not _is_public(info[4][0]):
+            return f"{parts.hostname} is not a public address"
+    return None
+
+
+class _PublicConnectionMixin:
+    def _new_conn(self):
+        sock = super()._new_conn()
+        peer = sock.getpeername()[0]
+        if not _is_public(peer):
+            sock.close()
+            raise NewConnectionError(self, f"{self.host} connected to {peer}, which is not a public address")
+        return sock
+
+
+class _PublicHTTPConnection(_PublicConnectionMixin, HTTPConnection):
+    pass
+
+
+class _PublicHTTPSConnection(_PublicConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _PublicHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _PublicHTTPConnection
+
+
+class _PublicHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _PublicHTTPSConnection
+
+
+class PublicAddressAdapter(HTTPAdapter):
+    """HTTPAdapter that only connects to public addresses.
+
+    ``check_url`` resolves the host when a URL is set; this checks the
+    address each connection is actually made to, so a host that resolves
+    to a private address later (DNS rebinding) is still refused.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _PublicHTTPConnectionPool, 'https': _PublicHTTPSConnectionPool
+        }
+
+
+class Target:
+    """Messages waiting for one URL and the state of its deliveries."""
+
+    __slots__ = ('url', 'queue', 'in_flight', 'ready_at', 'scheduled', 'failures')
+
+    def __init__(self, url):
+        self.url = url
+        self.queue = collections.deque()  # (address, record), oldest first
+        self.in_flight = 0
+        self.ready_at = 0.0  # monotonic time before which nothing is sent, while backing off
+        self.scheduled = False  # the target is in the heap
+        self.failures = 0  # consecutive failed requests
+
+
+class Pusher:
+    """POSTs received mail to user-supplied URLs from a pool of worker threads.
+
+    ``enqueue`` only appends to the queue of the target URL, so it is safe
+    to call from the SMTP event loop. Each request carries every message
+    queued for its target, up to ``max_batch``, so a target that falls
+    behind gets fewer, larger requests instead of a growing backlog. At
+    most ``max_in_flight`` requests go to one target at a time, leaving the
+    other workers free for other targets while it is slow.
+
+    Failed requests (connection errors, timeouts, 429 and 5xx) are retried
+    with jittered exponential backoff, honouring ``Retry-After``. Once a
+    target has failed ``max_retries`` times in a row, each further failure
+    drops the batch it was sending, and a target never holds more than
+    ``max_queue`` messages; the oldest are dropped first. Connections are
+    kept alive in a shared ``requests`` session. ``serialize(record)``
+    turns a stored record into the JSON sent for it. Unless
+    ``allow_private``, connections to non-public addresses are refused
+    (see PublicAddressAdapter).
+    """
+
+    def __init__(self, serialize, workers=4, max_in_flight=2, max_batch=20, max_queue=1000, max_retries=6,
+                 timeout=10, max_backoff=300, allow_private=False):
+        self.serialize = serialize
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.sent = 0
+        self.dropped = 0
+        self._targets = {}  # url -> Target with queued or in-flight messages
+        self._heap = []  # (ready_at, seq, Target)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._session = requests.Session()
+        if allow_private:
+            adapter = HTTPAdapter(pool_connections=256, pool_maxsize=workers)
+        else:
+            adapter = PublicAddressAdapter(pool_connections=256, pool_maxsize=workers)
+            # A proxy from the environment would be the address connected to instead of the target
+            self._session.trust_env = False
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def start(self):
+        self._running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"pusher-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} push workers")
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._session.close()
+
+    def pending(self):
+        with self._cond:
+            return sum(len(target.queue) for target in self._targets.values())
+
+    def __len__(self):
+        with self._cond:
+            return len(self._targets)
+
+    def enqueue(self, url, address, record):
+        """Queue ``record``, received for ``address``, to be posted to ``url``."""
+        with self._cond:
+            target = self._targets.get(url)
+            if target is None:
+                target = self._targets[url] = Target(url)
+            target.queue.append((address, record))
+            if len(target.queue) > self.max_queue:
+                target.queue.popleft()
+                self.dropped += 1
+            self._schedule(target)
+
+    def _schedule(self, target):
+        # Called with self._cond held
+        if target.scheduled or not target.queue or target.in_flight >= self.max_in_flight:
+            return
+        target.scheduled = True
+        heapq.heappush(self._heap, (target.ready_at, next(self._seq), target))
+        self._cond.notify()
+
+    def _next_batch(self):
+        with self._cond:
+            while self._running:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                delay = self._heap[0][0] - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                target = heapq.heappop(self._heap)[2]
+                target.scheduled = False
+                if not target.queue or target.in_flight >= self.max_in_flight:
+                    continue
+                batch = [target.queue.popleft() for _ in range(min(len(target.queue), self.max_batch))]
+                target.in_flight += 1
+                # Let another worker take the rest while this request is out
+                self._schedule(target)
+                return target, batch
+        return None
+
+    def _worker(self):
+        while True:
+            item = self._next_batch()
+            if item is None:
+                return
+            self._send(*item)
+
+    def _send(self, target, batch):
+        retry_after = None
+        try:
+            body = json.dumps({
+                'messages': [dict(self.serialize(record), address=address) for address, record in batch]
+            })
+            response = self._session.post(
+                target.url, data=body, headers={'Content-Type': 'application/json'},
+                timeout=self.timeout, allow_redirects=False
+            )
+        except requests.RequestException as e:
+            error, retry = str(e), True
+        except Exception as e:
+            error, retry = str(e), False
+        else:
+            error = None if 200 <= response.status_code < 300 else f"HTTP {response.status_code}"
+            retry = response.status_code == 429 or response.status_code >= 500
+            if response.status_code == 429:
+                try:
+                    retry_after = float(response.headers.get('Retry-After', ''))
+                except ValueError:
+                    pass
+            response.close()
+        with self._cond:
+            target.in_flight -= 1
+            if error is None:
+                target.failures = 0
+                self.sent += len(batch)
+            elif retry:
+                target.failures += 1
+                backoff = retry_after or min(2 ** target.failures, self.max_backoff) * random.uniform(0.5, 1.5)
+                target.ready_at = time.monotonic() + backoff
+                if target.failures > self.max_retries:
+                    logger.error(f"Giving up on {len(batch)} message(s) for {target.url}: {error}")
+                    self.dropped += len(batch)
+                else:
+                    logger.warning(f"Error pushing to {target.url}, retrying in {backoff:.1f}s: {error}")
+                    target.queue.extendleft(reversed(batch))
+                    while len(target.queue) > self.max_queue:
+                        target.queue.popleft()
+                        self.dropped += 1
+            else:
+                logger.error(f"Error pushing {len(batch)} message(s) to {target.url}: {error}")
+                self.dropped += len(batch)
+            if not target.queue and not target.in_flight and self._targets.get(target.url) is target:
+                del self._targets[target.url]
+            else:
+                self._schedule(target)
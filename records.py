@@ -0,0 +1,111 @@
+import sys
+import zlib
+
+from preview import PREVIEW_FIELDS
+
+# Bodies (and raw messages) at least this long are kept zlib-compressed
+COMPRESS_THRESHOLD = 1024
+
+_KEYS = {
+    'subject': 'subject', 'from': 'sender', 'date': 'date', 'body': 'body', 'received': 'received',
+    'raw': 'raw', 'attachments': 'attachments', 'preview': 'preview', 'parsed': 'parsed',
+}
+
+
+class _CompressedText(bytes):
+    """zlib-compressed UTF-8 text."""
+
+    __slots__ = ()
+
+
+class _CompressedBytes(bytes):
+    """zlib-compressed bytes."""
+
+    __slots__ = ()
+
+
+def _pack(value):
+    # Compressed values get their own types, so short raw messages kept as plain bytes are left alone
+    if value is None or len(value) < COMPRESS_THRESHOLD:
+        return value
+    if isinstance(value, str):
+        return _CompressedText(zlib.compress(value.encode('utf-8')))
+    return _CompressedBytes(zlib.compress(value, 1))
+
+
+def _unpack(value):
+    if isinstance(value, _CompressedText):
+        return zlib.decompress(value).decode('utf-8')
+    if isinstance(value, _CompressedBytes):
+        return zlib.decompress(value)
+    return value
+
+
+def as_dict(record):
+    """Plain dict of the fields of a record or StoredEmail, e.g. to pickle it."""
+    return {key: record.get(key) for key in _KEYS if record.get(key) is not None}
+
+
+class StoredEmail:
+    """Compact in-memory form of a received email.
+
+    Reads like the dict records parse_email produces (``msg['from']``,
+    ``msg.get('raw')``), but keeps fields in slots, interns the sender,
+    holds the preview as a tuple and compresses long bodies until they
+    are read. ``size`` is fixed when the email is stored, so memory
+    accounting stays consistent if the body is replaced later.
+    """
+
+    __slots__ = ('subject', 'sender', 'date', '_body', 'received', '_raw', 'attachments', '_preview',
+                 'parsed', 'size')
+
+    def __init__(self, record):
+        self.subject = str(record['subject'])
+        self.sender = sys.intern(record['from'])
+        self.date = str(record['date'])
+        self._body = _pack(record['body'])
+        self.received = record.get('received')
+        self._raw = _pack(record.get('raw'))
+        self.attachments = record.get('attachments')
+        preview = record.get('preview')
+        self._preview = tuple(preview[field] for field in PREVIEW_FIELDS) if preview else None
+        self.parsed = record.get('parsed', False)
+        self.size = (120 + len(self.subject) + len(self.sender) + len(self.date) + len(self._body)
+                     + len(self._raw or b'') + sum(len(value or '') for value in self._preview or ()))
+
+    @property
+    def body(self):
+        return _unpack(self._body)
+
+    @body.setter
+    def body(self, value):
+        self._body = _pack(value)
+
+    @property
+    def raw(self):
+        return _unpack(self._raw)
+
+    @raw.setter
+    def raw(self, value):
+        self._raw = _pack(value)
+
+    @property
+    def preview(self):
+        return dict(zip(PREVIEW_FIELDS, self._preview)) if self._preview else None
+
+    def get(self, key, default=None):
+        attribute = _KEYS.get(key)
+        value = getattr(self, attribute) if attribute else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        setattr(self, _KEYS[key], value)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
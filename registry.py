@@ -0,0 +1,127 @@
+import sys
+import threading
+
+
+class AddressRegistry:
+    """Two-way index between temporary addresses and the chats that own them.
+
+    Lookups in both directions are O(1): ``owners(address)`` for inbound mail
+    and ``addresses(user_id)`` for commands. A user may hold several live
+    addresses at once; the most recently assigned one is their current
+    address.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._owners = {}     # address -> {user_id: None}
+        self._addresses = {}  # user_id -> {address: None}, in assignment order
+        self._filter = None
+
+    def attach_filter(self, live_filter):
+        """Mirror the set of live addresses into ``live_filter`` (add/discard)."""
+        with self._lock:
+            for address in self._owners:
+                live_filter.add(address)
+            self._filter = live_filter
+
+    @staticmethod
+    def _key(address):
+        return address.strip().lower()
+
+    def assign(self, user_id, address, fresh=False):
+        """Give ``address`` to ``user_id`` and make it their current address.
+
+        With ``fresh`` the address is only assigned if nobody holds it yet;
+        otherwise ``None`` is returned.
+        """
+        address = sys.intern(self._key(address))
+        with self._lock:
+            if address not in self._owners:
+                if self._filter is not None:
+                    self._filter.add(address)
+            elif fresh:
+                return None
+            self._owners.setdefault(address, {})[user_id] = None
+            addresses = self._addresses.setdefault(user_id, {})
+            # Re-insert so the address moves to the end (= current)
+            addresses.pop(address, None)
+            addresses[address] = None
+        return address
+
+    def release(self, user_id, address=None):
+        """Drop one address (the current one by default) from ``user_id``.
+
+        Returns the released address, or ``None`` if the user had none.
+        """
+        with self._lock:
+            addresses = self._addresses.get(user_id)
+            if not addresses:
+                return None
+            if address is None:
+                address = next(reversed(addresses))
+            else:
+                address = self._key(address)
+                if address not in addresses:
+                    return None
+            del addresses[address]
+            if not addresses:
+                del self._addresses[user_id]
+            self._unlink(address, user_id)
+            return address
+
+    def release_address(self, address):
+        """Drop ``address`` from every owner. Returns the former owners."""
+        address = self._key(address)
+        with self._lock:
+            owners = self._owners.pop(address, {})
+            if owners and self._filter is not None:
+                self._filter.discard(address)
+            for user_id in owners:
+                addresses = self._addresses.get(user_id)
+                if addresses is not None:
+                    addresses.pop(address, None)
+                    if not addresses:
+                        del self._addresses[user_id]
+            return list(owners)
+
+    def _unlink(self, address, user_id):
+        owners = self._owners.get(address)
+        if owners is not None:
+            owners.pop(user_id, None)
+            if not owners:
+                del self._owners[address]
+                if self._filter is not None:
+                    self._filter.discard(address)
+
+    def owners(self, address):
+        """Return the chat ids that receive mail for ``address``."""
+        with self._lock:
+            return list(self._owners.get(self._key(address), ()))
+
+    def addresses(self, user_id):
+        """Return all live addresses of ``user_id``, oldest first."""
+        with self._lock:
+            return list(self._addresses.get(user_id, ()))
+
+    def users(self):
+        """Return the ids of users holding addresses."""
+        with self._lock:
+            return list(self._addresses)
+
+    def current(self, user_id):
+        """Return the current address of ``user_id`` or ``None``."""
+        with self._lock:
+            addresses = self._addresses.get(user_id)
+            return next(reversed(addresses)) if addresses else None
+
+    def is_live(self, address):
+        with self._lock:
+            return self._key(address) in self._owners
+
+    def __contains__(self, user_id):
+        with self._lock:
+            return user_id in self._addresses
+
+    def __len__(self):
+        with self._lock:
+            return len(self._owners)
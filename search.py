@@ -0,0 +1,188 @@
+import collections
+import math
+import re
+import threading
+
+_token = re.compile(r'\w{2,40}')
+
+# Weight of a term by the field it appears in
+FIELD_WEIGHTS = (('subject', 3), ('from', 2), ('body', 1))
+# Characters of body text indexed per message
+BODY_CHARS = 4000
+
+
+def tokenize(text):
+    return _token.findall(text.lower())
+
+
+class InboxIndex:
+    """Inverted index of one inbox.
+
+    Storage only ever drops the oldest messages of an inbox, so documents
+    are numbered consecutively and the position of a message in the inbox
+    is its number minus ``first``.
+    """
+
+    __slots__ = ('first', 'next', 'terms', 'documents', 'postings')
+
+    def __init__(self):
+        self.first = 0
+        self.next = 0
+        self.terms = {}      # term -> {document: weight}
+        self.documents = {}  # document -> its terms
+        self.postings = 0
+
+
+class SearchIndex:
+    """Per-inbox inverted indexes over subject, sender and body.
+
+    Storage backends call ``add``, ``drop_oldest`` and ``delete`` as
+    messages come and go. Each message contributes at most ``max_terms``
+    distinct terms; past ``max_postings`` in total, the indexes of the
+    least recently used inboxes are evicted and rebuilt when next searched.
+    ``loader(address, install)`` calls ``install(records)`` with the stored
+    records of an inbox while holding the lock its storage updates the
+    index under, so no change falls between the read and the rebuild.
+    """
+
+    def __init__(self, max_postings=2000000, max_terms=200, loader=None):
+        self.max_postings = max_postings
+        self.max_terms = max_terms
+        self.loader = loader
+        self.postings = 0
+        self._inboxes = collections.OrderedDict()  # address -> InboxIndex, least recently used first
+        self._evicted = set()
+        self._lock = threading.Lock()
+
+    def _terms(self, record):
+        weights = {}
+        for field, weight in FIELD_WEIGHTS:
+            text = str(record.get(field) or '')
+            for term in tokenize(text[:BODY_CHARS] if field == 'body' else text):
+                if term in weights:
+                    weights[term] += weight
+                elif len(weights) < self.max_terms:
+                    weights[term] = weight
+        return weights
+
+    def _add(self, inbox, record):
+        document = inbox.next
+        inbox.next += 1
+        weights = self._terms(record)
+        for term, weight in weights.items():
+            inbox.terms.setdefault(term, {})[document] = weight
+        inbox.documents[document] = tuple(weights)
+        inbox.postings += len(weights)
+        self.postings += len(weights)
+
+    def _drop_oldest(self, inbox):
+        document = inbox.first
+        inbox.first += 1
+        terms = inbox.documents.pop(document, ())
+        for term in terms:
+            postings = inbox.terms[term]
+            del postings[document]
+            if not postings:
+                del inbox.terms[term]
+        inbox.postings -= len(terms)
+        self.postings -= len(terms)
+
+    def _evict(self):
+        while self.postings > self.max_postings and len(self._inboxes) > 1:
+            address, inbox = self._inboxes.popitem(last=False)
+            self.postings -= inbox.postings
+            self._evicted.add(address)
+
+    def add(self, address, record):
+        with self._lock:
+            if address in self._evicted:
+                return
+            inbox = self._inboxes.get(address)
+            if inbox is None:
+                inbox = self._inboxes[address] = InboxIndex()
+            else:
+                self._inboxes.move_to_end(address)
+            self._add(inbox, record)
+            self._evict()
+
+    def drop_oldest(self, address):
+        with self._lock:
+            inbox = self._inboxes.get(address)
+            if inbox is not None:
+                self._drop_oldest(inbox)
+
+    def trim(self, address, keep):
+        """Drop the oldest messages of ``address`` beyond ``keep``."""
+        with self._lock:
+            inbox = self._inboxes.get(address)
+            while inbox is not None and inbox.next - inbox.first > keep:
+                self._drop_oldest(inbox)
+
+    def delete(self, address):
+        with self._lock:
+            self._evicted.discard(address)
+            inbox = self._inboxes.pop(address, None)
+            if inbox is not None:
+                self.postings -= inbox.postings
+
+    def mark_stale(self, addresses):
+        """Index these inboxes from ``loader`` when they are next searched."""
+        with self._lock:
+            for address in addresses:
+                inbox = self._inboxes.pop(address, None)
+                if inbox is not None:
+                    self.postings -= inbox.postings
+                self._evicted.add(address)
+
+    def _load(self, address):
+        if self.loader is not None:
+            self.loader(address, lambda records: self._install(address, records))
+        else:
+            self._install(address, ())
+
+    def _install(self, address, records):
+        with self._lock:
+            if address not in self._evicted:
+                return
+            inbox = self._inboxes[address] = InboxIndex()
+            self._evicted.discard(address)
+            for record in records:
+                self._add(inbox, record)
+            self._evict()
+
+    def search(self, address, query):
+        """Return inbox positions (0 = oldest) of messages matching every term, best first."""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        if address in self._evicted:
+            self._load(address)
+        with self._lock:
+            inbox = self._inboxes.get(address)
+            if inbox is None:
+                return []
+            self._inboxes.move_to_end(address)
+            postings = [inbox.terms.get(term) for term in terms]
+            if not all(postings):
+                return []
+            postings.sort(key=len)
+            total = len(inbox.documents)
+            scores = {}
+            for document in postings[0]:
+                score = 0.0
+                for term_postings in postings:
+                    weight = term_postings.get(document)
+                    if weight is None:
+                        break
+                    score += weight * math.log(1 + total / len(term_postings))
+                else:
+                    scores[document] = score
+            ranked = sorted(scores, key=lambda document: (-scores[document], -document))
+            return [document - inbox.first for document in ranked]
+
+    def memory_used(self):
+        """Rough bytes held by the indexes."""
+        return self.postings * 120 + len(self._inboxes) * 400
+
+    def __len__(self):
+        return len(self._inboxes)
@@ -0,0 +1,36 @@
+"""Run one role of the service.
+
+    python serve.py --role bot    Telegram handlers, inboxes and notifications (one per NODE_ID)
+    python serve.py --role smtp   SMTP front door, hands mail to the bot process
+    python serve.py --role web    Health, metrics and webhook endpoints
+    python serve.py --role all    Everything in one process, like `python bot.py`
+
+Each role imports only the modules it needs, so stateless roles start
+quickly and can be scaled and restarted on their own.
+"""
+import argparse
+
+ROLES = ('bot', 'smtp', 'web', 'all')
+
+
+def load(role):
+    """Import what ``role`` needs and return the function that runs it."""
+    if role == 'web':
+        import web
+        return web.main
+    if role == 'smtp':
+        import smtp_server
+        return smtp_server.main
+    import bot
+    return lambda: bot.main(role)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run one role of the temp mail bot.')
+    parser.add_argument('--role', choices=ROLES, default='all')
+    args = parser.parse_args()
+    load(args.role)()
+
+
+if __name__ == '__main__':
+    main()
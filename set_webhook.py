@@ -0,0 +1,32 @@
+import os
+from telegram import Bot
+from dotenv import load_dotenv
+from webhook import ALLOWED_UPDATES
+
+# Load environment variables
+load_dotenv()
+
+def set_webhook():
+    """Point Telegram at the webhook route of the Flask app."""
+    token = os.getenv("TELEGRAM_BOT_TOKEN")
+    url = os.getenv("WEBHOOK_URL")
+    secret = os.getenv("WEBHOOK_SECRET")
+    path = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+    if not token or not url or not secret:
+        print("Please set TELEGRAM_BOT_TOKEN, WEBHOOK_URL and WEBHOOK_SECRET environment variables.")
+        return
+
+    try:
+        bot = Bot(token)
+        bot.set_webhook(
+            url=url.rstrip('/') + path,
+            allowed_updates=ALLOWED_UPDATES,
+            drop_pending_updates=True,
+            api_kwargs={'secret_token': secret}
+        )
+        print(f"Successfully set webhook to {url.rstrip('/') + path}!")
+    except Exception as e:
+        print(f"Error setting webhook: {str(e)}")
+
+if __name__ == '__main__':
+    set_webhook()
@@ -0,0 +1,42 @@
+"""Settings shared by the bot, SMTP and web roles.
+
+Kept free of heavy imports so every role can read them cheaply.
+"""
+import os
+import tempfile
+
+# Where gunicorn workers hand webhook updates to the bot process
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+UPDATE_QUEUE_ADDRESS = os.getenv('UPDATE_QUEUE_ADDRESS', '127.0.0.1:10001')
+
+# Where SMTP role processes hand received mail to the bot process
+MAIL_QUEUE_ADDRESS = os.getenv('MAIL_QUEUE_ADDRESS', '127.0.0.1:10002')
+MAIL_QUEUE_SECRET = os.getenv('MAIL_QUEUE_SECRET', '')
+# Longest an SMTP session waits on the bot process before answering 451
+MAIL_QUEUE_TIMEOUT = float(os.getenv('MAIL_QUEUE_TIMEOUT_SECONDS', 10))
+
+# Email server settings
+EMAIL_HOST = '0.0.0.0'
+EMAIL_PORT = int(os.getenv('SMTP_PORT', 25))
+DOMAINS = ['10mail.xyz', 'emlhub.com', 'tempmail.plus', 'tempmail.space']
+MAIL_PARSE_MODE = os.getenv('MAIL_PARSE_MODE', 'full')  # 'full' or 'lazy'
+# SMTP server processes sharing EMAIL_PORT via SO_REUSEPORT; 0 runs SMTP in this process
+SMTP_WORKERS = int(os.getenv('SMTP_WORKERS', 0))
+MAX_MESSAGE_SIZE = int(os.getenv('MAX_MESSAGE_SIZE_MB', 10)) * 1024 * 1024  # Advertised as ESMTP SIZE
+# Messages per SMTP client IP and per MAIL FROM address; a rate of 0 disables the limit
+SMTP_CLIENT_RATE_PER_MINUTE = float(os.getenv('SMTP_CLIENT_RATE_PER_MINUTE', 120))
+SMTP_CLIENT_BURST = int(os.getenv('SMTP_CLIENT_BURST', 60))
+SMTP_SENDER_RATE_PER_MINUTE = float(os.getenv('SMTP_SENDER_RATE_PER_MINUTE', 30))
+SMTP_SENDER_BURST = int(os.getenv('SMTP_SENDER_BURST', 20))
+
+# Storage settings
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'memory')  # 'memory' or 'sqlite'
+STORAGE_PATH = os.getenv('STORAGE_PATH', '/data/tempmail.db')
+SPOOL_DIR = os.getenv('SPOOL_DIR', os.path.join(
+    os.path.dirname(STORAGE_PATH) if STORAGE_BACKEND == 'sqlite' else tempfile.gettempdir(), 'tempmail-attachments'
+))
+
+# HTTP ports: the web front end, and /metrics of roles without one
+PORT = int(os.getenv('PORT', 10000))
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
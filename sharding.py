@@ -0,0 +1,165 @@
+import bisect
+import hashlib
+import logging
+import string
+import threading
+import time
+
+from coordination import Lease
+from ingest import RemoteIngest
+
+logger = logging.getLogger(__name__)
+
+NODE_PREFIX = 'node:'
+
+# Users fall into buckets; addresses created in a cluster end in their user's bucket as a tag
+TAG_DIGITS = string.digits + string.ascii_lowercase
+TAG_LENGTH = 2
+BUCKETS = len(TAG_DIGITS) ** TAG_LENGTH
+LOCAL_PART_LENGTH = 10  # Random characters of an address before its tag
+
+
+def _point(value):
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+def user_bucket(user_id):
+    return _point(f"user:{user_id}") % BUCKETS
+
+
+def address_tag(user_id):
+    """Characters to end the local part of a new address of ``user_id`` with."""
+    bucket = user_bucket(user_id)
+    return ''.join(TAG_DIGITS[bucket // len(TAG_DIGITS) ** i % len(TAG_DIGITS)] for i in reversed(range(TAG_LENGTH)))
+
+
+def shard_key(key):
+    """Ring key of a user or chat id, or of an address.
+
+    A tagged address maps to the bucket of the user it was created for, so
+    users and their addresses always live on the same node and move
+    together. Other addresses are keyed by themselves.
+    """
+    if isinstance(key, int):
+        return f"bucket:{user_bucket(key)}"
+    key = str(key).lower()
+    local = key.rpartition('@')[0]
+    tag = local[LOCAL_PART_LENGTH:]
+    if len(local) == LOCAL_PART_LENGTH + TAG_LENGTH and all(c in TAG_DIGITS for c in tag):
+        return f"bucket:{int(tag, len(TAG_DIGITS))}"
+    return key
+
+
+class HashRing:
+    """Consistent hashing of keys onto nodes.
+
+    Each node places ``vnodes`` points on a 64-bit ring and owns the
+    ranges ending at them, so adding or removing a node only moves about
+    1/N of the keys. ``owner`` is a binary search.
+    """
+
+    def __init__(self, nodes=(), vnodes=64):
+        points = sorted((_point(f"{node}#{i}"), node) for node in nodes for i in range(vnodes))
+        self._points = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+        self.nodes = frozenset(nodes)
+
+    def owner(self, key):
+        if not self._points:
+            return None
+        i = bisect.bisect(self._points, _point(str(key).lower())) % len(self._points)
+        return self._nodes[i]
+
+
+class Cluster:
+    """Membership of this node and ownership of addresses and users.
+
+    Every node holds a ``node:<id>`` lease whose data is the address its
+    ingest server listens on; the ring is rebuilt from the live members
+    every ``ttl / 3`` seconds. Keys are user ids and addresses (see
+    ``shard_key``). ``route(key)`` returns a RemoteIngest for the owner of
+    ``key``, or ``None`` when this node owns it (or is alone).
+
+    After the members change, ``on_change()`` is called on the cluster
+    thread to hand state over; while it returns false it is called again on
+    every refresh. For ``grace`` seconds after a change (including joining)
+    the cluster is ``settling``: state may still be on its way here, so
+    unknown addresses are not yet known to be unknown.
+    """
+
+    def __init__(self, coordinator, node_id, address, authkey, ttl=15, vnodes=64, on_lost=None, on_change=None,
+                 grace=None):
+        self.coordinator = coordinator
+        self.node_id = node_id
+        self.authkey = authkey
+        self.vnodes = vnodes
+        self.on_change = on_change
+        self.grace = 2 * ttl if grace is None else grace
+        self.ring = HashRing([node_id], vnodes)
+        self.changed_at = time.monotonic()
+        self._pending = False  # on_change has not completed since the last change
+        self._addresses = {node_id: address}
+        self._remotes = {}
+        self._stop = threading.Event()
+        self._thread = None
+        self._lease = Lease(
+            coordinator, NODE_PREFIX + node_id, node_id, ttl, data=address,
+            on_change=lambda held: held or (on_lost and on_lost())
+        )
+
+    def start(self):
+        self._lease.start()
+        if not self._lease.wait(self._lease.ttl * 2):
+            raise RuntimeError(f"Node id {self.node_id} is held by another process")
+        self.refresh()
+        self._thread = threading.Thread(target=self._run, name='cluster', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._lease.stop()
+
+    def refresh(self):
+        members = {
+            name[len(NODE_PREFIX):]: address
+            for name, (_, address) in self.coordinator.leases(NODE_PREFIX).items()
+        }
+        members[self.node_id] = self._addresses[self.node_id]
+        self._addresses = members
+        if set(members) != self.ring.nodes:
+            logger.info(f"Cluster members: {', '.join(sorted(members))}")
+            self.ring = HashRing(members, self.vnodes)
+            self.changed_at = time.monotonic()
+            self._pending = self.on_change is not None
+
+    def settling(self):
+        return time.monotonic() - self.changed_at < self.grace
+
+    def _run(self):
+        while not self._stop.wait(self._lease.ttl / 3):
+            try:
+                self.refresh()
+                if self._pending:
+                    self._pending = not self.on_change()
+            except Exception as e:
+                logger.error(f"Error refreshing cluster members: {str(e)}")
+
+    def owner(self, key):
+        return self.ring.owner(shard_key(key))
+
+    def owns(self, key):
+        return self.owner(key) == self.node_id
+
+    def route(self, key):
+        node = self.owner(key)
+        return None if node == self.node_id else self.peer(node)
+
+    def peer(self, node):
+        """RemoteIngest of another member."""
+        remote = self._remotes.get(node)
+        if remote is None or remote.address != self._addresses.get(node):
+            remote = self._remotes[node] = RemoteIngest(self._addresses[node], self.authkey)
+        return remote
+
+    def __len__(self):
+        return len(self.ring.nodes)
@@ -0,0 +1,366 @@
+import asyncio
+import logging
+import multiprocessing
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from aiosmtpd.controller import Controller
+
+import mailparse
+import metrics
+import preview
+from spool import AttachmentSpool
+
+logger = logging.getLogger(__name__)
+
+# Reply while over a high-water mark; senders queue the mail and retry later
+TEMPFAIL_REPLY = '451 4.3.2 Server busy, please try again later'
+# Reply to MAIL FROM while the client or sender is over its rate limit
+RATE_LIMITED_REPLY = '450 4.7.1 Too many messages, please try again later'
+# Reply to RCPT for an unknown address while cluster members settle
+MOVING_REPLY = '451 4.2.0 Mailbox is moving, please try again later'
+
+
+def spool_attachments(raw, spool):
+    """Write the attachments of a raw message to ``spool``; return their metadata."""
+    attachments = []
+    for headers, start, end in mailparse.iter_attachments(raw):
+        try:
+            digest, size = spool.put(mailparse.iter_decoded(raw, start, end, headers))
+        except ValueError as e:
+            logger.warning(f"Skipping undecodable attachment: {str(e)}")
+            continue
+        attachments.append({
+            'name': headers.get_filename() or 'attachment',
+            'type': headers.get_content_type(),
+            'size': size,
+            'sha256': digest
+        })
+    return attachments
+
+
+def parse_email(envelope, parse_mode='full', spool=None):
+    """Turn an SMTP envelope into (recipient, stored email record)."""
+    to_addr = envelope.rcpt_tos[0].lower()
+    with metrics.MIME_PARSE_SECONDS.time():
+        if parse_mode == 'lazy':
+            # Headers and a short preview now, full MIME tree on /read
+            msg, body = mailparse.parse_preview(envelope.content)
+        else:
+            msg = mailparse.parse_full(envelope.content)
+            body = mailparse.text_body(msg)
+    record = {
+        'subject': str(msg.get('subject', 'No Subject')),
+        'from': envelope.mail_from,
+        'date': str(msg.get('date', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))),
+        'body': body,
+        'received': time.time()
+    }
+    record['preview'] = preview.build_preview(record)
+    if parse_mode == 'lazy':
+        record['raw'] = envelope.content
+    if spool is not None:
+        attachments = spool_attachments(envelope.content, spool)
+        if attachments:
+            record['attachments'] = attachments
+    return to_addr, record
+
+
+class CustomHandler:
+    """aiosmtpd handler: accepts mail for our domains and hands it to ``deliver``.
+
+    ``overloaded`` is called before accepting a recipient or a message body;
+    while it returns a truthy value the session gets a 451 temporary failure.
+    ``is_live`` is called with each lowercased recipient so mail for
+    addresses nobody holds is refused before the body is sent; ``None``
+    (not known yet) gets a 451. With a
+    ``spool``, attachments are written to it and the record keeps metadata.
+    ``client_limit`` and ``sender_limit`` (RateLimiters keyed by client IP
+    and MAIL FROM address) are charged once per message at MAIL FROM.
+
+    With ``call_timeout``, ``overloaded``, ``is_live`` and the handling of
+    DATA run in a thread pool, so calls to a remote bot process do not
+    stall the event loop; a call taking longer than ``call_timeout``
+    seconds gets a 451.
+    """
+
+    def __init__(self, domains, deliver, parse_mode='full', overloaded=None, is_live=None, spool=None,
+                 client_limit=None, sender_limit=None, call_timeout=None, call_threads=16):
+        self.domains = frozenset(domain.lower() for domain in domains)
+        self.deliver = deliver
+        self.parse_mode = parse_mode
+        self.overloaded = overloaded or (lambda: None)
+        self.is_live = is_live or (lambda address: True)
+        self.spool = spool
+        self.client_limit = client_limit
+        self.sender_limit = sender_limit
+        self.call_timeout = call_timeout
+        self._executor = ThreadPoolExecutor(call_threads, 'smtp-call') if call_timeout is not None else None
+
+    async def _run(self, func, *args):
+        if self._executor is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(loop.run_in_executor(self._executor, func, *args), self.call_timeout)
+
+    async def handle_MAIL(self, server, session, envelope, address, mail_options):
+        if self.client_limit is not None and self.client_limit.delay(session.peer[0]):
+            return RATE_LIMITED_REPLY
+        if self.sender_limit is not None and self.sender_limit.delay(address.lower()):
+            return RATE_LIMITED_REPLY
+        envelope.mail_from = address
+        envelope.mail_options.extend(mail_options)
+        return '250 OK'
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        address = address.lower()
+        local, _, domain = address.rpartition('@')
+        if not local or domain not in self.domains:
+            return '550 not relaying to that domain'
+        try:
+            if await self._run(self.overloaded):
+                return TEMPFAIL_REPLY
+            live = await self._run(self.is_live, address)
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out checking recipient {address}")
+            return TEMPFAIL_REPLY
+        if live is None:
+            # Cluster members changed and the address may still be on its way to its new node
+            return MOVING_REPLY
+        if not live:
+            return '550 5.1.1 No such mailbox'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        with metrics.SMTP_DATA_SECONDS.time():
+            try:
+                return await self._run(self._handle_data, envelope)
+            except asyncio.TimeoutError:
+                # It may still be stored; the sender's retry then arrives twice
+                logger.error("Timed out delivering email")
+                return TEMPFAIL_REPLY
+
+    def _handle_data(self, envelope):
+        if self.overloaded():
+            return TEMPFAIL_REPLY
+        try:
+            to_addr, record = parse_email(envelope, self.parse_mode, self.spool)
+            self.deliver(to_addr, record)
+            logger.info(f"Received email for {to_addr} from {record['from']}")
+            return '250 Message accepted for delivery'
+        except ConnectionError as e:
+            # The bot process is away (SMTP role); the sender keeps the mail
+            logger.error(f"Error delivering email: {str(e)}")
+            return TEMPFAIL_REPLY
+        except OSError as e:
+            # E.g. writing attachments to the spool failed; worth a retry
+            logger.error(f"Error storing email: {str(e)}")
+            return TEMPFAIL_REPLY
+        except Exception as e:
+            logger.error(f"Error processing email: {str(e)}")
+            return f'500 Error processing email: {str(e)}'
+
+
+class ReusePortController(Controller):
+    """Controller whose listening socket is bound with SO_REUSEPORT.
+
+    Several processes can listen on the same port and the kernel spreads
+    incoming connections across them.
+    """
+
+    def _create_server(self):
+        return self.loop.create_server(
+            self._factory_invoker,
+            host=self.hostname,
+            port=self.port,
+            ssl=self.ssl_context,
+            reuse_port=True
+        )
+
+    def _trigger_server(self):
+        # A test connection could be accepted by a sibling process, so
+        # instantiate the SMTP factory on our own loop instead.
+        self.loop.call_soon_threadsafe(self._factory_invoker)
+
+
+def _smtp_worker(host, port, domains, parse_mode, data_size_limit, out_queue, stop_event, overloaded, live_filter,
+                 spool_dir, client_limit, sender_limit, call_timeout):
+    """Process target: serve SMTP until ``stop_event`` is set."""
+    # The parent process coordinates shutdown
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    handler = CustomHandler(
+        domains,
+        lambda to_addr, record: out_queue.put((to_addr, record)),
+        parse_mode,
+        overloaded=lambda: overloaded.value,
+        is_live=getattr(live_filter, 'is_live', live_filter.__contains__) if live_filter is not None else None,
+        spool=AttachmentSpool(spool_dir) if spool_dir else None,
+        client_limit=client_limit,
+        sender_limit=sender_limit,
+        call_timeout=call_timeout
+    )
+    controller = ReusePortController(handler, hostname=host, port=port, data_size_limit=data_size_limit)
+    controller.start()
+    stop_event.wait()
+    controller.stop()
+
+
+class SMTPWorkerPool:
+    """Run N SMTP server processes on one port and collect their mail.
+
+    Workers parse messages and put (recipient, record) on a multiprocessing
+    queue; a thread in this process passes them to ``deliver``. Another
+    thread polls ``overloaded`` and publishes the result to the workers
+    through a shared flag. ``live_filter`` (a shared CountingBloomFilter,
+    or a RemoteIngest in the SMTP role) lets workers refuse unknown
+    recipients, and attachments are written to
+    ``spool_dir`` by the workers themselves. Each worker enforces an equal
+    share of ``client_limit`` and ``sender_limit`` (see RateLimiter.split),
+    so together they accept about what one process would.
+    Give a ``call_timeout`` (see CustomHandler) with a RemoteIngest.
+    """
+
+    def __init__(self, workers, host, port, domains, parse_mode='full', data_size_limit=None, live_filter=None,
+                 spool_dir=None, client_limit=None, sender_limit=None, call_timeout=None):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.domains = list(domains)
+        self.parse_mode = parse_mode
+        self.data_size_limit = data_size_limit
+        self.live_filter = live_filter
+        self.spool_dir = spool_dir
+        # Pickled into every worker with empty buckets, so each gets its share of the limit
+        self.client_limit = None if client_limit is None else client_limit.split(workers)
+        self.sender_limit = None if sender_limit is None else sender_limit.split(workers)
+        self.call_timeout = call_timeout
+        self._context = multiprocessing.get_context('spawn')
+        self._queue = self._context.Queue()
+        self._stop_event = self._context.Event()
+        self._overloaded = self._context.Value('b', 0, lock=False)
+        self._processes = []
+        self._consumer = None
+
+    def start(self, deliver, overloaded=None):
+        for i in range(self.workers):
+            process = self._context.Process(
+                target=_smtp_worker,
+                args=(self.host, self.port, self.domains, self.parse_mode, self.data_size_limit,
+                      self._queue, self._stop_event, self._overloaded, self.live_filter,
+                      self.spool_dir, self.client_limit, self.sender_limit, self.call_timeout),
+                name=f"smtp-worker-{i}",
+                daemon=True
+            )
+            process.start()
+            self._processes.append(process)
+        self._consumer = threading.Thread(target=self._consume, args=(deliver,), name='smtp-ingest', daemon=True)
+        self._consumer.start()
+        if overloaded is not None:
+            threading.Thread(target=self._watch, args=(overloaded,), name='smtp-admission', daemon=True).start()
+        logger.info(f"Started {self.workers} SMTP worker processes on {self.host}:{self.port}")
+
+    def pending(self):
+        try:
+            return self._queue.qsize()
+        except NotImplementedError:
+            return 0
+
+    def _watch(self, overloaded, interval=0.2):
+        while not self._stop_event.wait(interval):
+            try:
+                self._overloaded.value = 1 if overloaded() else 0
+            except Exception as e:
+                logger.error(f"Error checking SMTP admission: {str(e)}")
+
+    def _consume(self, deliver):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            while True:
+                try:
+                    deliver(*item)
+                except ConnectionError as e:
+                    # Already accepted, so hold it until the bot process is back
+                    logger.error(f"Error delivering email for {item[0]}, retrying: {str(e)}")
+                    time.sleep(1)
+                    continue
+                except Exception as e:
+                    logger.error(f"Error delivering email for {item[0]}: {str(e)}")
+                break
+
+    def stop(self, timeout=10):
+        """Stop accepting mail, let workers finish and drain what they queued."""
+        self._stop_event.set()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+        if self._consumer is not None:
+            self._queue.put(None)
+            self._consumer.join(timeout)
+            self._consumer = None
+
+
+def main():
+    """Run the SMTP role: accept mail and hand it to the bot process over MAIL_QUEUE_ADDRESS.
+
+    Keeps no state besides attachments in SPOOL_DIR, which must be the
+    directory the bot process reads them from.
+    """
+    from admission import RateLimiter
+    from ingest import RemoteIngest
+    import settings
+
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    if not settings.MAIL_QUEUE_SECRET:
+        logger.error("MAIL_QUEUE_SECRET is required for the SMTP role")
+        sys.exit(1)
+    remote = RemoteIngest(settings.MAIL_QUEUE_ADDRESS, settings.MAIL_QUEUE_SECRET)
+    client_limit = RateLimiter(settings.SMTP_CLIENT_RATE_PER_MINUTE / 60, settings.SMTP_CLIENT_BURST)
+    sender_limit = RateLimiter(settings.SMTP_SENDER_RATE_PER_MINUTE / 60, settings.SMTP_SENDER_BURST)
+    if settings.METRICS_PORT:
+        metrics.serve(settings.METRICS_PORT)
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+
+    if settings.SMTP_WORKERS > 0:
+        pool = SMTPWorkerPool(
+            settings.SMTP_WORKERS, settings.EMAIL_HOST, settings.EMAIL_PORT, settings.DOMAINS,
+            settings.MAIL_PARSE_MODE, data_size_limit=settings.MAX_MESSAGE_SIZE, live_filter=remote,
+            spool_dir=settings.SPOOL_DIR, client_limit=client_limit, sender_limit=sender_limit,
+            call_timeout=settings.MAIL_QUEUE_TIMEOUT
+        )
+        pool.start(remote.deliver, overloaded=remote.overloaded)
+        stop_event.wait()
+        pool.stop()
+    else:
+        handler = CustomHandler(
+            settings.DOMAINS, remote.deliver, settings.MAIL_PARSE_MODE,
+            overloaded=remote.overloaded, is_live=remote.is_live, spool=AttachmentSpool(settings.SPOOL_DIR),
+            client_limit=client_limit, sender_limit=sender_limit, call_timeout=settings.MAIL_QUEUE_TIMEOUT
+        )
+        controller = Controller(
+            handler, hostname=settings.EMAIL_HOST, port=settings.EMAIL_PORT,
+            data_size_limit=settings.MAX_MESSAGE_SIZE
+        )
+        controller.start()
+        logger.info(f"Starting SMTP server on {settings.EMAIL_HOST}:{settings.EMAIL_PORT}")
+        stop_event.wait()
+        controller.stop()
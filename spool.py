@@ -0,0 +1,187 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+REFS_DIR = 'refs'
+# Files younger than this are never deleted as unreferenced: they may have
+# just been written by an SMTP process for a message not yet stored
+GRACE_SECONDS = 3600
+
+
+class AttachmentSpool:
+    """Attachments on disk, stored once per distinct content.
+
+    Files are named by the SHA-256 of their content, so the same file sent
+    to many addresses takes the space of one. Stored messages keep only the
+    metadata returned by ``put``; storage backends ``retain`` it when a
+    message is stored and ``release`` it when the message is dropped. ``put``
+    needs no shared state, so SMTP processes can write into the same
+    directory.
+
+    Several nodes may share the directory, so reference counts are kept per
+    process and each ``node`` marks the files it references with a hard link
+    under ``refs/<node>/``. A file is deleted once no node links to it and
+    it is older than ``grace`` seconds; ``.tmp`` files being written are
+    never touched.
+    """
+
+    def __init__(self, root, node='main', grace=GRACE_SECONDS):
+        self.root = root
+        self.node = node
+        self.grace = grace
+        self._refs = {}      # sha256 -> number of stored messages referencing it
+        self._file_ids = {}  # sha256 -> Telegram file_id of a previous upload
+        self._lock = threading.Lock()
+
+    def _content_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def _ref_path(self, digest):
+        return os.path.join(self.root, REFS_DIR, self.node, digest)
+
+    def path(self, digest):
+        """Path to read an attachment from; this node's link outlives deletion by others."""
+        ref_path = self._ref_path(digest)
+        return ref_path if os.path.exists(ref_path) else self._content_path(digest)
+
+    def put(self, chunks):
+        """Write an iterable of byte chunks; return (sha256 hex digest, size)."""
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = digest.hexdigest()
+            path = self._content_path(digest)
+            try:
+                # Restart the grace period of a file that is already there
+                os.utime(path)
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return digest, size
+
+    def _link(self, digest):
+        ref_path = self._ref_path(digest)
+        try:
+            os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+            os.link(self._content_path(digest), ref_path)
+        except FileExistsError:
+            pass
+        except OSError as e:
+            logger.error(f"Error referencing attachment {digest}: {str(e)}")
+
+    def _unlink(self, digest):
+        # Drop this node's link, then the file if no node links to it any more
+        try:
+            os.unlink(self._ref_path(digest))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error removing attachment {digest}: {str(e)}")
+        path = self._content_path(digest)
+        try:
+            stat = os.stat(path)
+            if stat.st_nlink == 1 and time.time() - stat.st_mtime >= self.grace:
+                os.unlink(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error removing attachment {digest}: {str(e)}")
+
+    def retain(self, attachments):
+        with self._lock:
+            for attachment in attachments:
+                digest = attachment['sha256']
+                refs = self._refs.get(digest, 0)
+                if not refs:
+                    self._link(digest)
+                self._refs[digest] = refs + 1
+
+    def release(self, attachments):
+        with self._lock:
+            for attachment in attachments:
+                digest = attachment['sha256']
+                refs = self._refs.get(digest, 0) - 1
+                if refs > 0:
+                    self._refs[digest] = refs
+                    continue
+                self._refs.pop(digest, None)
+                self._file_ids.pop(digest, None)
+                self._unlink(digest)
+
+    def discard(self, attachments):
+        """Delete files written by ``put`` for a message that was not stored."""
+        self.retain(attachments)
+        self.release(attachments)
+
+    def rebuild(self, attachment_lists):
+        """Count references from this node's stored messages and sync its links to them.
+
+        Call at startup, before mail is accepted.
+        """
+        with self._lock:
+            self._refs = {}
+            for attachments in attachment_lists:
+                for attachment in attachments:
+                    self._refs[attachment['sha256']] = self._refs.get(attachment['sha256'], 0) + 1
+            refs_dir = os.path.join(self.root, REFS_DIR, self.node)
+            linked = set(os.listdir(refs_dir)) if os.path.isdir(refs_dir) else set()
+            for digest in linked - set(self._refs):
+                try:
+                    os.unlink(os.path.join(refs_dir, digest))
+                except OSError as e:
+                    logger.error(f"Error removing attachment {digest}: {str(e)}")
+            for digest in set(self._refs) - linked:
+                self._link(digest)
+        self.sweep()
+
+    def sweep(self):
+        """Delete files no node links to once they are past the grace period."""
+        if not os.path.isdir(self.root):
+            return
+        removed = 0
+        now = time.time()
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                # Links of nodes, and .tmp files of writes in progress, are not content
+                dirnames[:] = [name for name in dirnames if name != REFS_DIR]
+                continue
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_nlink == 1 and now - stat.st_mtime >= self.grace:
+                        os.unlink(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        if removed:
+            logger.info(f"Removed {removed} unreferenced attachments from {self.root}")
+
+    def file_id(self, digest):
+        return self._file_ids.get(digest)
+
+    def remember_file_id(self, digest, file_id):
+        """Keep the file_id of an upload so the same file is not sent twice."""
+        with self._lock:
+            if digest in self._refs:
+                self._file_ids[digest] = file_id
+
+    def __len__(self):
+        return len(self._refs)
@@ -0,0 +1,609 @@
+import collections
+import functools
+import itertools
+import json
+import logging
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+from records import StoredEmail
+
+logger = logging.getLogger(__name__)
+
+
+def record_size(record):
+    """Rough number of bytes a stored email keeps alive."""
+    size = (400 + len(record['body']) + len(str(record['subject']))
+            + len(record['from']) + len(record.get('raw') or b''))
+    preview = record.get('preview')
+    if preview:
+        size += 600 + sum(len(value) for value in preview.values() if value)
+    return size
+
+
+class MemoryStorage:
+    """Default backend: everything lives in the module-level dicts of bot.py.
+
+    Nothing survives a restart. Address assignments and stats are already
+    held in memory by the caller, so persisting them is a no-op here.
+
+    Each inbox keeps at most ``max_messages`` and all inboxes together at
+    most ``memory_budget`` bytes (estimated). Over budget the globally
+    oldest message is dropped; a FIFO of (address, sequence, size) finds it
+    without scanning the inboxes. Messages are kept as compact
+    StoredEmail records, and their ``size`` is what counts against the
+    budget. Attachments of stored messages are
+    retained in ``spool`` and released when the message is dropped, and
+    the search ``index`` follows every change. ``on_change(address)`` is
+    called after each change to an inbox.
+    """
+
+    def __init__(self, emails, message_tracking, max_messages=50, memory_budget=256 * 1024 * 1024, spool=None,
+                 index=None, on_change=None):
+        self.emails = emails
+        self.spool = spool
+        self.index = index
+        self.on_change = on_change
+        self.message_tracking = message_tracking
+        self.max_messages = max_messages
+        self.memory_budget = memory_budget
+        self.bytes_used = 0
+        self.message_count = 0
+        self._lock = threading.Lock()
+        self._seqs = {}  # address -> sequence numbers of its stored messages, oldest first
+        self._order = collections.deque()  # (address, sequence, size), oldest first
+        self._seq = 1  # Sequence numbers double as message ids, so 0 means "before any message"
+        self._versions = {}  # address -> counter value of its last change
+        self._version_counter = itertools.count(1)
+
+    def load(self):
+        """Return ([(user_id, address, assigned)], user stats) saved by a previous run."""
+        return [], {}
+
+    def attachments(self):
+        """Yield the attachment metadata lists of stored messages."""
+        return iter(())
+
+    def inbox_addresses(self):
+        """Return the addresses that have stored messages."""
+        with self._lock:
+            return list(self.emails)
+
+    def inbox_times(self):
+        """Return {address: time its newest message was received} of stored inboxes."""
+        with self._lock:
+            return {address: inbox[-1].received or time.time() for address, inbox in self.emails.items()}
+
+    def add_email(self, address, record):
+        if self.spool is not None and record.get('attachments'):
+            self.spool.retain(record['attachments'])
+        stored = StoredEmail(record)
+        size = stored.size
+        with self._lock:
+            inbox = self.emails.get(address)
+            if inbox is None:
+                address = sys.intern(address)
+                inbox = self.emails[address] = collections.deque()
+                self._seqs[address] = collections.deque()
+            inbox.append(stored)
+            if self.index is not None:
+                # Index the plain record; the stored one keeps its body compressed
+                self.index.add(address, record)
+            self._seqs[address].append(self._seq)
+            self._versions[address] = next(self._version_counter)
+            self._order.append((address, self._seq, size))
+            self._seq += 1
+            self.bytes_used += size
+            self.message_count += 1
+            if len(inbox) > self.max_messages:
+                self._drop_oldest(address)
+            while self.bytes_used > self.memory_budget and self._order:
+                oldest, seq, _ = self._order.popleft()
+                seqs = self._seqs.get(oldest)
+                if seqs and seqs[0] == seq:
+                    self._drop_oldest(oldest)
+            # Entries of messages removed out of order go stale; compact them
+            if len(self._order) > 2 * self.max_messages * max(len(self.emails), 1) + 1024:
+                self._order = collections.deque(
+                    entry for entry in self._order
+                    if entry[0] in self._seqs and entry[1] >= self._seqs[entry[0]][0]
+                )
+        if self.on_change is not None:
+            self.on_change(address)
+
+    def _drop_oldest(self, address):
+        inbox = self.emails[address]
+        record = inbox.popleft()
+        self.bytes_used -= record.size
+        if self.spool is not None and record.get('attachments'):
+            self.spool.release(record['attachments'])
+        self.message_count -= 1
+        if self.index is not None:
+            self.index.drop_oldest(address)
+        self._seqs[address].popleft()
+        self._versions[address] = next(self._version_counter)
+        if not inbox:
+            del self.emails[address]
+            del self._seqs[address]
+            del self._versions[address]
+
+    def delete_inbox(self, address):
+        with self._lock:
+            inbox = self.emails.pop(address, None)
+            self._seqs.pop(address, None)
+            self._versions.pop(address, None)
+            if self.index is not None:
+                self.index.delete(address)
+            if inbox:
+                self.bytes_used -= sum(record.size for record in inbox)
+                self.message_count -= len(inbox)
+                if self.spool is not None:
+                    for record in inbox:
+                        if record.get('attachments'):
+                            self.spool.release(record['attachments'])
+        if self.on_change is not None:
+            self.on_change(address)
+
+    def delete_messages(self, address, ids):
+        """Remove the stored messages of ``address`` with these ids."""
+        ids = set(ids)
+        with self._lock:
+            inbox = self.emails.get(address)
+            if not inbox:
+                return
+            seqs = self._seqs[address]
+            kept = []
+            for seq, record in zip(seqs, inbox):
+                if seq not in ids:
+                    kept.append((seq, record))
+                    continue
+                self.bytes_used -= record.size
+                self.message_count -= 1
+                if self.spool is not None and record.get('attachments'):
+                    self.spool.release(record['attachments'])
+            if len(kept) == len(inbox):
+                return
+            inbox.clear()
+            seqs.clear()
+            for seq, record in kept:
+                seqs.append(seq)
+                inbox.append(record)
+            if inbox:
+                self._versions[address] = next(self._version_counter)
+                if self.index is not None:
+                    # Positions moved; reindex when next searched
+                    self.index.mark_stale([address])
+            else:
+                del self.emails[address]
+                del self._seqs[address]
+                del self._versions[address]
+                if self.index is not None:
+                    self.index.delete(address)
+        if self.on_change is not None:
+            self.on_change(address)
+
+    def flush(self, timeout=None):
+        """Wait until every change so far is stored; nothing to wait for here."""
+        return True
+
+    def count_messages(self):
+        return self.message_count
+
+    def inbox_version(self, address):
+        """Return a number that changes whenever the inbox changes."""
+        return self._versions.get(address, 0)
+
+    def memory_used(self):
+        """Estimated bytes of stored mail held in memory."""
+        return self.bytes_used
+
+    def get_emails(self, address):
+        with self._lock:
+            return list(self.emails.get(address, ()))
+
+    def with_emails(self, address, func):
+        """Call ``func`` with the stored messages of ``address`` while no change to the index can happen."""
+        with self._lock:
+            return func(list(self.emails.get(address, ())))
+
+    def get_email(self, address, index):
+        with self._lock:
+            inbox = self.emails.get(address, ())
+            return inbox[index] if 0 <= index < len(inbox) else None
+
+    def emails_since(self, address, since):
+        """Return [(id, record)] of stored messages with ids above ``since``, oldest first."""
+        with self._lock:
+            inbox = self.emails.get(address)
+            if not inbox:
+                return []
+            start = len(inbox)
+            seqs = self._seqs[address]
+            while start and seqs[start - 1] > since:
+                start -= 1
+            return [(seqs[i], inbox[i]) for i in range(start, len(inbox))]
+
+    def save_address(self, user_id, address):
+        pass
+
+    def delete_address(self, user_id, address):
+        pass
+
+    def save_stats(self, user_id, stats):
+        pass
+
+    def delete_stats(self, user_id):
+        pass
+
+    def forwards(self):
+        """Return {address: push URL} saved by a previous run."""
+        return {}
+
+    def save_forward(self, address, url):
+        pass
+
+    def delete_forward(self, address):
+        pass
+
+    def track_message(self, chat_id, message_id, msg_type, email=None, original_message_id=None):
+        self.message_tracking.track(chat_id, message_id, msg_type, email, original_message_id)
+
+    def close(self):
+        pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    address TEXT NOT NULL,
+    subject TEXT,
+    sender TEXT,
+    date TEXT,
+    body TEXT,
+    raw BLOB,
+    received REAL NOT NULL,
+    attachments TEXT,
+    preview TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_address ON messages (address, id);
+CREATE TABLE IF NOT EXISTS addresses (
+    address TEXT NOT NULL,
+    user_id INTEGER NOT NULL,
+    assigned REAL NOT NULL,
+    PRIMARY KEY (address, user_id)
+);
+CREATE INDEX IF NOT EXISTS addresses_user ON addresses (user_id);
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INTEGER PRIMARY KEY,
+    created TEXT NOT NULL,
+    emails_received INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS message_tracking (
+    chat_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    email TEXT,
+    original_message_id INTEGER,
+    created REAL NOT NULL,
+    PRIMARY KEY (chat_id, message_id)
+);
+CREATE INDEX IF NOT EXISTS message_tracking_email ON message_tracking (email);
+CREATE INDEX IF NOT EXISTS message_tracking_created ON message_tracking (created);
+CREATE TABLE IF NOT EXISTS forwards (
+    address TEXT PRIMARY KEY,
+    url TEXT NOT NULL
+);
+"""
+
+
+class SQLiteStorage:
+    """Durable backend on a SQLite database in WAL mode.
+
+    All writes go through one writer thread that commits them in batches,
+    so the SMTP path only pays for a queue put. Reads use a separate
+    connection per thread; with WAL they never wait for the writer.
+    Attachment metadata is stored as JSON and retained in ``spool``; the
+    search ``index`` is updated on the writer thread once a change is
+    committed. ``on_change(address)`` is called there too.
+    """
+
+    def __init__(self, path, max_messages=50, tracking_ttl=48 * 3600, batch_size=200, flush_interval=0.05,
+                 spool=None, index=None, on_change=None, tracking_max_entries=100000):
+        self.path = path
+        self.spool = spool
+        self.index = index
+        self.on_change = on_change
+        self.max_messages = max_messages
+        self.tracking_ttl = tracking_ttl
+        self.tracking_max_entries = tracking_max_entries
+        # Prune often enough that the table never holds much more than the bound
+        self._prune_every = max(1, min(1000, tracking_max_entries // 10))
+        self._tracked = 0
+        self._pending_bytes = 0  # size of messages queued but not yet committed
+        self._pending_lock = threading.Lock()
+        self._versions = {}
+        self._version_counter = itertools.count(1)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._flushes = []  # events of flush() calls in the batch being written
+        self._index_lock = threading.Lock()  # held from commit until the index follows it
+        self._conn = self._connect()
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.executescript(SCHEMA)
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(messages)')]
+        for column in ('attachments', 'preview'):
+            # Added after the first release; older databases lack them
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE messages ADD COLUMN {column} TEXT')
+        # Inboxes kept from an earlier run start with a version, so 0 only ever means "no messages"
+        for (address,) in self._conn.execute('SELECT DISTINCT address FROM messages'):
+            self._versions[address] = next(self._version_counter)
+        self._writer = threading.Thread(target=self._write_loop, name='sqlite-writer', daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            conn.execute('PRAGMA query_only=ON')
+        return conn
+
+    def _write(self, sql, params, address=None, size=0, indexed=None):
+        # ``sql`` may be a function called as sql(conn, *params) on the writer;
+        # ``address`` marks an inbox whose version changes once this commits;
+        # ``size`` is memory held until then; ``indexed`` updates the index after
+        if size:
+            with self._pending_lock:
+                self._pending_bytes += size
+        self._queue.put((sql, params, address, size, indexed))
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while item is not None and len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(item)
+            with self._index_lock:
+                try:
+                    with self._conn:
+                        for entry in batch:
+                            if entry is None:
+                                continue
+                            if callable(entry[0]):
+                                entry[0](self._conn, *entry[1])
+                            else:
+                                self._conn.execute(entry[0], entry[1])
+                except Exception as e:
+                    logger.error(f"Error writing batch of {len(batch)} to {self.path}: {str(e)}")
+                else:
+                    for entry in batch:
+                        if entry is not None and entry[4] is not None:
+                            entry[4]()
+            while self._flushes:
+                self._flushes.pop().set()
+            for entry in batch:
+                if entry is not None:
+                    if entry[2] is not None:
+                        self._versions[entry[2]] = next(self._version_counter)
+                        if self.on_change is not None:
+                            self.on_change(entry[2])
+                    if entry[3]:
+                        with self._pending_lock:
+                            self._pending_bytes -= entry[3]
+            if batch[-1] is None:
+                return
+
+    def load(self):
+        conn = self._reader()
+        addresses = conn.execute(
+            'SELECT user_id, address, assigned FROM addresses ORDER BY assigned'
+        ).fetchall()
+        stats = {
+            user_id: {'created': datetime.fromisoformat(created), 'emails_received': received}
+            for user_id, created, received in conn.execute(
+                'SELECT user_id, created, emails_received FROM user_stats'
+            )
+        }
+        return addresses, stats
+
+    def attachments(self):
+        for (attachments,) in self._reader().execute(
+            'SELECT attachments FROM messages WHERE attachments IS NOT NULL'
+        ):
+            yield json.loads(attachments)
+
+    def inbox_addresses(self):
+        return [address for (address,) in self._reader().execute('SELECT DISTINCT address FROM messages')]
+
+    def inbox_times(self):
+        return dict(self._reader().execute('SELECT address, MAX(received) FROM messages GROUP BY address'))
+
+    def add_email(self, address, record):
+        attachments = record.get('attachments')
+        if self.spool is not None and attachments:
+            self.spool.retain(attachments)
+        self._write(
+            'INSERT INTO messages (address, subject, sender, date, body, raw, received, attachments, preview) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (address, str(record['subject']), record['from'], str(record['date']),
+             record['body'], record.get('raw'), record.get('received') or time.time(),
+             json.dumps(attachments) if attachments else None,
+             json.dumps(record['preview']) if record.get('preview') else None),
+            size=record_size(record),
+            indexed=None if self.index is None else functools.partial(self.index.add, address, record)
+        )
+        self._write(self._delete_messages, (
+            'address = ? AND id <= (SELECT id FROM messages WHERE address = ? ORDER BY id DESC LIMIT 1 OFFSET ?)',
+            (address, address, self.max_messages)
+        ), address, indexed=None if self.index is None else functools.partial(
+            self.index.trim, address, self.max_messages
+        ))
+
+    def _delete_messages(self, conn, where, params):
+        # Runs on the writer thread; releases attachments of the deleted rows
+        if self.spool is not None:
+            for (attachments,) in conn.execute(
+                f'SELECT attachments FROM messages WHERE attachments IS NOT NULL AND {where}', params
+            ).fetchall():
+                self.spool.release(json.loads(attachments))
+        conn.execute(f'DELETE FROM messages WHERE {where}', params)
+
+    def delete_inbox(self, address):
+        self._write(
+            self._delete_messages, ('address = ?', (address,)),
+            address, indexed=None if self.index is None else functools.partial(self.index.delete, address)
+        )
+
+    def delete_messages(self, address, ids):
+        """Remove the stored messages of ``address`` with these ids."""
+        ids = list(ids)
+        if not ids:
+            return
+        self._write(
+            self._delete_messages, (f"address = ? AND id IN ({', '.join('?' * len(ids))})", (address, *ids)),
+            address, indexed=None if self.index is None else functools.partial(self.index.mark_stale, [address])
+        )
+
+    def flush(self, timeout=30):
+        """Wait until every write queued so far is committed; return whether it was in time."""
+        done = threading.Event()
+        self._write(lambda conn: self._flushes.append(done), ())
+        return done.wait(timeout)
+
+    def memory_used(self):
+        """Bytes of received mail waiting in the write queue."""
+        return self._pending_bytes
+
+    def count_messages(self):
+        return self._reader().execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def inbox_version(self, address):
+        """Return a number that changes once a change to the inbox is committed."""
+        return self._versions.get(address, 0)
+
+    def with_emails(self, address, func):
+        """Call ``func`` with the stored messages of ``address`` while no change to the index can happen."""
+        with self._index_lock:
+            return func(self.get_emails(address))
+
+    def get_emails(self, address):
+        rows = self._reader().execute(
+            'SELECT subject, sender, date, body, preview FROM messages WHERE address = ? ORDER BY id',
+            (address,)
+        )
+        emails = []
+        for subject, sender, date, body, preview in rows:
+            record = {'subject': subject, 'from': sender, 'date': date, 'body': body}
+            if preview is not None:
+                record['preview'] = json.loads(preview)
+            emails.append(record)
+        return emails
+
+    def emails_since(self, address, since):
+        """Return [(id, record)] of stored messages with ids above ``since``, oldest first."""
+        rows = self._reader().execute(
+            'SELECT id, subject, sender, date, body, raw, received, attachments, preview FROM messages '
+            'WHERE address = ? AND id > ? ORDER BY id',
+            (address, since)
+        )
+        emails = []
+        for message_id, subject, sender, date, body, raw, received, attachments, preview in rows:
+            record = {'subject': subject, 'from': sender, 'date': date, 'body': body, 'received': received}
+            if raw is not None:
+                record['raw'] = raw
+            if attachments is not None:
+                record['attachments'] = json.loads(attachments)
+            if preview is not None:
+                record['preview'] = json.loads(preview)
+            emails.append((message_id, record))
+        return emails
+
+    def get_email(self, address, index):
+        if index < 0:
+            return None
+        row = self._reader().execute(
+            'SELECT subject, sender, date, body, raw, attachments, preview FROM messages WHERE address = ? '
+            'ORDER BY id LIMIT 1 OFFSET ?',
+            (address, index)
+        ).fetchone()
+        if row is None:
+            return None
+        subject, sender, date, body, raw, attachments, preview = row
+        record = {'subject': subject, 'from': sender, 'date': date, 'body': body}
+        if raw is not None:
+            record['raw'] = raw
+        if attachments is not None:
+            record['attachments'] = json.loads(attachments)
+        if preview is not None:
+            record['preview'] = json.loads(preview)
+        return record
+
+    def save_address(self, user_id, address):
+        self._write(
+            'INSERT OR REPLACE INTO addresses (address, user_id, assigned) VALUES (?, ?, ?)',
+            (address, user_id, time.time())
+        )
+
+    def delete_address(self, user_id, address):
+        self._write('DELETE FROM addresses WHERE address = ? AND user_id = ?', (address, user_id))
+
+    def save_stats(self, user_id, stats):
+        self._write(
+            'INSERT OR REPLACE INTO user_stats (user_id, created, emails_received) VALUES (?, ?, ?)',
+            (user_id, stats['created'].isoformat(), stats['emails_received'])
+        )
+
+    def delete_stats(self, user_id):
+        self._write('DELETE FROM user_stats WHERE user_id = ?', (user_id,))
+
+    def forwards(self):
+        return dict(self._reader().execute('SELECT address, url FROM forwards'))
+
+    def save_forward(self, address, url):
+        self._write('INSERT OR REPLACE INTO forwards (address, url) VALUES (?, ?)', (address, url))
+
+    def delete_forward(self, address):
+        self._write('DELETE FROM forwards WHERE address = ?', (address,))
+
+    def track_message(self, chat_id, message_id, msg_type, email=None, original_message_id=None):
+        now = time.time()
+        self._write(
+            'INSERT OR REPLACE INTO message_tracking '
+            '(chat_id, message_id, type, email, original_message_id, created) VALUES (?, ?, ?, ?, ?, ?)',
+            (chat_id, message_id, msg_type, email, original_message_id, now)
+        )
+        self._tracked += 1
+        if self._tracked % self._prune_every == 0:
+            self._write('DELETE FROM message_tracking WHERE created < ?', (now - self.tracking_ttl,))
+            self._write(
+                'DELETE FROM message_tracking WHERE created <= '
+                '(SELECT created FROM message_tracking ORDER BY created DESC LIMIT 1 OFFSET ?)',
+                (self.tracking_max_entries,)
+            )
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join(10)
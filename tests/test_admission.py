@@ -0,0 +1,99 @@
+import pickle
+
+import pytest
+
+import admission
+from admission import Backpressure, RateLimiter
+
+
+def test_backpressure_engages_at_high_water_and_releases_below_low_water():
+    value = [0]
+    backpressure = Backpressure(low_ratio=0.8)
+    backpressure.add('queue', lambda: value[0], 100)
+    assert backpressure.check() is None
+    value[0] = 99
+    assert backpressure.check() is None
+    value[0] = 100
+    assert backpressure.check() == 'queue'
+    # Still refusing between the low and high water marks
+    value[0] = 90
+    assert backpressure.check() == 'queue'
+    value[0] = 80
+    assert backpressure.check() == 'queue'
+    value[0] = 79
+    assert backpressure.check() is None
+    # Released: the high-water mark applies again
+    value[0] = 90
+    assert backpressure.check() is None
+
+
+def test_backpressure_reports_first_gauge_over_its_mark():
+    values = {'stored': 0, 'pending': 0}
+    backpressure = Backpressure()
+    backpressure.add('stored', lambda: values['stored'], 10)
+    backpressure.add('pending', lambda: values['pending'], 10)
+    values['pending'] = 10
+    assert backpressure.check() == 'pending'
+    values['stored'] = 10
+    assert backpressure.check() == 'stored'
+    status = backpressure.status()
+    assert status['status'] == 'overloaded'
+    assert status['gauges']['pending'] == {'value': 10, 'high_water': 10}
+    values['stored'] = values['pending'] = 0
+    assert backpressure.status()['status'] == 'ok'
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, 'monotonic', clock)
+    return clock
+
+
+def test_rate_limiter_allows_burst_then_refills(clock):
+    limiter = RateLimiter(rate=1, burst=3)
+    assert [limiter.delay('a') for _ in range(3)] == [0, 0, 0]
+    assert limiter.delay('a') == pytest.approx(1)
+    clock.now += 0.5
+    assert limiter.delay('a') == pytest.approx(0.5)
+    clock.now += 0.5
+    assert limiter.delay('a') == 0
+    # Other keys have their own buckets
+    assert limiter.delay('b') == 0
+
+
+def test_rate_limiter_drops_idle_and_least_recent_buckets(clock):
+    limiter = RateLimiter(rate=1, burst=2, max_keys=2)
+    limiter.delay('a')
+    limiter.delay('b')
+    limiter.delay('c')
+    assert len(limiter) == 2
+    clock.now += 10
+    limiter.delay('d')
+    assert len(limiter) == 1
+
+
+def test_rate_limiter_disabled_and_pickled():
+    assert all(RateLimiter(0, 1).delay('a') == 0 for _ in range(10))
+    limiter = RateLimiter(1, 1)
+    limiter.delay('a')
+    copy = pickle.loads(pickle.dumps(limiter))
+    assert len(copy) == 0
+    assert copy.delay('a') == 0
+
+
+def test_rate_limiter_split_shares_rate_and_burst(clock):
+    parts = [RateLimiter(rate=4, burst=8).split(4) for _ in range(4)]
+    assert sum(1 for limiter in parts for _ in range(10) if limiter.delay('a') == 0) == 8
+    clock.now += 1
+    assert sum(1 for limiter in parts for _ in range(10) if limiter.delay('a') == 0) == 4
+    assert RateLimiter(1, 2).split(8).delay('a') == 0
+    assert RateLimiter(0, 1).split(4).delay('a') == 0
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from expiry import ExpiryScheduler
+
+
+class Expired:
+    def __init__(self, last):
+        self.keys = []
+        self.last = last
+        self.done = threading.Event()
+
+    def __call__(self, key):
+        self.keys.append(key)
+        if key == self.last:
+            self.done.set()
+
+
+def test_rescheduled_and_cancelled_keys_are_not_expired_early():
+    now = time.time()
+    expired = Expired('last')
+    scheduler = ExpiryScheduler(expired)
+    scheduler.schedule('cancelled', now - 4)
+    scheduler.cancel('cancelled')
+    scheduler.schedule('later', now - 3)
+    scheduler.schedule('later', now + 60)
+    scheduler.schedule('earlier', now + 60)
+    scheduler.schedule('earlier', now - 2)
+    scheduler.schedule('last', now - 1)
+    scheduler.start()
+    try:
+        assert expired.done.wait(5)
+    finally:
+        scheduler.stop()
+    assert expired.keys == ['earlier', 'last']
+    assert scheduler.deadline('later') == now + 60
+    assert scheduler.deadline('earlier') is None
+    assert len(scheduler) == 1
+
+
+def test_stale_entries_are_compacted():
+    now = time.time()
+    expired = Expired('key')
+    scheduler = ExpiryScheduler(expired)
+    for i in range(5000):
+        scheduler.schedule('key', now + 5000 - i)
+    scheduler.schedule('key', now - 1)
+    scheduler.start()
+    try:
+        assert expired.done.wait(5)
+    finally:
+        scheduler.stop()
+    assert expired.keys == ['key']
+    assert len(scheduler) == 0
+
+
+def test_schedule_wakes_the_thread_for_an_earlier_deadline():
+    expired = Expired('soon')
+    scheduler = ExpiryScheduler(expired)
+    scheduler.schedule('idle', time.time() + 3600)
+    scheduler.start()
+    try:
+        scheduler.schedule('soon', time.time())
+        assert expired.done.wait(5)
+    finally:
+        scheduler.stop()
+    assert expired.keys == ['soon']
@@ -0,0 +1,55 @@
+from inbox import MAX_MESSAGE_LENGTH, RESERVED_LENGTH, InboxRenderer
+from storage import MemoryStorage, SQLiteStorage
+from tracking import MessageTracker
+
+
+def test_long_page_is_cut_between_lines():
+    storage = MemoryStorage({}, MessageTracker())
+    for i in range(40):
+        storage.add_email('a@example.com', {
+            'subject': f"Your code 1234{i:02d} *now* [click]_here_",
+            'from': f"no_reply_{i}@example.com",
+            'date': 'Mon, 1 Jan 2024 00:00:00 +0000',
+            'body': 'Use `this` code_*_ ' * 40,
+        })
+    text, page, pages, version = InboxRenderer(page_size=40).render(storage, 'a@example.com')
+    assert len(text) <= MAX_MESSAGE_LENGTH - RESERVED_LENGTH
+    assert text.endswith('\n…')
+    assert text.count('`') % 2 == 0
+    body = text[:-1]
+    assert not body.rstrip('\n').endswith('\\')
+
+
+def test_short_page_is_not_cut():
+    storage = MemoryStorage({}, MessageTracker())
+    storage.add_email('a@example.com', {'subject': 'Hi', 'from': 'x@example.com', 'date': 'today', 'body': 'hello'})
+    text, _, _, _ = InboxRenderer().render(storage, 'a@example.com')
+    assert '…' not in text
+    assert text.endswith('\n\n')
+
+
+def test_unchanged_page_is_shown_at_any_version():
+    storage = MemoryStorage({}, MessageTracker())
+    renderer = InboxRenderer()
+    text, page, _, version = renderer.render(storage, 'a@example.com')
+    assert version == 0
+    renderer.mark_shown(1, 2, 'a@example.com', page, text)
+    assert renderer.is_shown(1, 2, 'a@example.com', page, renderer.render(storage, 'a@example.com')[0])
+    storage.add_email('a@example.com', {'subject': 'Hi', 'from': 'x@example.com', 'date': 'today', 'body': 'hello'})
+    text, page, _, _ = renderer.render(storage, 'a@example.com')
+    assert not renderer.is_shown(1, 2, 'a@example.com', page, text)
+    assert not renderer.is_shown(1, 3, 'a@example.com', page, text)
+
+
+def test_sqlite_inbox_has_a_version_after_restart(tmp_path):
+    path = str(tmp_path / 'mail.db')
+    storage = SQLiteStorage(path)
+    storage.add_email('a@example.com', {'subject': 'Hi', 'from': 'x@example.com', 'date': 'today', 'body': 'hello'})
+    storage.flush()
+    storage.close()
+    reopened = SQLiteStorage(path)
+    try:
+        assert reopened.inbox_version('a@example.com')
+        assert not reopened.inbox_version('b@example.com')
+    finally:
+        reopened.close()
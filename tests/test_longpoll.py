@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+from longpoll import InboxAPI, InboxWaiters, address_token
+from storage import MemoryStorage
+from tracking import MessageTracker
+
+SECRET = b'secret'
+ADDRESS = 'box@example.com'
+
+
+class SignallingWaiters(InboxWaiters):
+    """InboxWaiters that signal when a request starts waiting."""
+
+    def __init__(self):
+        super().__init__()
+        self.waiting = threading.Event()
+
+    def wait(self, address, predicate, timeout):
+        self.waiting.set()
+        return super().wait(address, predicate, timeout)
+
+
+def mail(subject):
+    return {'subject': subject, 'from': 'x@example.com', 'date': 'today', 'body': f"Your code is 1234 ({subject})"}
+
+
+@pytest.fixture
+def api():
+    waiters = SignallingWaiters()
+    storage = MemoryStorage({}, MessageTracker(), on_change=waiters.notify)
+    return InboxAPI(storage, waiters, lambda address: address == ADDRESS, SECRET)
+
+
+def test_returns_stored_messages_at_once(api):
+    api.storage.add_email(ADDRESS, mail('first'))
+    result, status = api.get('BOX@example.com', address_token(SECRET, ADDRESS), wait=30)
+    assert status == 200
+    assert [message['subject'] for message in result['messages']] == ['first']
+    assert result['messages'][0]['code'] == '1234'
+    assert result['since'] == result['messages'][0]['id']
+    assert not api.waiters.waiting.is_set()
+    assert api.get(ADDRESS, address_token(SECRET, ADDRESS), since=result['since']) == (
+        {'address': ADDRESS, 'messages': [], 'since': result['since']}, 200
+    )
+
+
+def test_waiting_request_wakes_on_new_mail(api):
+    results = []
+    thread = threading.Thread(target=lambda: results.append(api.get(ADDRESS, address_token(SECRET, ADDRESS), wait=30)))
+    thread.start()
+    assert api.waiters.waiting.wait(5)
+    api.storage.add_email(ADDRESS, mail('new'))
+    thread.join(5)
+    assert not thread.is_alive()
+    result, status = results[0]
+    assert status == 200
+    assert [message['subject'] for message in result['messages']] == ['new']
+    assert len(api.waiters) == 0
+
+
+def test_wait_times_out_empty(api):
+    api.max_wait = 0.05
+    result, status = api.get(ADDRESS, address_token(SECRET, ADDRESS), since=7, wait=30)
+    assert status == 200
+    assert result == {'address': ADDRESS, 'messages': [], 'since': 7}
+    assert api.waiters.waiting.is_set()
+    assert len(api.waiters) == 0
+
+
+def test_rejects_bad_token_unknown_address_and_too_many_waiters(api):
+    assert api.get(ADDRESS, 'x' * 32)[1] == 403
+    assert api.get(ADDRESS, address_token(b'other', ADDRESS))[1] == 403
+    assert api.get('other@example.com', address_token(SECRET, ADDRESS))[1] == 403
+    assert api.get('other@example.com', address_token(SECRET, 'other@example.com'))[1] == 404
+    api.max_waiters = 0
+    assert api.get(ADDRESS, address_token(SECRET, ADDRESS), wait=30) == ({'error': 'too_many_waiters'}, 503)
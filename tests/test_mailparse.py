@@ -0,0 +1,65 @@
+from email.message import EmailMessage
+
+from mailparse import html_to_text, iter_attachments, iter_decoded, parse_full, parse_preview, text_body
+
+HTML = (
+    '<html><head><title>Ignored</title><style>p {color: red}</style></head><body>'
+    '<p>Hello&nbsp;there,</p><p>Your code is <b>482913</b>.</p>'
+    '<a href="https://example.com/verify?t=abc">Confirm</a>'
+    '<script>alert(1)</script></body></html>'
+)
+
+
+def html_only():
+    msg = EmailMessage()
+    msg['Subject'] = 'Welcome'
+    msg.set_content(HTML, subtype='html')
+    return msg
+
+
+def nested():
+    msg = EmailMessage()
+    msg['Subject'] = 'Nested'
+    msg.set_content('Plain body with code 1234')
+    msg.add_alternative('<p>HTML body</p>', subtype='html')
+    msg.add_attachment(b'\x00' * 100, maintype='application', subtype='octet-stream', filename='a.bin')
+    outer = EmailMessage()
+    outer['Subject'] = 'Outer'
+    outer.make_mixed()
+    outer.attach(msg)
+    return outer
+
+
+def test_html_to_text_keeps_visible_text_and_links():
+    assert html_to_text(HTML) == (
+        "Hello there,\nYour code is 482913.\nConfirm (https://example.com/verify?t=abc)"
+    )
+    # A link whose text already shows the URL is not repeated
+    assert html_to_text('<a href="https://a.example">https://a.example</a>') == 'https://a.example'
+    assert html_to_text('<a href="javascript:x()">Click</a>') == 'Click'
+
+
+def test_html_only_body_in_both_modes():
+    raw = html_only().as_bytes()
+    assert text_body(parse_full(raw)) == html_to_text(HTML)
+    headers, text = parse_preview(raw)
+    assert headers['subject'] == 'Welcome'
+    assert text == html_to_text(HTML)
+
+
+def test_nested_multipart_prefers_text_and_finds_attachments():
+    raw = nested().as_bytes()
+    assert text_body(parse_full(raw)).strip() == 'Plain body with code 1234'
+    assert parse_preview(raw)[1].strip() == 'Plain body with code 1234'
+    assert parse_preview(raw, limit=5)[1] == 'Plain'
+    attachments = list(iter_attachments(raw))
+    assert [headers.get_filename() for headers, _, _ in attachments] == ['a.bin']
+    headers, start, end = attachments[0]
+    assert b''.join(iter_decoded(raw, start, end, headers, chunk_size=16)) == b'\x00' * 100
+
+
+def test_plain_message_has_no_attachments():
+    msg = EmailMessage()
+    msg.set_content('hi')
+    assert list(iter_attachments(msg.as_bytes())) == []
+    assert parse_preview(msg.as_bytes())[1].strip() == 'hi'
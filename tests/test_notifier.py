@@ -0,0 +1,79 @@
+import threading
+
+from notifier import Notifier, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Message:
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+class HeldBot:
+    """Bot whose sends block until ``release`` is set."""
+
+    def __init__(self):
+        self.calls = []
+        self.sending = threading.Event()
+        self.release = threading.Event()
+        self.edited = threading.Event()
+
+    def send_message(self, chat_id, text, parse_mode=None):
+        self.sending.set()
+        self.release.wait(5)
+        self.calls.append(('send', text))
+        return Message(1)
+
+    def edit_message_text(self, text, chat_id, message_id, parse_mode=None):
+        self.calls.append(('edit', text))
+        self.edited.set()
+        return Message(message_id)
+
+
+class CountingBucket(TokenBucket):
+    def __init__(self, clock):
+        super().__init__(1000, clock=clock)
+        self.taken = 0
+
+    def acquire(self):
+        self.taken += 1
+        super().acquire()
+
+
+def test_burst_waits_for_the_send_in_flight_without_spending_tokens():
+    clock = Clock()
+    bucket = CountingBucket(clock)
+    notifier = Notifier(workers=4, coalesce_window=5, clock=clock, bucket=bucket)
+    bot = HeldBot()
+    notifier.start(bot)
+    try:
+        notifier.enqueue(1, "mail 0", email='a@example.com', summary="summary 0")
+        assert bot.sending.wait(5)
+        # The digest edit is due while the first message is still being sent
+        clock.now += 1
+        for i in range(1, 5):
+            notifier.enqueue(1, f"mail {i}", email='a@example.com', summary=f"summary {i}")
+        bot.release.set()
+        assert bot.edited.wait(5)
+        assert bot.calls == [('send', "mail 0"), ('edit', notifier.digest([f"summary {i}" for i in range(5)]))]
+        assert bucket.taken == 2
+    finally:
+        notifier.stop()
+
+
+def test_try_acquire_does_not_wait():
+    clock = Clock()
+    bucket = TokenBucket(1, 2, clock=clock)
+    assert bucket.try_acquire()
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+    clock.now += 1
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
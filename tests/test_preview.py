@@ -0,0 +1,43 @@
+from preview import SNIPPET_CHARS, build_preview, escape_markdown, find_code, find_link, preview_of
+
+
+def record(subject='Hello', body='', sender='a_b@example.com'):
+    return {'subject': subject, 'from': sender, 'date': 'today', 'body': body}
+
+
+def test_find_code():
+    assert find_code('Your verification code is 482913') == '482913'
+    assert find_code('OTP: 1234.') == '1234'
+    assert find_code('654321 is your login code') == '654321'
+    assert find_code('Order 12345678901 shipped') is None
+    assert find_code('Welcome', 'Use code 9876 to sign in') == '9876'
+
+
+def test_find_link():
+    body = (
+        'Read our blog at https://example.com/blog.\n'
+        'Confirm your address: https://example.com/confirm?token=abc123.'
+    )
+    assert find_link(body) == 'https://example.com/confirm?token=abc123'
+    assert find_link('Visit https://example.com/news') is None
+
+
+def test_build_preview_strips_links_and_escapes():
+    preview = build_preview(record(
+        subject='Your *code*',
+        body='Click https://example.com/verify?t=1 to go on.\n\n' + 'word ' * 100,
+    ))
+    assert 'https://' not in preview['text']
+    assert preview['text'].startswith('Click to go on. word')
+    assert len(preview['text']) == SNIPPET_CHARS + 1 and preview['text'].endswith('…')
+    assert preview['link'] == 'https://example.com/verify?t=1'
+    assert preview['subject_md'] == 'Your \\*code\\*'
+    assert preview['from_md'] == 'a\\_b@example.com'
+    assert preview['subject_html'] == 'Your *code*'
+    assert escape_markdown('[x]_`y`') == '\\[x]\\_\\`y\\`'
+
+
+def test_preview_of_prefers_the_stored_preview():
+    stored = dict(record(body='code 1234'), preview={'text': 'stored'})
+    assert preview_of(stored) == {'text': 'stored'}
+    assert preview_of(record(body='code 1234'))['code'] == '1234'
@@ -0,0 +1,76 @@
+import socket
+import threading
+
+import pytest
+import requests
+
+import push
+from push import PublicAddressAdapter, check_url
+
+
+def resolving_to(monkeypatch, *addresses):
+    def getaddrinfo(host, port, *args, **kwargs):
+        family = socket.AF_INET6 if ':' in addresses[0] else socket.AF_INET
+        return [(family, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (address, port)) for address in addresses]
+    monkeypatch.setattr(push.socket, 'getaddrinfo', getaddrinfo)
+
+
+@pytest.mark.parametrize('url', ['ftp://example.com/hook', 'example.com/hook', 'http:///hook', 'javascript:alert(1)'])
+def test_refuses_other_schemes(url):
+    assert check_url(url, allow_private=True) == "The URL must start with http:// or https://"
+
+
+def test_accepts_public_address(monkeypatch):
+    resolving_to(monkeypatch, '93.184.216.34')
+    assert check_url('https://example.com/hook') is None
+
+
+@pytest.mark.parametrize('address', [
+    '127.0.0.1', '10.1.2.3', '172.16.0.1', '192.168.1.1', '169.254.169.254', '0.0.0.0', '100.64.0.1',
+    '::1', 'fe80::1%eth0', 'fd00::1', '::ffff:127.0.0.1',
+])
+def test_refuses_private_addresses(monkeypatch, address):
+    resolving_to(monkeypatch, address)
+    assert check_url('http://internal.example.com/hook') == "internal.example.com is not a public address"
+    assert check_url('http://internal.example.com/hook', allow_private=True) is None
+
+
+def test_refuses_if_any_address_is_private(monkeypatch):
+    resolving_to(monkeypatch, '93.184.216.34', '10.0.0.1')
+    assert check_url('http://example.com/hook') is not None
+
+
+def test_refuses_unresolvable_host(monkeypatch):
+    def getaddrinfo(*args, **kwargs):
+        raise socket.gaierror('Name or service not known')
+    monkeypatch.setattr(push.socket, 'getaddrinfo', getaddrinfo)
+    assert check_url('http://nowhere.invalid/hook') == "Cannot resolve nowhere.invalid"
+
+
+@pytest.fixture
+def listener():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen()
+    accepted = []
+
+    def accept():
+        try:
+            while True:
+                accepted.append(server.accept()[0])
+        except OSError:
+            pass
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield f"http://127.0.0.1:{server.getsockname()[1]}/hook"
+    server.close()
+    for conn in accepted:
+        conn.close()
+
+
+def test_adapter_refuses_private_peer(listener):
+    # What a host that passed check_url and was then rebound to 127.0.0.1 would connect to
+    session = requests.Session()
+    session.mount('http://', PublicAddressAdapter())
+    with pytest.raises(requests.ConnectionError, match='not a public address'):
+        session.post(listener, data=b'{}', timeout=5)
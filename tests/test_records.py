@@ -0,0 +1,45 @@
+import pytest
+
+from records import COMPRESS_THRESHOLD, StoredEmail
+
+
+def record(body, raw=None):
+    return {'subject': 'Hello', 'from': 'sender@example.com', 'date': 'today', 'body': body, 'raw': raw}
+
+
+@pytest.mark.parametrize('size', [0, 10, COMPRESS_THRESHOLD - 1, COMPRESS_THRESHOLD, COMPRESS_THRESHOLD * 10])
+def test_body_and_raw_round_trip(size):
+    body = ('é' + 'x' * size)[:size]
+    raw = b'R' * size
+    stored = StoredEmail(record(body, raw))
+    assert stored.body == body
+    assert stored.raw == raw
+    assert stored['body'] == body
+    assert stored.get('raw') == raw
+
+
+@pytest.mark.parametrize('value', ['short', 'long ' * COMPRESS_THRESHOLD, b'short', b'long ' * COMPRESS_THRESHOLD])
+def test_raw_round_trips_str_and_bytes(value):
+    stored = StoredEmail(record('body', value))
+    assert stored.raw == value
+    assert type(stored.raw) is type(value)
+    assert 'raw' in stored
+
+
+def test_missing_raw():
+    stored = StoredEmail(record('body'))
+    assert stored.raw is None
+    assert 'raw' not in stored
+
+
+def test_setters_recompress():
+    stored = StoredEmail(record('x'))
+    stored['body'] = 'y' * (COMPRESS_THRESHOLD * 2)
+    stored['parsed'] = True
+    assert stored.body == 'y' * (COMPRESS_THRESHOLD * 2)
+    assert stored.get('parsed') is True
+
+
+def test_long_values_are_compressed():
+    stored = StoredEmail(record('z' * COMPRESS_THRESHOLD * 10, b'z' * COMPRESS_THRESHOLD * 10))
+    assert stored.size < COMPRESS_THRESHOLD * 2
@@ -0,0 +1,61 @@
+from registry import AddressRegistry
+
+
+class Filter:
+    def __init__(self):
+        self.items = set()
+
+    def add(self, item):
+        self.items.add(item)
+
+    def discard(self, item):
+        self.items.discard(item)
+
+
+def test_lookup_ignores_case_and_whitespace():
+    registry = AddressRegistry()
+    assert registry.assign(1, ' Box@Example.COM ') == 'box@example.com'
+    assert registry.owners('BOX@example.com') == [1]
+    assert registry.is_live('box@EXAMPLE.com')
+    assert registry.current(1) == 'box@example.com'
+    assert registry.release(1, 'Box@Example.com') == 'box@example.com'
+    assert not registry.is_live('box@example.com')
+    assert 1 not in registry
+
+
+def test_fresh_assign_refuses_taken_address():
+    registry = AddressRegistry()
+    assert registry.assign(1, 'box@example.com', fresh=True) == 'box@example.com'
+    assert registry.assign(2, 'BOX@example.com', fresh=True) is None
+    assert registry.owners('box@example.com') == [1]
+    assert 2 not in registry
+    # Without fresh the address is shared
+    assert registry.assign(2, 'box@example.com') == 'box@example.com'
+    assert registry.owners('box@example.com') == [1, 2]
+
+
+def test_current_is_most_recently_assigned():
+    registry = AddressRegistry()
+    registry.assign(1, 'a@example.com')
+    registry.assign(1, 'b@example.com')
+    assert registry.current(1) == 'b@example.com'
+    registry.assign(1, 'A@example.com')
+    assert registry.addresses(1) == ['b@example.com', 'a@example.com']
+    assert registry.release(1) == 'a@example.com'
+    assert registry.current(1) == 'b@example.com'
+
+
+def test_filter_follows_live_addresses():
+    registry = AddressRegistry()
+    registry.assign(1, 'a@example.com')
+    live = Filter()
+    registry.attach_filter(live)
+    assert live.items == {'a@example.com'}
+    registry.assign(2, 'a@example.com')
+    registry.assign(2, 'b@example.com')
+    registry.release(1)
+    assert live.items == {'a@example.com', 'b@example.com'}
+    assert registry.release_address('A@example.com') == [2]
+    assert live.items == {'b@example.com'}
+    assert registry.addresses(2) == ['b@example.com']
+    assert len(registry) == 1
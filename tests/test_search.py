@@ -0,0 +1,78 @@
+from search import SearchIndex, tokenize
+
+
+def mail(subject, body='', sender='someone@example.com'):
+    return {'subject': subject, 'from': sender, 'body': body}
+
+
+class Loader:
+    """Stored inboxes to rebuild from, as storage would pass them."""
+
+    def __init__(self):
+        self.inboxes = {}
+        self.loaded = []
+
+    def add(self, index, address, record):
+        self.inboxes.setdefault(address, []).append(record)
+        index.add(address, record)
+
+    def __call__(self, address, install):
+        self.loaded.append(address)
+        install(self.inboxes.get(address, []))
+
+
+def test_subject_ranks_above_body():
+    index = SearchIndex()
+    index.add('a@example.com', mail('Weekly report', body='invoice attached'))
+    index.add('a@example.com', mail('Your invoice', body='thanks'))
+    index.add('a@example.com', mail('Hello', body='nothing here'))
+    assert index.search('a@example.com', 'INVOICE') == [1, 0]
+    assert index.search('a@example.com', 'invoice report') == [0]
+    assert index.search('a@example.com', 'missing') == []
+    assert index.search('b@example.com', 'invoice') == []
+    assert tokenize('a Bc déjà') == ['bc', 'déjà']
+
+
+def test_trim_keeps_positions_relative_to_the_oldest_message():
+    index = SearchIndex()
+    for i in range(5):
+        index.add('a@example.com', mail(f"code {i}"))
+    index.trim('a@example.com', 3)
+    assert sorted(index.search('a@example.com', 'code')) == [0, 1, 2]
+    assert index.search('a@example.com', '4') == []  # single characters are not indexed
+    index.add('a@example.com', mail('newest'))
+    index.trim('a@example.com', 3)
+    assert index.search('a@example.com', 'newest') == [2]
+
+
+def test_least_recently_used_inbox_is_evicted_past_the_postings_bound():
+    loader = Loader()
+    index = SearchIndex(max_postings=5, loader=loader)
+    loader.add(index, 'a@example.com', mail('alpha bravo', sender='x'))
+    loader.add(index, 'b@example.com', mail('charlie delta', sender='x'))
+    assert len(index) == 2
+    loader.add(index, 'c@example.com', mail('echo foxtrot', sender='x'))
+    assert index.postings <= 5
+    assert len(index) == 2
+    # Mail for an evicted inbox is not indexed; the whole inbox is rebuilt when searched
+    loader.add(index, 'a@example.com', mail('golf alpha', sender='x'))
+    assert index.search('a@example.com', 'alpha') == [1, 0]
+    assert loader.loaded == ['a@example.com']
+    assert index.postings <= 5
+
+
+def test_stale_inbox_is_rebuilt_from_storage():
+    loader = Loader()
+    index = SearchIndex(loader=loader)
+    loader.add(index, 'a@example.com', mail('first'))
+    loader.add(index, 'a@example.com', mail('second'))
+    # Storage deleted the first message outside the oldest-first order
+    del loader.inboxes['a@example.com'][0]
+    index.mark_stale(['a@example.com'])
+    assert index.search('a@example.com', 'first') == []
+    assert index.search('a@example.com', 'second') == [0]
+    assert loader.loaded == ['a@example.com']
+    assert index.search('a@example.com', 'second') == [0]
+    assert loader.loaded == ['a@example.com']
+    index.delete('a@example.com')
+    assert len(index) == 0 and index.postings == 0
@@ -0,0 +1,78 @@
+import pytest
+
+from coordination import SQLiteCoordinator
+from sharding import BUCKETS, Cluster, HashRing, LOCAL_PART_LENGTH, address_tag, shard_key
+
+KEYS = [f"user{i}@example.com" for i in range(5000)]
+
+
+def owners(ring):
+    return {key: ring.owner(key) for key in KEYS}
+
+
+def test_adding_a_node_only_moves_keys_to_it():
+    before = owners(HashRing(['a', 'b', 'c']))
+    after = owners(HashRing(['a', 'b', 'c', 'd']))
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == 'd' for key in moved)
+    assert 0.15 < len(moved) / len(KEYS) < 0.35
+
+
+def test_removing_a_node_only_moves_its_keys():
+    before = owners(HashRing(['a', 'b', 'c']))
+    after = owners(HashRing(['a', 'b']))
+    for key in KEYS:
+        if before[key] != 'c':
+            assert after[key] == before[key]
+
+
+def test_empty_ring_has_no_owner():
+    assert HashRing().owner('x@example.com') is None
+
+
+def test_tagged_address_maps_to_its_user():
+    for user_id in (1, 42, 123456789, -100):
+        address = f"{'k' * LOCAL_PART_LENGTH}{address_tag(user_id)}@example.com"
+        assert shard_key(address) == shard_key(user_id)
+        assert shard_key(address.upper()) == shard_key(user_id)
+    assert len({shard_key(user_id) for user_id in range(20000)}) == BUCKETS
+
+
+def test_other_addresses_map_to_themselves():
+    assert shard_key('Legacy1234@Example.com') == 'legacy1234@example.com'
+    assert shard_key('kkkkkkkkkk!!@example.com') == 'kkkkkkkkkk!!@example.com'
+
+
+@pytest.fixture
+def coordinator(tmp_path):
+    return SQLiteCoordinator(str(tmp_path / 'leases.db'))
+
+
+def test_cluster_settles_after_members_change(coordinator):
+    first = Cluster(coordinator, 'a', '127.0.0.1:1', 'secret', ttl=3, on_change=lambda: True, grace=60)
+    second = Cluster(coordinator, 'b', '127.0.0.1:2', 'secret', ttl=3, grace=0)
+    try:
+        first.start()
+        first.changed_at -= 120
+        assert not first.settling()
+        second.start()
+        first.refresh()
+        assert first.ring.nodes == {'a', 'b'}
+        assert first.settling()
+        assert first._pending
+        user_id = next(user_id for user_id in range(1000) if first.owner(user_id) == 'b')
+        address = f"{'k' * LOCAL_PART_LENGTH}{address_tag(user_id)}@example.com"
+        assert first.owner(address) == second.owner(address) == 'b'
+        assert not first.owns(address)
+    finally:
+        second.stop()
+        first.stop()
+
+
+def test_failed_acquire_rolls_back(coordinator):
+    with pytest.raises(TypeError):
+        coordinator.acquire('lease', 'a', 60, data=object())
+    assert coordinator.leases() == {}
+    assert coordinator.acquire('lease', 'b', 60)
+    assert not coordinator.acquire('lease', 'a', 60)
+    assert coordinator.leases() == {'lease': ('b', None)}
@@ -0,0 +1,98 @@
+import os
+import time
+
+import pytest
+
+from spool import AttachmentSpool
+
+
+@pytest.fixture
+def root(tmp_path):
+    return str(tmp_path / 'spool')
+
+
+def meta(digest):
+    return [{'name': 'a.txt', 'type': 'text/plain', 'size': 1, 'sha256': digest}]
+
+
+def age(spool, digest, seconds=7200):
+    past = time.time() - seconds
+    os.utime(spool._content_path(digest), (past, past))
+
+
+def test_put_deduplicates(root):
+    spool = AttachmentSpool(root)
+    first, size = spool.put([b'hello ', b'world'])
+    second, _ = spool.put([b'hello world'])
+    assert first == second
+    assert size == 11
+    with open(spool.path(first), 'rb') as f:
+        assert f.read() == b'hello world'
+
+
+def test_release_deletes_after_last_reference(root):
+    spool = AttachmentSpool(root, grace=0)
+    digest, _ = spool.put([b'data'])
+    spool.retain(meta(digest))
+    spool.retain(meta(digest))
+    spool.release(meta(digest))
+    assert os.path.exists(spool.path(digest))
+    spool.release(meta(digest))
+    assert not os.path.exists(spool.path(digest))
+    assert len(spool) == 0
+
+
+def test_release_keeps_files_other_nodes_reference(root):
+    a = AttachmentSpool(root, node='a', grace=0)
+    b = AttachmentSpool(root, node='b', grace=0)
+    digest, _ = a.put([b'shared'])
+    a.retain(meta(digest))
+    b.retain(meta(digest))
+    a.release(meta(digest))
+    with open(b.path(digest), 'rb') as f:
+        assert f.read() == b'shared'
+    b.release(meta(digest))
+    assert not os.path.exists(b.path(digest))
+
+
+def test_release_keeps_young_unreferenced_files(root):
+    spool = AttachmentSpool(root)
+    digest, _ = spool.put([b'just written'])
+    spool.discard(meta(digest))
+    assert os.path.exists(spool.path(digest))
+    age(spool, digest)
+    spool.sweep()
+    assert not os.path.exists(spool.path(digest))
+
+
+def test_rebuild_only_drops_this_nodes_links(root):
+    a = AttachmentSpool(root, node='a')
+    b = AttachmentSpool(root, node='b')
+    kept, _ = a.put([b'kept by a'])
+    other, _ = b.put([b'kept by b'])
+    orphan, _ = a.put([b'orphan'])
+    a.retain(meta(kept) + meta(orphan))
+    b.retain(meta(other))
+    for digest in (kept, other, orphan):
+        age(a, digest)
+    tmp = os.path.join(root, 'incoming.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(b'in flight')
+    os.utime(tmp, (0, 0))
+
+    # Restart of node a, whose storage now only references ``kept``
+    restarted = AttachmentSpool(root, node='a')
+    restarted.rebuild([meta(kept)])
+    assert len(restarted) == 1
+    assert os.path.exists(restarted.path(kept))
+    assert os.path.exists(b.path(other))
+    assert not os.path.exists(restarted.path(orphan))
+    assert os.path.exists(tmp)
+
+
+def test_rebuild_relinks_referenced_files(root):
+    spool = AttachmentSpool(root, grace=0)
+    digest, _ = spool.put([b'stored'])
+    AttachmentSpool(root, grace=0).rebuild([meta(digest)])
+    spool.sweep()
+    assert os.path.exists(spool.path(digest))
@@ -0,0 +1,34 @@
+import sqlite3
+
+from storage import SQLiteStorage
+
+
+def test_sqlite_delete_changes_version_once_committed(tmp_path):
+    changes = []
+    storage = SQLiteStorage(str(tmp_path / 'mail.db'), on_change=changes.append)
+    try:
+        storage.add_email('a@example.com', {'subject': 'Hi', 'from': 'x@example.com', 'date': 'today', 'body': 'hi'})
+        storage.flush()
+        version = storage.inbox_version('a@example.com')
+        changes.clear()
+        storage.delete_inbox('a@example.com')
+        storage.flush()
+        assert storage.get_emails('a@example.com') == []
+        assert storage.inbox_version('a@example.com') not in (0, version)
+        assert changes == ['a@example.com']
+    finally:
+        storage.close()
+
+
+def test_sqlite_tracking_keeps_the_newest_entries(tmp_path):
+    path = str(tmp_path / 'mail.db')
+    storage = SQLiteStorage(path, tracking_max_entries=20)
+    try:
+        for message_id in range(100):
+            storage.track_message(1, message_id, 'help')
+        storage.flush()
+    finally:
+        storage.close()
+    with sqlite3.connect(path) as conn:
+        kept = [row[0] for row in conn.execute('SELECT message_id FROM message_tracking ORDER BY message_id')]
+    assert kept == list(range(80, 100))
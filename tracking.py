@@ -0,0 +1,106 @@
+import collections
+import sys
+import threading
+import time
+
+# Message types are stored as small integers instead of repeated strings
+MESSAGE_TYPES = (
+    'email_notification', 'email_generation', 'inbox_view', 'read_email', 'no_message',
+    'edit_notification', 'delete_notification', 'current_email', 'no_email',
+    'email_deletion', 'stats', 'no_stats', 'forwarding_info', 'extension',
+    'privacy_tips', 'help', 'attachment', 'search', 'rate_limited', 'api_access',
+)
+_type_tags = {name: tag for tag, name in enumerate(MESSAGE_TYPES)}
+
+
+def type_tag(msg_type):
+    """Return the integer tag of a message type, registering new types on first use."""
+    tag = _type_tags.get(msg_type)
+    if tag is None:
+        tag = _type_tags.setdefault(msg_type, len(_type_tags))
+    return tag
+
+
+def type_name(tag):
+    for name, value in _type_tags.items():
+        if value == tag:
+            return name
+    return None
+
+
+class TrackedMessage:
+    __slots__ = ('tag', 'email', 'original_message_id', 'touched')
+
+    def __init__(self, tag, email, original_message_id, touched):
+        self.tag = tag
+        self.email = email
+        self.original_message_id = original_message_id
+        self.touched = touched
+
+    @property
+    def type(self):
+        return type_name(self.tag)
+
+
+class MessageTracker:
+    """Bounded record of the messages the bot has sent.
+
+    Entries are keyed by (chat_id, message_id), packed into one integer,
+    and kept in an OrderedDict in least-recently-used order. Inserting past
+    ``max_entries`` evicts the least recently used entry, and entries not
+    touched for ``ttl`` seconds are dropped from the cold end as new ones
+    arrive, so no sweep over all entries is ever needed.
+    """
+
+    def __init__(self, max_entries=100000, ttl=48 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(chat_id, message_id):
+        # Message ids are 32-bit and unique only within their chat
+        return (chat_id << 32) | message_id
+
+    def track(self, chat_id, message_id, msg_type, email=None, original_message_id=None):
+        now = time.time()
+        if email is not None:
+            email = sys.intern(email)
+        record = TrackedMessage(type_tag(msg_type), email, original_message_id, now)
+        key = self._key(chat_id, message_id)
+        with self._lock:
+            self._entries[key] = record
+            self._entries.move_to_end(key)
+            self._evict(now)
+
+    def get(self, chat_id, message_id):
+        key = self._key(chat_id, message_id)
+        with self._lock:
+            record = self._entries.get(key)
+            if record is None:
+                return None
+            if record.touched + self.ttl < time.time():
+                del self._entries[key]
+                return None
+            record.touched = time.time()
+            self._entries.move_to_end(key)
+            return record
+
+    def pop(self, chat_id, message_id):
+        with self._lock:
+            return self._entries.pop(self._key(chat_id, message_id), None)
+
+    def _evict(self, now):
+        entries = self._entries
+        while len(entries) > self.max_entries:
+            entries.popitem(last=False)
+        cutoff = now - self.ttl
+        while entries:
+            oldest = next(iter(entries.values()))
+            if oldest.touched >= cutoff:
+                break
+            entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,116 @@
+"""HTTP front end: health, metrics, the Telegram webhook and the inbox API.
+
+Holds no state of its own, so it can run as many processes as needed
+(``gunicorn -c gunicorn_config.py web:app``) and restart freely; webhook
+updates are handed to the bot process over UPDATE_QUEUE_ADDRESS. The
+inbox API needs the inboxes, so it is only served where the bot process
+installs it with ``set_inbox_api``.
+"""
+import hmac
+import logging
+import sys
+
+from flask import Flask, request, jsonify
+
+import metrics
+import webhook
+from ingest import RemoteIngest
+from settings import WEBHOOK_PATH, WEBHOOK_SECRET, UPDATE_QUEUE_ADDRESS, MAIL_QUEUE_ADDRESS, MAIL_QUEUE_SECRET, PORT
+
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+# Admission state; the bot process installs its own when it serves HTTP itself
+_status = None
+
+
+def set_status(func):
+    global _status
+    _status = func
+
+
+# Admission state of a separate bot process, polled over MAIL_QUEUE_ADDRESS
+_bot_process = RemoteIngest(MAIL_QUEUE_ADDRESS, MAIL_QUEUE_SECRET) if MAIL_QUEUE_SECRET else None
+
+
+def remote_status():
+    """Admission state for the web role, which has none of its own."""
+    if _bot_process is None:
+        return {'status': 'unknown', 'reason': None, 'role': 'web', 'gauges': {}}
+    reason = _bot_process.overloaded()
+    return {'status': 'overloaded' if reason else 'ok', 'reason': reason, 'role': 'web', 'gauges': {}}
+
+
+# Inbox reads, installed by the bot process: (address, token, since, wait) -> (body, status)
+_inbox_api = None
+
+
+def set_inbox_api(func):
+    global _inbox_api
+    _inbox_api = func
+
+
+@app.route('/')
+def home():
+    return "Bot is running!"
+
+
+@app.route('/monitor/status')
+def monitor_status():
+    """Health check: 503 while the SMTP front door is refusing mail."""
+    status = _status() if _status else remote_status()
+    return jsonify(status), 503 if status['reason'] else 200
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    body, content_type = metrics.render()
+    return body, 200, {'Content-Type': content_type}
+
+
+@app.route(WEBHOOK_PATH, methods=['POST'])
+def telegram_webhook():
+    """Receive an update from Telegram and queue it for the dispatcher."""
+    token = request.headers.get(webhook.SECRET_HEADER, '')
+    if not WEBHOOK_SECRET or not hmac.compare_digest(token, WEBHOOK_SECRET):
+        return "Forbidden", 403
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        return "Bad Request", 400
+    if not webhook.forward_update(data, UPDATE_QUEUE_ADDRESS, WEBHOOK_SECRET):
+        # Telegram retries the update later
+        return "Service Unavailable", 503
+    return "OK"
+
+
+@app.route('/api/inbox/<address>')
+def api_inbox(address):
+    """Messages newer than ``since``, waiting up to ``wait`` seconds for the next one."""
+    if _inbox_api is None:
+        return jsonify({'error': 'not_served_here'}), 404
+    token = request.headers.get('Authorization', '')
+    token = token[len('Bearer '):] if token.startswith('Bearer ') else request.args.get('token', '')
+    since = request.args.get('since', 0, type=int)
+    wait = request.args.get('wait', 0, type=float)
+    body, status = _inbox_api(address, token, since, wait)
+    return jsonify(body), status
+
+
+def run_flask(port=PORT):
+    """Run Flask server in a separate thread."""
+    try:
+        # Threaded, so requests waiting on the inbox API do not hold up others
+        app.run(host='0.0.0.0', port=port, threaded=True)
+    except Exception as e:
+        logger.error(f"Error running Flask server: {str(e)}")
+        sys.exit(1)
+
+
+def main():
+    """Run the web role with Flask's own server."""
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    run_flask()
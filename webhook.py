@@ -0,0 +1,87 @@
+import logging
+import queue
+import threading
+from multiprocessing.managers import BaseManager
+
+logger = logging.getLogger(__name__)
+
+# Header Telegram sends with every webhook request when a secret token is set
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Update types the bot handles, for both polling and webhooks
+ALLOWED_UPDATES = ['message', 'edited_message', 'callback_query']
+
+# Raw update dicts received over HTTP, waiting for the dispatcher
+update_queue = queue.Queue(maxsize=10000)
+
+_serving = False
+_remote_queue = None
+_remote_lock = threading.Lock()
+
+
+class UpdateQueueManager(BaseManager):
+    """Shares ``update_queue`` of the bot process with gunicorn workers."""
+
+
+UpdateQueueManager.register('get_queue', callable=lambda: update_queue)
+
+
+def parse_address(address):
+    """Turn 'host:port' into a tuple; anything else is a Unix socket path."""
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def serve_update_queue(address, authkey):
+    """Accept updates forwarded by other processes (gunicorn workers)."""
+    global _serving
+    manager = UpdateQueueManager(address=parse_address(address), authkey=authkey.encode())
+    server = manager.get_server()
+    thread = threading.Thread(target=server.serve_forever, name='update-queue-server', daemon=True)
+    thread.start()
+    _serving = True
+    logger.info(f"Serving webhook update queue on {address}")
+
+
+def _connect(address, authkey):
+    global _remote_queue
+    with _remote_lock:
+        if _remote_queue is None:
+            manager = UpdateQueueManager(address=parse_address(address), authkey=authkey.encode())
+            manager.connect()
+            _remote_queue = manager.get_queue()
+        return _remote_queue
+
+
+def forward_update(data, address, authkey):
+    """Queue a raw update for the dispatcher. Returns False if it was dropped."""
+    global _remote_queue
+    try:
+        target = update_queue if _serving else _connect(address, authkey)
+        target.put_nowait(data)
+        return True
+    except queue.Full:
+        logger.error("Webhook update queue is full, dropping update")
+        return False
+    except Exception as e:
+        # Reconnect on the next request, e.g. after the bot process restarted
+        _remote_queue = None
+        logger.error(f"Error forwarding update to bot process: {str(e)}")
+        return False
+
+
+def pump_updates(dispatcher, de_json):
+    """Move updates from ``update_queue`` into the dispatcher. Runs in a thread."""
+    while True:
+        data = update_queue.get()
+        try:
+            dispatcher.update_queue.put(de_json(data, dispatcher.bot))
+        except Exception as e:
+            logger.error(f"Error decoding webhook update: {str(e)}")
+
+
+def start_pump(dispatcher, de_json):
+    thread = threading.Thread(target=pump_updates, args=(dispatcher, de_json), name='webhook-pump', daemon=True)
+    thread.start()